@@ -0,0 +1,443 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Times the generate, display and export hot paths separately, and prints
+the results as JSON so they can be compared between releases:
+
+    python -m gif_for_cli.benchmark --frames 20 --output before.json
+"""
+import argparse
+from collections import OrderedDict
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from . import __version__
+from .constants import CODECS, DISPLAY_MODES, DITHER_MODES
+from .display import display_txt_frames, get_txt_frames
+from .export import (
+    MARKUP_EXPORT_FORMATS,
+    PALETTE_DISPLAY_MODES,
+    export_txt_frame,
+    render_markup,
+    render_palette_frame,
+)
+from .generate import (
+    _extract_with_pil,
+    _run_ffmpeg,
+    convert_frame,
+    get_decoder,
+    reset_written_digests,
+)
+from .generate.color import get_256_indexes
+from .generate.utils import (
+    get_gray_histogram,
+    get_nocolor_table,
+    get_256_cell,
+    get_256fgbg_cell,
+    get_truecolor_cell,
+    get_avg_for_em,
+)
+from .generate.x256fgbg_utils import top_2_colors
+from .storage import get_frame_filename, read_frame, write_frame
+from .utils import get_output_dirnames, get_sorted_filenames
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows.
+    resource = None
+
+
+CELL_FUNCTIONS = {
+    '256': get_256_cell,
+    '256fgbg': get_256fgbg_cell,
+    'truecolor': get_truecolor_cell,
+}
+
+
+class _NullSink(object):
+    """
+    A stdout replacement that only counts how many bytes were written.
+    """
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, s):
+        self.bytes_written += len(s.encode('utf8'))
+
+    def flush(self):
+        pass
+
+
+def _get_peak_rss():
+    """
+    The most memory the process has used since it started, not just during
+    the stage that was timed last.
+    """
+    if resource is None:  # pragma: no cover
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, everything else kilobytes.
+    if sys.platform == 'darwin':  # pragma: no cover
+        return peak_rss
+    return peak_rss * 1024
+
+
+def _time_stage(results, name, num_frames, num_cells, f, *args):
+    start = time.perf_counter()
+    ret = f(*args)
+    seconds = time.perf_counter() - start
+
+    results[name] = OrderedDict([
+        ('seconds', seconds),
+        ('frames_per_second', num_frames / seconds if seconds else None),
+        ('cells_per_second', num_cells / seconds if seconds else None),
+        ('cumulative_peak_rss_bytes', _get_peak_rss()),
+    ])
+    return ret
+
+
+def make_synthetic_clip(filename, jpg_dirname, num_frames, width, height):
+    """
+    Draws a moving gradient with a bouncing ball, saved both as a GIF (for
+    ffmpeg) and as already extracted JPEGs.
+    """
+    frames = []
+    for i in range(num_frames):
+        im = Image.new('RGB', (width, height,))
+        draw = ImageDraw.Draw(im)
+        for x in range(width):
+            draw.line(
+                [(x, 0,), (x, height,)],
+                fill=(x * 255 // width, (x + i * 8) % 256, 255 - x * 255 // width,),
+            )
+        radius = height // 4
+        cx = radius + (width - 2 * radius) * i // max(num_frames - 1, 1)
+        draw.ellipse(
+            [(cx - radius, height // 2 - radius,), (cx + radius, height // 2 + radius,)],
+            fill=(255, 255, 255,),
+        )
+        frames.append(im)
+        im.save('{}/{:04d}.jpg'.format(jpg_dirname, i + 1))
+
+    frames[0].save(filename, save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+
+def _make_area_scaled_frames(src_dirname, dest_dirname, frame_names, cell_width, cell_height):
+    for frame_name in frame_names:
+        with Image.open('{}/{}.jpg'.format(src_dirname, frame_name)) as img:
+            img.resize(
+                (img.size[0] // cell_width, img.size[1] // cell_height,), Image.BOX,
+            ).save('{}/{}.jpg'.format(dest_dirname, frame_name), quality=95, subsampling=0)
+
+
+def _average_cells(pixel_access, cell_width, cell_height):
+    colors = []
+    for px, width, height in pixel_access:
+        for y in range(0, height - (height % cell_height), cell_height):
+            for x in range(0, width - (width % cell_width), cell_width):
+                colors.append(get_avg_for_em(px, x, y, cell_height, cell_width))
+    return colors
+
+
+def _top_2_colors(colors):
+    for rgb in colors:
+        top_2_colors(*rgb)
+
+
+def _map_cells(cell_function, colors):
+    cell_function.cache_clear()
+    for rgb in colors:
+        cell_function(*rgb)
+
+
+def _map_nocolor_cells(colors):
+    nocolor_table = get_nocolor_table(get_gray_histogram([colors]))
+    for r, g, b in colors:
+        nocolor_table[r + g + b]
+
+
+def _match_256_grids(grids, dither):
+    for grid in grids:
+        get_256_indexes(grid, dither=dither)
+
+
+def _time_dithering(results, colors, cols, num_frames, num_cells):
+    """
+    Matches the same cells as convert_frame:256 does one at a time, but a
+    whole frame's grid at once, with each kind of dithering.
+    """
+    rows = [
+        colors[i:i + cols]
+        for i in range(0, len(colors), cols)
+    ] if cols else []
+    rows_per_frame = len(rows) // num_frames if num_frames else 0
+    grids = [
+        rows[i:i + rows_per_frame]
+        for i in range(0, len(rows), rows_per_frame)
+    ] if rows_per_frame else []
+    for dither in DITHER_MODES:
+        _time_stage(results, 'convert_frame:256:dither-{}'.format(dither), num_frames,
+            num_cells, _match_256_grids, grids, dither)
+
+
+def _convert_frames(frame_names, options):
+    for cell_function in CELL_FUNCTIONS.values():
+        cell_function.cache_clear()
+    reset_written_digests()
+    for frame_name in frame_names:
+        convert_frame(frame_name, **options)
+
+
+def _display(txt_frames):
+    sink = _NullSink()
+    display_txt_frames(txt_frames, sink, 1, 0)
+    return sink.bytes_written
+
+
+def _write_frames(txts, dirname, codec):
+    filenames = []
+    for frame_name, txt in txts:
+        filename = get_frame_filename(dirname, frame_name, codec)
+        write_frame(filename, txt, codec)
+        filenames.append(filename)
+    return filenames
+
+
+def _read_frames(filenames, codec):
+    for filename in filenames:
+        read_frame(filename, codec)
+
+
+def _time_codecs(results, tmp_dir, txt_dirname, frame_names, num_cells):
+    """
+    Stores the truecolor frames, the largest, with each codec and times
+    reading them back, which playback has to do once per frame interval.
+    """
+    txts = [
+        (frame_name, read_frame(get_frame_filename(txt_dirname, frame_name)),)
+        for frame_name in frame_names
+        if os.path.exists(get_frame_filename(txt_dirname, frame_name))
+    ]
+    for codec in CODECS:
+        codec_dirname = '{}/codec-{}'.format(tmp_dir, codec)
+        os.makedirs(codec_dirname)
+        filenames = _time_stage(results, 'write_frame:{}'.format(codec), len(txts), num_cells,
+            _write_frames, txts, codec_dirname, codec)
+        name = 'read_frame:{}'.format(codec)
+        _time_stage(results, name, len(txts), num_cells, _read_frames, filenames, codec)
+        results[name]['bytes_stored'] = sum(
+            os.path.getsize(filename)
+            for filename in filenames
+        )
+
+
+def _export(txt_filenames, options, export_frame=export_txt_frame):
+    for txt_filename in txt_filenames:
+        export_frame(txt_filename, '#', **options)
+
+
+def _time_exports(results, output_dirnames, num_frames, num_cells, options):
+    for display_mode in DISPLAY_MODES:
+        txt_filenames = [
+            '{}/{}'.format(output_dirnames[display_mode], filename)
+            for filename in get_sorted_filenames(output_dirnames[display_mode], 'txt')
+        ]
+        name = 'export_txt_frame:{}'.format(display_mode)
+        _time_stage(results, name, num_frames, num_cells, _export, txt_filenames, options)
+        # the frames ffmpeg would be given, to compare with the markup.
+        results[name]['bytes_written'] = sum(
+            os.path.getsize('{}.png'.format(txt_filename))
+            for txt_filename in txt_filenames
+        )
+        for markup_format in MARKUP_EXPORT_FORMATS.values():
+            name = 'render_markup:{}:{}'.format(markup_format, display_mode)
+            markup = _time_stage(results, name, num_frames, num_cells, render_markup,
+                output_dirnames[display_mode], '#', 0.1, markup_format)
+            results[name]['bytes_written'] = len(markup.encode('utf-8'))
+        if display_mode in PALETTE_DISPLAY_MODES:
+            _time_stage(results, 'render_palette_frame:{}'.format(display_mode), num_frames,
+                num_cells, _export, txt_filenames, options, render_palette_frame)
+
+
+def run_benchmark(tmp_dir, num_frames, cols, rows, cell_width, cell_height, clip_filename=None):
+    options = {
+        'cols': cols,
+        'rows': rows,
+        'cell_width': cell_width,
+        'cell_height': cell_height,
+    }
+    output_dirnames = get_output_dirnames(tmp_dir, __version__, 'benchmark', **options)
+    for output_dirname in output_dirnames.values():
+        os.makedirs(output_dirname)
+
+    results = OrderedDict()
+    clip = clip_filename or 'synthetic'
+
+    if clip_filename is None:
+        clip_filename = '{}/synthetic.gif'.format(tmp_dir)
+        make_synthetic_clip(
+            clip_filename, output_dirnames['jpg'], num_frames, cols * cell_width,
+            rows * cell_height)
+        extraction_dirnames = get_output_dirnames(tmp_dir, __version__, 'extraction', **options)
+        os.makedirs(extraction_dirnames['jpg'])
+    else:
+        extraction_dirnames = output_dirnames
+
+    if shutil.which('ffmpeg'):
+        _time_stage(results, 'ffmpeg', num_frames, num_frames * cols * rows,
+            lambda: _run_ffmpeg(clip_filename, extraction_dirnames, **options))
+    else:
+        results['ffmpeg'] = {'skipped': 'ffmpeg not found'}
+
+    if get_decoder(clip_filename) == 'pil':
+        pil_dirnames = get_output_dirnames(tmp_dir, __version__, 'pil_extraction', **options)
+        os.makedirs(pil_dirnames['jpg'])
+        _time_stage(results, 'pil_decode', num_frames, num_frames * cols * rows,
+            lambda: _extract_with_pil(clip_filename, pil_dirnames, **options))
+    else:
+        results['pil_decode'] = {'skipped': 'not a GIF'}
+
+    frame_names = [
+        filename.split('.')[0]
+        for filename in get_sorted_filenames(output_dirnames['jpg'], 'jpg')
+    ]
+    num_frames = len(frame_names)
+
+    # decoding isn't part of the averaging stage.
+    pixel_access = []
+    for frame_name in frame_names:
+        img = Image.open('{}/{}.jpg'.format(output_dirnames['jpg'], frame_name))
+        pixel_access.append((img.load(), img.size[0], img.size[1],))
+
+    num_cells = num_frames * (
+        (pixel_access[0][1] // cell_width) * (pixel_access[0][2] // cell_height)
+        if pixel_access else 0
+    )
+    colors = _time_stage(results, 'get_avg_for_em', num_frames, num_cells,
+        _average_cells, pixel_access, cell_width, cell_height)
+
+    _time_stage(results, 'top_2_colors', num_frames, num_cells, _top_2_colors, colors)
+
+    _time_stage(results, 'convert_frame:nocolor', num_frames, num_cells,
+        _map_nocolor_cells, colors)
+    for display_mode, cell_function in CELL_FUNCTIONS.items():
+        _time_stage(results, 'convert_frame:{}'.format(display_mode), num_frames, num_cells,
+            _map_cells, cell_function, colors)
+
+    _time_dithering(results, colors, pixel_access[0][1] // cell_width if pixel_access else 0,
+        num_frames, num_cells)
+
+    _time_stage(results, 'convert_frame', num_frames, num_cells,
+        _convert_frames, frame_names, dict(options, output_dirnames=output_dirnames))
+
+    # Same frames, already averaged to one pixel per cell like --area-scale.
+    area_dirnames = get_output_dirnames(tmp_dir, __version__, 'benchmark', area_scale=True,
+        **options)
+    for output_dirname in area_dirnames.values():
+        os.makedirs(output_dirname)
+    _make_area_scaled_frames(output_dirnames['jpg'], area_dirnames['jpg'], frame_names,
+        cell_width, cell_height)
+    _time_stage(results, 'convert_frame:area_scale', num_frames, num_cells,
+        _convert_frames, frame_names, dict(options, output_dirnames=area_dirnames, area_scale=True))
+
+    for display_mode in DISPLAY_MODES:
+        name = 'display_txt_frames:{}'.format(display_mode)
+        txt_frames = list(get_txt_frames(output_dirnames[display_mode], '#'))
+        bytes_emitted = _time_stage(results, name, num_frames, num_cells, _display, txt_frames)
+        results[name]['bytes_emitted'] = bytes_emitted
+
+    _time_codecs(results, tmp_dir, output_dirnames['truecolor'], frame_names, num_cells)
+
+    _time_exports(results, output_dirnames, num_frames, num_cells, options)
+
+    return OrderedDict([
+        ('version', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('params', OrderedDict([
+            ('clip', clip),
+            ('num_frames', num_frames),
+            ('cols', cols),
+            ('rows', rows),
+            ('cell_width', cell_width),
+            ('cell_height', cell_height),
+        ])),
+        ('stages', results),
+    ])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='gif_for_cli.benchmark',
+        description='Benchmark the generate, display and export hot paths.',
+    )
+    parser.add_argument(
+        '--clip',
+        dest='clip_filename',
+        type=str,
+        default=None,
+        help='A .gif/.mp4 to benchmark with, instead of a synthetic clip. Requires ffmpeg.',
+    )
+    parser.add_argument('--frames', dest='num_frames', type=int, default=10)
+    parser.add_argument('--cols', dest='cols', type=int, default=160)
+    parser.add_argument('--rows', dest='rows', type=int, default=40)
+    parser.add_argument('-cw', dest='cell_width', type=int, default=3)
+    parser.add_argument('-ch', dest='cell_height', type=int, default=6)
+    parser.add_argument(
+        '--output',
+        dest='output_filename',
+        type=str,
+        default='',
+        help='Write JSON results to this file instead of stdout.',
+    )
+    return parser
+
+
+def main(argv, stdout):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.clip_filename and not shutil.which('ffmpeg'):
+        parser.error('--clip requires ffmpeg')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_benchmark(
+            tmp_dir,
+            args.num_frames,
+            args.cols,
+            args.rows,
+            args.cell_width,
+            args.cell_height,
+            clip_filename=args.clip_filename,
+        )
+
+    if args.output_filename:
+        with open(args.output_filename, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, stdout, indent=2)
+        stdout.write('\n')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:], sys.stdout)
@@ -13,8 +13,66 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+DISPLAY_MODES = [
+    'nocolor', '256', '256fgbg', 'truecolor', '256half', 'truecolorhalf', 'braille', '256braille',
+]
+# Modes that show two colors per cell, one above the other.
+HALF_BLOCK_MODES = ['256half', 'truecolorhalf']
+# Modes that draw each cell as a 2x4 grid of braille dots.
+BRAILLE_MODES = ['braille', '256braille']
+# How cells are averaged, and how colors are matched to the 256 color palette.
+COLOR_SPACES = ['srgb', 'linear', 'oklab']
+DEFAULT_COLOR_SPACE = 'srgb'
+DECODERS = ['auto', 'ffmpeg', 'pil']
+# Whether nocolor characters are spread over the gray levels of each frame,
+# or of the whole clip.
+EQUALIZE_MODES = ['frame', 'clip']
+DEFAULT_EQUALIZE = 'frame'
+# How 256 color modes dither the cell grid before matching it to the
+# palette.
+DITHER_MODES = ['none', 'bayer', 'floyd']
+DEFAULT_DITHER = 'none'
+# How .txt frames are stored in the cache.
+CODECS = ['none', 'zlib', 'lzma']
+DEFAULT_CODEC = 'none'
 NOCOLOR_CHARS = ' .,\'-:;!"^/+?*&8#$@%'
 X256FGBG_CHARS = '.,-:;!"^/+?*&#'
 STORED_CELL_CHAR = '#'
+# Characters half block modes draw cells with, by which parts are in the FG
+# color: the top half, the bottom half, all of it, or none of it.
+UPPER_HALF_BLOCK = u'\u2580'
+LOWER_HALF_BLOCK = u'\u2584'
+FULL_BLOCK = u'\u2588'
+# Braille characters are this plus a bit for each raised dot.
+BRAILLE_BLANK = u'\u2800'
+# (x, y, bit) of each braille dot.
+BRAILLE_DOTS = (
+    (0, 0, 0x01,),
+    (0, 1, 0x02,),
+    (0, 2, 0x04,),
+    (1, 0, 0x08,),
+    (1, 1, 0x10,),
+    (1, 2, 0x20,),
+    (0, 3, 0x40,),
+    (1, 3, 0x80,),
+)
 ANSI_RESET = u'\u001b[0m'
 ANSI_CURSOR_UP = u'\u001b[A'
+ANSI_ERASE_DOWN = u'\u001b[J'
+DEFAULT_COLS = 160
+DEFAULT_ROWS = 40
+# (cols, rows) sizes picked from when sizing to the terminal, so resizing a
+# window only occasionally needs a new cache entry.
+SIZE_BUCKETS = (
+    (40, 10,),
+    (80, 20,),
+    (120, 30,),
+    (160, 40,),
+    (200, 50,),
+    (240, 60,),
+    (320, 80,),
+)
+# --preview plays at most this many frames, at this size, while the rest
+# are generated.
+PREVIEW_SIZE = (40, 10,)
+PREVIEW_MAX_FRAMES = 24
@@ -13,46 +13,575 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from bisect import bisect
+import itertools
+import os
+import queue
+import re
+import select
+import signal
+import threading
 import time
 
-from .constants import STORED_CELL_CHAR, ANSI_RESET, ANSI_CURSOR_UP
-from .utils import get_sorted_filenames
+from .constants import (
+    DEFAULT_CODEC,
+    STORED_CELL_CHAR,
+    ANSI_ERASE_DOWN,
+    ANSI_RESET,
+    ANSI_CURSOR_UP,
+)
+from .instrument import count
+from .storage import get_frame_ext, get_frame_filename, read_frame
+from .utils import get_sorted_filenames, get_terminal_size
+
+
+# Roughly 64MB worth of frames can be kept in memory between loops.
+MAX_CACHED_TXT_FRAMES_SIZE = 64 * 1024 * 1024
+# How many frames the background thread is allowed to read ahead.
+NUM_PREFETCHED_TXT_FRAMES = 8
+# How many frames are prepared for writing ahead of the one being shown.
+NUM_PREPARED_TXT_FRAMES = 2
+
+_END_OF_FRAMES = object()
+
+
+class _PrefetchError(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _put(items, item, stop):
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _prefetch(iterable, items, stop):
+    try:
+        for item in iterable:
+            if not _put(items, item, stop):
+                return
+    except Exception as e:
+        _put(items, _PrefetchError(e), stop)
+        return
+    _put(items, _END_OF_FRAMES, stop)
+
+
+def _iter_prefetched(iterable, size):
+    """
+    Iterates over `iterable` in a background thread, staying at most `size`
+    items ahead of the caller. Closing the generator stops the thread.
+    """
+    items = queue.Queue(size)
+    stop = threading.Event()
+    thread = threading.Thread(target=_prefetch, args=(iterable, items, stop))
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _END_OF_FRAMES:
+                return
+            if isinstance(item, _PrefetchError):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+
+
+class TxtFrames(object):
+    """
+    A sequence of text frames that are read from disk as they're needed.
+
+    Iterating starts a background thread which reads at most `prefetch`
+    frames ahead, so memory use stays flat regardless of clip length and the
+    first frame is available right away. If the whole clip turns out to fit
+    in `max_cache_size` characters, it's kept after the first pass so later
+    loops are served from memory.
+
+    `durations`, if given, is how many seconds each frame is shown for.
+    `codec` is how the files are stored, they're decompressed as they're
+    read.
+    """
+
+    def __init__(self, filenames, cell_char, durations=None, prefetch=NUM_PREFETCHED_TXT_FRAMES,
+            max_cache_size=MAX_CACHED_TXT_FRAMES_SIZE, codec=DEFAULT_CODEC):
+        self.filenames = list(filenames)
+        self.cell_char = cell_char
+        self.durations = durations
+        self.codec = codec
+        self.prefetch = prefetch
+        self.max_cache_size = max_cache_size
+        self._cache = None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, index):
+        if self._cache is not None:
+            return self._cache[index]
+        return self._read(self.filenames[index])
+
+    def __iter__(self):
+        if self._cache is not None:
+            return iter(self._cache)
+        return self._stream()
+
+    def get_durations(self, seconds_per_frame):
+        return self.durations or [seconds_per_frame] * len(self)
+
+    def _read(self, filename):
+        return read_frame(filename, self.codec).replace(STORED_CELL_CHAR, self.cell_char)
+
+    def _stream(self):
+        cache = []
+        cache_size = 0
+        txt_frames = _iter_prefetched(
+            (self._read(filename) for filename in self.filenames),
+            self.prefetch,
+        )
+        try:
+            for txt_frame in txt_frames:
+                if cache is not None:
+                    cache_size += len(txt_frame)
+                    if cache_size <= self.max_cache_size:
+                        cache.append(txt_frame)
+                    else:
+                        # too big to keep around, keep streaming from disk.
+                        cache = None
+
+                yield txt_frame
+        finally:
+            txt_frames.close()
+
+        if cache is not None:
+            self._cache = cache
+
+
+class ResizableTxtFrames(object):
+    """
+    Wraps a sequence of text frames so playback can be switched to another
+    size of the same clip part way through a loop, e.g. from a signal
+    handler or another thread.
+    """
+
+    def __init__(self, txt_frames):
+        self.txt_frames = txt_frames
+        self._pending = None
+
+    def __len__(self):
+        return len(self.txt_frames)
+
+    def __getitem__(self, index):
+        return self.txt_frames[index]
+
+    def switch(self, txt_frames):
+        self._pending = txt_frames
+
+    def __iter__(self):
+        # without durations, frames line up by index.
+        return (
+            txt_frame
+            for txt_frame, seconds in self.iter_with_durations(1)
+        )
+
+    def iter_with_durations(self, seconds_per_frame):
+        index = 0
+        durations = _get_durations(self.txt_frames, seconds_per_frame)
+        stream = iter(self.txt_frames)
+        elapsed = 0
+        while index < len(self.txt_frames):
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                self.txt_frames = pending
+                # Sizes may have had different frames deduplicated, so pick
+                # up from the frame shown at the same point in time, reading
+                # the rest of this loop directly.
+                durations = _get_durations(self.txt_frames, seconds_per_frame)
+                starts = list(itertools.accumulate([0] + durations[:-1]))
+                index = max(0, bisect(starts, elapsed) - 1)
+                elapsed = starts[index]
+                stream = (
+                    self.txt_frames[i]
+                    for i in range(index, len(self.txt_frames))
+                )
+                # clear anything the previous size left behind.
+                yield ANSI_ERASE_DOWN + next(stream), durations[index]
+            else:
+                yield next(stream), durations[index]
+            elapsed += durations[index]
+            index += 1
+
+
+def _get_durations(txt_frames, seconds_per_frame):
+    if hasattr(txt_frames, 'get_durations'):
+        return txt_frames.get_durations(seconds_per_frame)
+    return [seconds_per_frame] * len(txt_frames)
+
+
+def _iter_with_durations(txt_frames, seconds_per_frame):
+    if hasattr(txt_frames, 'iter_with_durations'):
+        return txt_frames.iter_with_durations(seconds_per_frame)
+    return zip(txt_frames, _get_durations(txt_frames, seconds_per_frame))
+
+
+class _StreamWriter(object):
+    """
+    Writes frames through a text stream, for when there's no file descriptor
+    to write to, e.g. io.StringIO.
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def encode(self, s):
+        return s
+
+    def write(self, *chunks):
+        self.stdout.write(''.join(chunks))
+        self.stdout.flush()
+
+
+class _FdWriter(object):
+    """
+    Writes already encoded frames straight to `stdout`'s file descriptor,
+    in a single system call per frame.
+    """
+
+    def __init__(self, stdout, fd):
+        # anything already written to `stdout` has to go out first.
+        stdout.flush()
+        self.fd = fd
+        self.encoding = getattr(stdout, 'encoding', None) or 'utf-8'
+        self.errors = getattr(stdout, 'errors', None) or 'strict'
+
+    def encode(self, s):
+        return s.encode(self.encoding, self.errors)
+
+    def write(self, *chunks):
+        chunks = [memoryview(chunk) for chunk in chunks if chunk]
+        while chunks:
+            try:
+                num_bytes = os.writev(self.fd, chunks)
+            except BlockingIOError:
+                # wait for a non-blocking stdout to drain.
+                select.select([], [self.fd], [])
+                continue
+
+            while chunks and num_bytes >= len(chunks[0]):
+                num_bytes -= len(chunks[0])
+                chunks.pop(0)
+            if num_bytes:
+                chunks[0] = chunks[0][num_bytes:]
+
+
+def _get_writer(stdout):
+    # Windows consoles need the text layer to get characters across.
+    if hasattr(os, 'writev') and os.name != 'nt':
+        try:
+            return _FdWriter(stdout, stdout.fileno())
+        except (AttributeError, OSError, ValueError):
+            pass
+    return _StreamWriter(stdout)
+
+
+def _prepare_frames(txt_frames, num_loops, seconds_per_frame, encode,
+        max_cache_size=MAX_CACHED_TXT_FRAMES_SIZE):
+    """
+    Yields each frame encoded for writing, with its line count, duration,
+    and whether it clears the lines below it. Frames are only encoded once,
+    and played from memory after the first loop if they fit in
+    `max_cache_size` bytes and playback can't switch sizes.
+    """
+    remaining_loops = num_loops or None
+    prepared_frames = None
+    while remaining_loops is None or remaining_loops > 0:
+        if prepared_frames is not None:
+            for prepared_frame in prepared_frames:
+                yield prepared_frame
+        else:
+            cache = None if hasattr(txt_frames, 'switch') else []
+            cache_size = 0
+            for txt_frame, seconds in _iter_with_durations(txt_frames, seconds_per_frame):
+                prepared_frame = (
+                    encode(txt_frame + '\n'),
+                    txt_frame.count('\n') + 1,
+                    seconds,
+                    txt_frame.startswith(ANSI_ERASE_DOWN),
+                )
+                if cache is not None:
+                    cache_size += len(prepared_frame[0])
+                    if cache_size <= max_cache_size:
+                        cache.append(prepared_frame)
+                    else:
+                        cache = None
+                yield prepared_frame
+            prepared_frames = cache
+
+        if remaining_loops is not None:
+            remaining_loops -= 1
 
 
 def display_txt_frames(txt_frames, stdout, num_loops, seconds_per_frame):
+    """
+    Frames are shown for `seconds_per_frame`, unless `txt_frames` has its
+    own durations for them.
+
+    The next frames are read and encoded in a background thread while the
+    current one is written and shown. Each frame is due at a fixed time from
+    the start, and frames whose time has already passed by the time they'd
+    be written (e.g. over a slow SSH link) are skipped, so playback keeps
+    pace instead of falling further behind.
+
+    Returns False if playback was stopped with Ctrl+C.
+    """
+    writer = _get_writer(stdout)
+    no_erase = writer.encode('')
+    erase_down = writer.encode(ANSI_ERASE_DOWN)
+    cursor_ups = {}
     previous_line_count = 0
-    remaining_loops = num_loops or None
+    erase = False
+    prepared_frames = _iter_prefetched(
+        _prepare_frames(txt_frames, num_loops, seconds_per_frame, writer.encode),
+        NUM_PREPARED_TXT_FRAMES,
+    )
+    finished = True
 
     try:
-        while remaining_loops is None or remaining_loops > 0:
-            for txt_frame in txt_frames:
-                stdout.write(ANSI_CURSOR_UP * previous_line_count)
-                stdout.write(txt_frame)
-                stdout.write('\n')
-                stdout.flush()
-                previous_line_count = len(txt_frames[0].split('\n'))
-                time.sleep(seconds_per_frame)
-
-            if remaining_loops is not None:
-                remaining_loops -= 1
+        deadline = time.monotonic()
+        for txt_frame, line_count, seconds, erases in prepared_frames:
+            deadline += seconds
+            # without a duration there's no pace to keep, e.g. benchmarks.
+            if seconds and time.monotonic() > deadline:
+                # Frames switching size clear what was below them, so the
+                # next one written has to instead.
+                erase = erase or erases
+                count('skipped_frames')
+                continue
+
+            if previous_line_count not in cursor_ups:
+                cursor_ups[previous_line_count] = writer.encode(
+                    ANSI_CURSOR_UP * previous_line_count)
+            writer.write(
+                cursor_ups[previous_line_count],
+                erase_down if erase and not erases else no_erase,
+                txt_frame,
+            )
+            previous_line_count = line_count
+            erase = False
+            time.sleep(max(0, deadline - time.monotonic()))
         stdout.write(ANSI_RESET)
     except KeyboardInterrupt:
         # ensure styling is reset
         stdout.write(ANSI_RESET)
         # we'll want an extra new line if CTRL+C was pressed
         stdout.write('\n')
+        finished = False
+    finally:
+        prepared_frames.close()
 
     stdout.flush()
+    return finished
+
+
+# Matches the color escape codes in a line, to find its visible width.
+_ANSI_SGR = re.compile('\u001b\\[[0-9;]*m')
+# Between tiles side by side in a mosaic.
+MOSAIC_GAP = ' '
 
 
-def get_txt_frames(display_dirname, cell_char):
-    return [
-        open('{}/{}'.format(display_dirname, filename)).read().replace(STORED_CELL_CHAR, cell_char)
-        for filename in get_sorted_filenames(display_dirname, 'txt')
-    ]
+def _loop_with_durations(txt_frames, seconds_per_frame):
+    while True:
+        for txt_frame, seconds in _iter_with_durations(txt_frames, seconds_per_frame):
+            yield txt_frame, seconds
 
 
-def display(display_dirname, stdout, num_loops, cell_char, seconds_per_frame):
-    txt_frames = get_txt_frames(display_dirname, cell_char)
+def _get_tile_lines(txt_frame, cols, rows):
+    """
+    Pads a frame to exactly `rows` lines of `cols` visible characters, so
+    tiles line up next to each other.
+    """
+    lines = txt_frame.split('\n')[:rows]
+    lines += [''] * (rows - len(lines))
 
-    display_txt_frames(txt_frames, stdout, num_loops, seconds_per_frame)
+    tile_lines = []
+    for line in lines:
+        padding = ' ' * max(0, cols - len(_ANSI_SGR.sub('', line)))
+        # colors mustn't run on into the padding or the next tile.
+        if '\u001b' in line and not line.endswith(ANSI_RESET):
+            line += ANSI_RESET
+        tile_lines.append(line + padding)
+    return tile_lines
+
+
+class _Tile(object):
+    """
+    One clip in a mosaic, and the frame it's currently showing.
+    """
+
+    def __init__(self, txt_frames, seconds_per_frame, cols, rows):
+        self.cols = cols
+        self.rows = rows
+        self.seconds = sum(_get_durations(txt_frames, seconds_per_frame))
+        self.lines = _get_tile_lines('', cols, rows)
+        # when the next frame is due, in seconds from the start.
+        self.due = 0
+        self._frames = _loop_with_durations(txt_frames, seconds_per_frame)
+
+    def advance(self, elapsed):
+        """
+        Moves on to the frame that should be showing `elapsed` seconds in,
+        skipping any that were missed.
+        """
+        num_frames = 0
+        while self.due <= elapsed:
+            txt_frame, seconds = next(self._frames)
+            self.due += seconds
+            num_frames += 1
+        if num_frames:
+            self.lines = _get_tile_lines(txt_frame, self.cols, self.rows)
+        if num_frames > 1:
+            count('skipped_frames', num_frames - 1)
+
+
+def _compose(tiles, mosaic_cols):
+    screen = []
+    for i in range(0, len(tiles), mosaic_cols):
+        row_tiles = tiles[i:i + mosaic_cols]
+        for line_index in range(max(tile.rows for tile in row_tiles)):
+            screen.append(MOSAIC_GAP.join(
+                tile.lines[line_index] if line_index < tile.rows else ' ' * tile.cols
+                for tile in row_tiles
+            ))
+    return screen
+
+
+def _get_screen_delta(previous_screen, screen):
+    """
+    Only lines that changed since `previous_screen` are written again, the
+    rest are stepped over.
+    """
+    if previous_screen is None:
+        return ''.join(line + '\n' for line in screen)
+    return ANSI_CURSOR_UP * len(previous_screen) + ''.join(
+        '\n' if line == previous_line else line + '\n'
+        for line, previous_line in zip(screen, previous_screen)
+    )
+
+
+def display_mosaic(tiles, stdout, num_loops, mosaic_cols):
+    """
+    Plays several clips at once, tiled `mosaic_cols` to a row. `tiles` is a
+    list of (txt_frames, seconds_per_frame, cols, rows).
+
+    Every clip keeps its own frame timing, and the screen is written once
+    each time any of them moves on to another frame. `num_loops` counts
+    loops of the longest clip, and shorter ones repeat until it's done.
+    """
+    tiles = [_Tile(*tile) for tile in tiles]
+    writer = _get_writer(stdout)
+    end = num_loops * max(tile.seconds for tile in tiles) if num_loops else None
+    previous_screen = None
+
+    try:
+        start = time.monotonic()
+        elapsed = 0
+        while end is None or elapsed < end:
+            for tile in tiles:
+                tile.advance(elapsed)
+
+            screen = _compose(tiles, mosaic_cols)
+            writer.write(writer.encode(_get_screen_delta(previous_screen, screen)))
+            previous_screen = screen
+
+            due = min(tile.due for tile in tiles)
+            time.sleep(max(0, start + due - time.monotonic()))
+            # when writing fell behind, tiles catch up on the next pass.
+            elapsed = max(due, time.monotonic() - start)
+        stdout.write(ANSI_RESET)
+    except KeyboardInterrupt:
+        # ensure styling is reset
+        stdout.write(ANSI_RESET)
+        # we'll want an extra new line if CTRL+C was pressed
+        stdout.write('\n')
+
+    stdout.flush()
+
+
+def get_txt_frames(display_dirname, cell_char, frames=None, codec=DEFAULT_CODEC,
+        max_cache_size=MAX_CACHED_TXT_FRAMES_SIZE):
+    """
+    `frames`, if given, is a list of [frame name, seconds] to play, as saved
+    to config.json once repeated frames are removed.
+    """
+    if frames is None:
+        return TxtFrames(
+            (
+                '{}/{}'.format(display_dirname, filename)
+                for filename in get_sorted_filenames(display_dirname, get_frame_ext(codec))
+            ),
+            cell_char,
+            max_cache_size=max_cache_size,
+            codec=codec,
+        )
+
+    return TxtFrames(
+        (
+            get_frame_filename(display_dirname, frame_name, codec)
+            for frame_name, seconds in frames
+        ),
+        cell_char,
+        durations=[seconds for frame_name, seconds in frames],
+        max_cache_size=max_cache_size,
+        codec=codec,
+    )
+
+
+def display(display_dirname, stdout, num_loops, cell_char, seconds_per_frame,
+        frames=None, on_resize=None, codec=DEFAULT_CODEC, on_play=None):
+    """
+    `on_resize`, if given, is called with the new terminal size whenever it
+    changes, along with a function that switches playback over to another
+    display dirname (and its frames and codec). The switch may happen later,
+    from another thread.
+
+    `on_play`, if given, is called with the same function just before
+    playback starts.
+
+    Returns False if playback was stopped with Ctrl+C.
+    """
+    if on_resize is not None and not hasattr(signal, 'SIGWINCH'):
+        on_resize = None
+
+    if on_resize is None and on_play is None:
+        # the frames are kept once they're encoded for writing instead, see
+        # _prepare_frames().
+        txt_frames = get_txt_frames(display_dirname, cell_char, frames, codec, max_cache_size=0)
+        return display_txt_frames(txt_frames, stdout, num_loops, seconds_per_frame)
+
+    txt_frames = ResizableTxtFrames(get_txt_frames(display_dirname, cell_char, frames, codec))
+
+    def switch(display_dirname, frames=None, codec=DEFAULT_CODEC):
+        txt_frames.switch(get_txt_frames(display_dirname, cell_char, frames, codec))
+
+    if on_play is not None:
+        on_play(switch)
+
+    if on_resize is None:
+        return display_txt_frames(txt_frames, stdout, num_loops, seconds_per_frame)
+
+    def handle_sigwinch(signum, frame):
+        terminal_size = get_terminal_size(stdout, {})
+        if terminal_size:
+            on_resize(terminal_size, switch)
+
+    previous_handler = signal.signal(signal.SIGWINCH, handle_sigwinch)
+    try:
+        return display_txt_frames(txt_frames, stdout, num_loops, seconds_per_frame)
+    finally:
+        signal.signal(signal.SIGWINCH, previous_handler)
@@ -14,25 +14,212 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import hashlib
+import io
 import json
+import math
 import os
 from os.path import expanduser
+import shutil
+import tempfile
+import threading
 
-from . import __version__
-from .display import display
+from . import __version__, instrument
+from .constants import (
+    DEFAULT_CODEC,
+    DEFAULT_COLS,
+    DEFAULT_ROWS,
+    PREVIEW_MAX_FRAMES,
+    PREVIEW_SIZE,
+    SIZE_BUCKETS,
+)
+from .display import MOSAIC_GAP, display, display_mosaic, get_txt_frames
 from .export import export
-from .generate import generate
+from .generate import (
+    EmptyWindowError,
+    derive,
+    extract,
+    generate,
+    generate_preview,
+    slice_window,
+)
+from .generate.manifest import is_complete
 from .generate.utils import process_input_source
-from .utils import get_parser, get_output_dirnames
+from .utils import (
+    get_parser,
+    get_output_dirnames,
+    get_size_bucket,
+    get_sorted_filenames,
+    get_terminal_size,
+)
+
+
+def _fits_terminal(args):
+    # Exports and pre-built caches get the same size whoever makes them.
+    if args.export_filename or args.no_display:
+        return False
+    return args.cols is None and args.rows is None
+
+
+def _get_size(args, stdout, environ):
+    """
+    Returns cols, rows, and whether they were picked to fit the terminal.
+    """
+    if _fits_terminal(args):
+        terminal_size = get_terminal_size(stdout, environ)
+        if terminal_size:
+            return get_size_bucket(terminal_size) + (True,)
+
+    return (
+        DEFAULT_COLS if args.cols is None else args.cols,
+        DEFAULT_ROWS if args.rows is None else args.rows,
+        False,
+    )
+
+
+def _get_sizes(args, cols, rows):
+    sizes = [(cols, rows,)]
+    for size in args.sizes:
+        if size not in sizes:
+            sizes.append(size)
+    return sizes
+
+
+def _get_num_pixels(entry):
+    return entry['cols'] * entry['cell_width'] * entry['rows'] * entry['cell_height']
+
+
+def _get_entry(home_dir, input_source_hash, args, cols, rows, whole_clip=False):
+    start, duration = (0, None,) if whole_clip else (args.start, args.duration,)
+    return {
+        'cols': cols,
+        'rows': rows,
+        'cell_width': args.cell_width,
+        'cell_height': args.cell_height,
+        'color_space': args.color_space,
+        'area_scale': args.area_scale,
+        'equalize': args.equalize,
+        'dither': args.dither,
+        'codec': args.codec,
+        'start': start,
+        'duration': duration,
+        'output_dirnames': get_output_dirnames(
+            home_dir,
+            __version__,
+            input_source_hash,
+            cols,
+            rows,
+            args.cell_width,
+            args.cell_height,
+            args.color_space,
+            args.area_scale,
+            args.equalize,
+            start,
+            duration,
+            args.dither,
+        ),
+    }
+
+
+def _has_extracted_frames(entry):
+    try:
+        return any(get_sorted_filenames(entry['output_dirnames']['jpg'], 'jpg'))
+    except OSError:
+        return False
+
+
+def _load_config(output_dirnames):
+    with open('{}/config.json'.format(output_dirnames['.']), 'r') as f:
+        return json.load(f)
+
+
+def _get_codec(config):
+    # entries cached before codecs existed don't record one.
+    return config.get('codec') or DEFAULT_CODEC
+
+
+def _make_dirs(entry):
+    for output_dirname in entry['output_dirnames'].values():
+        if not os.path.exists(output_dirname):
+            os.makedirs(output_dirname)
+
+
+def _get_resize_handler(get_entry, display_mode, current_size):
+    """
+    Switches playback to the size bucket that fits the resized terminal.
+    Buckets that aren't cached yet are derived in the background from the
+    largest frames already extracted, and switched to once they're ready.
+    """
+    deriving = set()
+    latest_size = current_size
+
+    def switch_to(size, entry, switch):
+        nonlocal current_size
+        current_size = size
+        config = _load_config(entry['output_dirnames'])
+        switch(entry['output_dirnames'][display_mode], config.get('frames'),
+            _get_codec(config))
+
+    def on_resize(terminal_size, switch):
+        nonlocal latest_size
+        size = latest_size = get_size_bucket(terminal_size)
+        entry = get_entry(*size)
+
+        if size == current_size or size in deriving:
+            return
+        if is_complete(entry['output_dirnames']['.']):
+            switch_to(size, entry, switch)
+            return
+
+        sources = sorted(
+            (get_entry(*bucket) for bucket in SIZE_BUCKETS),
+            key=_get_num_pixels,
+            reverse=True,
+        )
+        source = next(filter(_has_extracted_frames, sources), None)
+        # Upscaling wouldn't gain anything over what's playing already.
+        if source is None or _get_num_pixels(source) < _get_num_pixels(entry):
+            return
+
+        def run():
+            _make_dirs(entry)
+            derive(source['output_dirnames'], **entry)
+            deriving.discard(size)
+            if latest_size == size:
+                switch_to(size, entry, switch)
+
+        deriving.add(size)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    return on_resize
 
 
 def execute(environ, argv, stdout):
     parser = get_parser(environ)
 
     args = parser.parse_args(argv)
+    if args.mosaic and args.export_filename:
+        parser.error('--export does not support --mosaic')
+
+    try:
+        if not args.profile:
+            _execute(args, environ, stdout)
+        else:
+            with instrument.profile(args.profile_output, stdout):
+                _execute(args, environ, stdout)
+    except EmptyWindowError as e:
+        parser.error(str(e))
 
-    input_source = args.input_source
 
+def _prepare(args, stdout, input_source, cols, rows, preview=False):
+    """
+    Makes sure `input_source` is cached at `cols` x `rows` and any --sizes,
+    generating whatever is missing. Returns a function to get cache entries
+    by size, the entry for `cols` x `rows`, and if `preview` is set, the
+    options to generate() with instead of generating right away (or None if
+    everything is cached).
+    """
     input_source_file = process_input_source(input_source, args.api_key)
 
     home_dir = expanduser('~')
@@ -41,35 +228,75 @@ def execute(environ, argv, stdout):
     m.update(input_source_file.encode('utf8'))
     input_source_hash = m.hexdigest()
 
-    output_dirnames = get_output_dirnames(
-        home_dir,
-        __version__,
-        input_source_hash,
-        args.cols,
-        args.rows,
-        args.cell_width,
-        args.cell_height
-    )
+    def get_entry(cols, rows):
+        return _get_entry(home_dir, input_source_hash, args, cols, rows)
+
+    entries = [
+        get_entry(*size)
+        for size in _get_sizes(args, cols, rows)
+    ]
+
+    # Entries left incomplete by an interrupted run are picked up again,
+    # and generate() only redoes what their manifest says is missing.
+    missing_entries = [
+        entry
+        for entry in entries
+        if not is_complete(entry['output_dirnames']['.'])
+    ]
+
+    if args.start or args.duration is not None:
+        # Windows of a clip that's already cached whole are cut out of it.
+        for entry in list(missing_entries):
+            whole_entry = _get_entry(home_dir, input_source_hash, args, entry['cols'],
+                entry['rows'], whole_clip=True)
+            if is_complete(whole_entry['output_dirnames']['.']):
+                _make_dirs(entry)
+                slice_window(whole_entry['output_dirnames'], **entry)
+                missing_entries.remove(entry)
 
-    if not os.path.exists(output_dirnames['.']):
-        for output_dirname in output_dirnames.values():
-            if not os.path.exists(output_dirname):
-                os.makedirs(output_dirname)
+    if missing_entries:
+        for entry in missing_entries:
+            _make_dirs(entry)
 
-        generate(
+        # Decode once at the largest size, smaller ones are derived from it.
+        missing_entries.sort(key=_get_num_pixels, reverse=True)
+
+        options = dict(
             stdout=stdout,
             input_source=input_source,
             input_source_file=input_source_file,
-            cols=args.cols,
-            rows=args.rows,
-            cell_width=args.cell_width,
-            cell_height=args.cell_height,
-            output_dirnames=output_dirnames,
             cpu_pool_size=args.cpu_pool_size,
+            decoder=args.decoder,
+            variants=missing_entries[1:],
+            **missing_entries[0]
         )
+        if preview:
+            return get_entry, entries[0], options
+        generate(**options)
 
-    with open('{}/config.json'.format(output_dirnames['.']), 'r') as f:
-        config = json.load(f)
+    return get_entry, entries[0], None
+
+
+def _execute(args, environ, stdout):
+    if args.mosaic:
+        _execute_mosaic(args, environ, stdout)
+        return
+
+    cols, rows, fit_to_terminal = _get_size(args, stdout, environ)
+
+    get_entry, entry, generate_options = _prepare(args, stdout, args.input_source, cols, rows,
+        preview=args.preview and not args.export_filename and not args.no_display)
+    output_dirnames = entry['output_dirnames']
+    on_resize = (
+        _get_resize_handler(get_entry, args.display_mode, (cols, rows,))
+        if fit_to_terminal else None
+    )
+
+    if generate_options is not None:
+        _display_preview(args, stdout, entry, generate_options, on_resize)
+        return
+
+    config = _load_config(output_dirnames)
 
     if args.export_filename:
         export(
@@ -78,12 +305,16 @@ def execute(environ, argv, stdout):
             stdout=stdout,
             cell_char=args.cell_char,
             seconds_per_frame=config['seconds'] / config['num_frames'],
-            cols=args.cols,
-            rows=args.rows,
+            cols=cols,
+            rows=rows,
             cell_width=args.cell_width,
             cell_height=args.cell_height,
             cpu_pool_size=args.cpu_pool_size,
             output_dirnames=output_dirnames,
+            frames=config.get('frames'),
+            codec=_get_codec(config),
+            display_mode=args.display_mode,
+            delta=args.export_delta,
         )
     elif not args.no_display:
         display(
@@ -92,4 +323,121 @@ def execute(environ, argv, stdout):
             num_loops=args.num_loops,
             cell_char=args.cell_char,
             seconds_per_frame=config['seconds'] / config['num_frames'],
+            frames=config.get('frames'),
+            codec=_get_codec(config),
+            on_resize=on_resize,
+        )
+
+
+def _display_preview(args, stdout, entry, generate_options, on_resize):
+    """
+    Plays a few frames at a small size as soon as they're extracted, while
+    the rest is generated in the background, then switches over to `entry`.
+    Resizing the terminal is only followed once that switch is made.
+    """
+    extract(**generate_options)
+
+    preview_dir = tempfile.mkdtemp()
+    try:
+        preview_entry = _get_entry(preview_dir, 'preview', args,
+            min(entry['cols'], PREVIEW_SIZE[0]), min(entry['rows'], PREVIEW_SIZE[1]))
+        _make_dirs(preview_entry)
+        generate_preview(generate_options['output_dirnames'], PREVIEW_MAX_FRAMES,
+            modes=[args.display_mode], **preview_entry)
+        config = _load_config(preview_entry['output_dirnames'])
+
+        generated = threading.Event()
+        threads = []
+
+        def on_play(switch):
+            def run():
+                # progress would garble playback.
+                generate(**dict(generate_options, stdout=io.StringIO()))
+                entry_config = _load_config(entry['output_dirnames'])
+                switch(entry['output_dirnames'][args.display_mode], entry_config.get('frames'),
+                    _get_codec(entry_config))
+                generated.set()
+
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        def on_preview_resize(terminal_size, switch):
+            if generated.is_set():
+                on_resize(terminal_size, switch)
+
+        finished = display(
+            display_dirname=preview_entry['output_dirnames'][args.display_mode],
+            stdout=stdout,
+            num_loops=args.num_loops,
+            cell_char=args.cell_char,
+            seconds_per_frame=config['seconds'] / config['num_frames'],
+            frames=config['frames'],
+            codec=_get_codec(config),
+            on_resize=on_preview_resize if on_resize else None,
+            on_play=on_play,
         )
+
+        if not finished:
+            # Ctrl+C shouldn't leave the user waiting on the rest of the clip.
+            # What's converted so far is in the manifest for next time.
+            if not generated.is_set():
+                stdout.write('Stopped before the whole clip was cached.\n')
+            return
+
+        # finish caching, even if playback ended first.
+        if not generated.is_set():
+            stdout.write('Caching the rest of the clip...\n')
+        for thread in threads:
+            thread.join()
+    finally:
+        shutil.rmtree(preview_dir)
+
+
+def _get_mosaic_shape(args, num_tiles):
+    mosaic_cols = args.mosaic_cols or math.ceil(math.sqrt(num_tiles))
+    return mosaic_cols, math.ceil(num_tiles / mosaic_cols)
+
+
+def _get_tile_size(args, stdout, environ, mosaic_cols, mosaic_rows):
+    """
+    Like _get_size(), but fits `mosaic_cols` x `mosaic_rows` tiles in the
+    terminal.
+    """
+    if _fits_terminal(args):
+        terminal_size = get_terminal_size(stdout, environ)
+        if terminal_size:
+            cols, lines = terminal_size
+            return get_size_bucket((
+                (cols - len(MOSAIC_GAP) * (mosaic_cols - 1)) // mosaic_cols,
+                # get_size_bucket() leaves the last line for the cursor.
+                (lines - 1) // mosaic_rows + 1,
+            ))
+
+    return _get_size(args, stdout, environ)[:2]
+
+
+def _execute_mosaic(args, environ, stdout):
+    input_sources = [args.input_source] + args.mosaic
+    mosaic_cols, mosaic_rows = _get_mosaic_shape(args, len(input_sources))
+    cols, rows = _get_tile_size(args, stdout, environ, mosaic_cols, mosaic_rows)
+
+    tiles = []
+    for input_source in input_sources:
+        get_entry, entry, generate_options = _prepare(args, stdout, input_source, cols, rows)
+        config = _load_config(entry['output_dirnames'])
+        tiles.append((
+            get_txt_frames(
+                entry['output_dirnames'][args.display_mode],
+                args.cell_char,
+                config.get('frames'),
+                _get_codec(config),
+            ),
+            config['seconds'] / config['num_frames'],
+            cols,
+            rows,
+        ))
+
+    if not args.no_display:
+        display_mosaic(tiles, stdout, args.num_loops, mosaic_cols)
@@ -13,42 +13,106 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import html
+import json
 import os
 import subprocess
+import time
 
 from PIL import Image, ImageDraw, ImageFont
 from x256 import x256
 
 from . import third_party
-from .constants import STORED_CELL_CHAR
+from .constants import (
+    ANSI_CURSOR_UP,
+    ANSI_RESET,
+    BRAILLE_BLANK,
+    BRAILLE_DOTS,
+    DEFAULT_CODEC,
+    FULL_BLOCK,
+    LOWER_HALF_BLOCK,
+    STORED_CELL_CHAR,
+    UPPER_HALF_BLOCK,
+)
+from .display import _ANSI_SGR, _get_screen_delta, _iter_with_durations, get_txt_frames
+from .instrument import timed
+from .storage import get_frame_basename, get_frame_ext, get_frame_filename, read_frame
 from .utils import get_sorted_filenames, pool_abstraction, memoize
 
 
+# Display modes whose colors all come from the 256 color palette, so they
+# can be drawn straight into palette images.
+PALETTE_DISPLAY_MODES = ['nocolor', '256', '256fgbg', '256half', 'braille', '256braille']
+# Formats Pillow can write animations of.
+PALETTE_EXPORT_FORMATS = ['GIF', 'PNG', 'WEBP']
+# Recordings written straight from the text frames, no drawing needed.
+STREAM_EXPORT_EXTS = ['.cast', '.ans']
+# Formats the frames can be written out as markup in.
+MARKUP_EXPORT_FORMATS = {'.html': 'html', '.svg': 'svg'}
+# SVG cell size and font size, in px.
+SVG_CELL_SIZE = (6, 12,)
+SVG_FONT_SIZE = 10
+# Which part of a cell each block character fills with the FG color, as
+# fractions of its height.
+BLOCK_PARTS = {
+    UPPER_HALF_BLOCK: (0, 0.5,),
+    LOWER_HALF_BLOCK: (0.5, 1,),
+    FULL_BLOCK: (0, 1,),
+}
+# x256 indexes of the terminal's default colors.
+DEFAULT_BG = 0
+DEFAULT_FG = 15
+X256_PALETTE = [
+    n
+    for rgb in x256.colors
+    for n in rgb
+]
+
+
 @memoize
 def to_rgb(s):
     return tuple(x256.to_rgb(int(s)))
 
 
-def export_txt_frame(txt_filename, cell_char, rows, cols, **options):
-    # PNG is used because JPG looked a little desaturated.
-    img_filename = '{}.png'.format(txt_filename)
-
+@memoize
+def _get_font():
     font = ImageFont.truetype(
         os.path.join(third_party.__path__[0], 'Roboto_Mono/RobotoMono-Regular.ttf'),
         size=24,
     )
     em_size = font.getsize('M')
-
-    img_cell_width = em_size[0]
-    img_cell_height = int(em_size[1] * 1.25)
-
-    im = Image.new('RGB', (cols * img_cell_width, rows * img_cell_height,))
-    draw = ImageDraw.Draw(im)
-
-    txt = open(txt_filename).read().replace(STORED_CELL_CHAR, cell_char)
-
-    bg = (0, 0, 0,)
-    fg = (255, 255, 255,)
+    return font, (em_size[0], int(em_size[1] * 1.25),)
+
+
+def _apply_escape_seq(escape_seq, fg, bg):
+    """
+    Returns the (fg, bg) colors after an SGR escape sequence.
+    """
+    if escape_seq == '[0':
+        # reset
+        return DEFAULT_FG, DEFAULT_BG
+    elif escape_seq.startswith('[48;5;'):
+        # 256 BG
+        return fg, int(escape_seq[6:])
+    elif escape_seq.startswith('[38;5;'):
+        # 256 FG
+        return int(escape_seq[6:]), bg
+    elif escape_seq.startswith('[38;2;'):
+        # truecolor FG
+        return tuple([int(c) for c in escape_seq[6:].split(';')]), bg
+    elif escape_seq.startswith('[48;2;'):
+        # truecolor BG
+        return fg, tuple([int(c) for c in escape_seq[6:].split(';')])
+    return fg, bg
+
+
+def parse_txt_frame(txt):
+    """
+    Yields (row, col, char, fg, bg) for each character of a frame. Colors
+    are x256 indexes, or (r, g, b) tuples for truecolor.
+    """
+    bg = DEFAULT_BG
+    fg = DEFAULT_FG
     escaped = False
     escape_seq = []
 
@@ -59,73 +123,160 @@ def export_txt_frame(txt_filename, cell_char, rows, cols, **options):
                 escaped = True
             elif escaped:
                 if char == 'm':
-                    # act on escape_seq
-                    escape_seq = ''.join(escape_seq)
-
-                    if escape_seq == '[0':
-                        # reset
-                        bg = (0, 0, 0,)
-                        fg = (255, 255, 255,)
-                    elif escape_seq.startswith('[48;5;'):
-                        # 256 BG
-                        bg = to_rgb(escape_seq[6:])
-                    elif escape_seq.startswith('[38;5;'):
-                        # 256 FG
-                        fg = to_rgb(escape_seq[6:])
-                    elif escape_seq.startswith('[38;2;'):
-                        # truecolor FG
-                        fg = tuple([int(c) for c in escape_seq[6:].split(';')])
-
+                    fg, bg = _apply_escape_seq(''.join(escape_seq), fg, bg)
                     escaped = False
                     escape_seq = []
                 else:
                     escape_seq.append(char)
             else:
-                # draw char on background
-                x = col * img_cell_width
-                y = row * img_cell_height
-
-                draw.rectangle(
-                    [
-                        (x, y,),
-                        (x + img_cell_width, y + img_cell_height,),
-                    ],
-                    fill=bg,
-                )
-                draw.text(
-                    (x, y,),
-                    char,
-                    fill=fg,
-                    font=font,
-                )
-
+                yield row, col, char, fg, bg
                 col += 1
 
+
+def _draw_braille(draw, x, y, cell_width, cell_height, mask, fill):
+    dot_width = cell_width / 2
+    dot_height = cell_height / 4
+    for dot_x, dot_y, bit in BRAILLE_DOTS:
+        if mask & bit:
+            # round dots, a little smaller than their share of the cell.
+            left = x + dot_x * dot_width
+            top = y + dot_y * dot_height
+            draw.ellipse(
+                [
+                    (round(left + dot_width * 0.2), round(top + dot_height * 0.2),),
+                    (round(left + dot_width * 0.8), round(top + dot_height * 0.8),),
+                ],
+                fill=fill,
+            )
+
+
+def _draw_txt_frame(txt, rows, cols, mode='RGB'):
+    """
+    Draws a frame as the terminal would show it. In 'P' mode, colors are
+    drawn as indexes into the x256 palette, so truecolor frames can't be.
+    """
+    font, (img_cell_width, img_cell_height,) = _get_font()
+
+    if mode == 'P':
+        im = Image.new('P', (cols * img_cell_width, rows * img_cell_height,), DEFAULT_BG)
+        im.putpalette(X256_PALETTE)
+
+        def get_color(color):
+            return color
+    else:
+        im = Image.new('RGB', (cols * img_cell_width, rows * img_cell_height,))
+
+        def get_color(color):
+            return color if isinstance(color, tuple) else to_rgb(color)
+
+    draw = ImageDraw.Draw(im)
+    if mode == 'P':
+        # antialiasing would blend palette indexes, not colors.
+        draw.fontmode = '1'
+
+    row = col = -1
+    for row, col, char, fg, bg in parse_txt_frame(txt):
+        # draw char on background
+        x = col * img_cell_width
+        y = row * img_cell_height
+
+        draw.rectangle(
+            [
+                (x, y,),
+                (x + img_cell_width, y + img_cell_height,),
+            ],
+            fill=get_color(bg),
+        )
+        if BRAILLE_BLANK <= char <= u'\u28ff':
+            _draw_braille(draw, x, y, img_cell_width, img_cell_height,
+                ord(char) - ord(BRAILLE_BLANK), get_color(fg))
+            continue
+        if char in BLOCK_PARTS:
+            # drawn exactly, whatever the font makes of them.
+            top, bottom = BLOCK_PARTS[char]
+            draw.rectangle(
+                [
+                    (x, y + round(top * img_cell_height),),
+                    (x + img_cell_width - 1, y + round(bottom * img_cell_height) - 1,),
+                ],
+                fill=get_color(fg),
+            )
+            continue
+        draw.text(
+            (x, y,),
+            char,
+            fill=get_color(fg),
+            font=font,
+        )
+
     actual_rows = row + 1
-    actual_cols = col
+    actual_cols = col + 1
 
     # Chances are there's fewer rows.
-    im = im.crop((0, 0, actual_cols * img_cell_width, actual_rows * img_cell_height))
-    im.save(img_filename)
+    return im.crop((0, 0, actual_cols * img_cell_width, actual_rows * img_cell_height))
+
+
+@timed('export_txt_frame')
+def export_txt_frame(txt_filename, cell_char, rows, cols, codec=DEFAULT_CODEC, **options):
+    # PNG is used because JPG looked a little desaturated. Named the same
+    # whatever the codec, for ffmpeg.
+    img_filename = '{}.txt.png'.format(get_frame_basename(txt_filename, codec))
+
+    txt = read_frame(txt_filename, codec).replace(STORED_CELL_CHAR, cell_char)
+    _draw_txt_frame(txt, rows, cols).save(img_filename)
+
 
+@timed('render_palette_frame')
+def render_palette_frame(txt_filename, cell_char, rows, cols, codec=DEFAULT_CODEC, **options):
+    """
+    Returns the filename, size and pixels of a frame drawn in 'P' mode, to
+    be put back together in the parent process.
+    """
+    txt = read_frame(txt_filename, codec).replace(STORED_CELL_CHAR, cell_char)
+    img = _draw_txt_frame(txt, rows, cols, 'P')
+    return txt_filename, img.size, img.tobytes()
 
-def _get_txt_frames(display_dirname):
+
+def _get_txt_frames(display_dirname, codec=DEFAULT_CODEC):
     return [
         '{}/{}'.format(display_dirname, filename)
-        for filename in get_sorted_filenames(display_dirname, 'txt')
+        for filename in get_sorted_filenames(display_dirname, get_frame_ext(codec))
     ]
 
 
-def _run_ffmpeg(export_filename, display_dirname, stdout, seconds_per_frame):
+def _write_concat_list(display_dirname, frames):
+    """
+    Lists each frame's png along with how long it's shown, for ffmpeg's
+    concat demuxer.
+    """
+    concat_filename = '{}/frames.ffconcat'.format(display_dirname)
+    with open(concat_filename, 'w') as f:
+        f.write('ffconcat version 1.0\n')
+        for frame_name, seconds in frames:
+            f.write("file '{}.txt.png'\nduration {}\n".format(frame_name, seconds))
+        # the last duration is only applied if there's a file after it.
+        f.write("file '{}.txt.png'\n".format(frames[-1][0]))
+    return concat_filename
+
+
+@timed('export_ffmpeg')
+def _run_ffmpeg(export_filename, display_dirname, stdout, seconds_per_frame, frames=None):
     if not os.path.isabs(export_filename):
         export_filename = '{}/{}'.format(os.getcwd(), export_filename)
 
+    if frames:
+        input_args = ['-f', 'concat', '-i', _write_concat_list(display_dirname, frames)]
+    else:
+        input_args = [
+            '-framerate', str(1.0 / seconds_per_frame),
+            '-i', '{}/%04d.txt.png'.format(display_dirname),
+        ]
+
     # convert pngs to .gif using ffmpeg
     cmd = [
         'ffmpeg',
         '-y',
-        '-framerate', str(1.0 / seconds_per_frame),
-        '-i', '{}/%04d.txt.png'.format(display_dirname),
+    ] + input_args + [
         export_filename,
     ]
     p = subprocess.Popen(cmd,
@@ -144,10 +295,385 @@ def _export_txt_frames(txt_frames, cpu_pool_size, stdout, **options):
     pool_abstraction(export_txt_frame, txt_frames, cpu_pool_size, stdout, **options)
 
 
-def export(export_filename, display_dirname, stdout, seconds_per_frame,
-        cpu_pool_size, output_dirnames, **options):
-    txt_frames = _get_txt_frames(display_dirname)
+def get_palette_format(export_filename):
+    """
+    Returns the Pillow format to write `export_filename` in, or None if it
+    isn't one Pillow can animate.
+    """
+    ext = os.path.splitext(export_filename)[1].lower()
+    export_format = Image.registered_extensions().get(ext)
+    if export_format in PALETTE_EXPORT_FORMATS and export_format in Image.SAVE_ALL:
+        return export_format
+    return None
 
-    _export_txt_frames(txt_frames, cpu_pool_size, stdout, **options)
 
-    _run_ffmpeg(export_filename, display_dirname, stdout, seconds_per_frame)
+@timed('export_pil')
+def _save_animation(export_filename, images, durations):
+    export_format = get_palette_format(export_filename)
+    images[0].save(
+        export_filename,
+        format=export_format,
+        save_all=True,
+        append_images=images[1:],
+        duration=[round(seconds * 1000) for seconds in durations],
+        loop=0,
+        # WebP is lossy by default, which would undo the exact colors.
+        **({'lossless': True} if export_format == 'WEBP' else {})
+    )
+
+
+def _export_palette(export_filename, display_dirname, txt_frames, stdout, seconds_per_frame,
+        cpu_pool_size, frames=None, codec=DEFAULT_CODEC, **options):
+    """
+    Draws frames straight into the x256 palette and has Pillow write them
+    out, so colors stay exact and there's no ffmpeg palette pass.
+    """
+    images = {}
+
+    def on_result(result):
+        txt_filename, size, data = result
+        img = Image.frombytes('P', size, data)
+        img.putpalette(X256_PALETTE)
+        images[get_frame_basename(txt_filename, codec)] = img
+
+    pool_abstraction(render_palette_frame, txt_frames, cpu_pool_size, stdout,
+        on_result=on_result, codec=codec, **options)
+
+    if frames:
+        frames = [
+            ('{}/{}'.format(display_dirname, frame_name), seconds,)
+            for frame_name, seconds in frames
+        ]
+    else:
+        frames = [
+            (get_frame_basename(txt_filename, codec), seconds_per_frame,)
+            for txt_filename in txt_frames
+        ]
+
+    if not os.path.isabs(export_filename):
+        export_filename = '{}/{}'.format(os.getcwd(), export_filename)
+    _save_animation(
+        export_filename,
+        [images[basename] for basename, seconds in frames],
+        [seconds for basename, seconds in frames],
+    )
+    stdout.write('Exported to:\n{}\n'.format(export_filename))
+
+
+def _iter_stream(txt_frames, seconds_per_frame, delta=False):
+    """
+    Yields what display() would write for each frame, and for how long it's
+    shown. With `delta`, lines that didn't change are stepped over.
+    """
+    previous_lines = None
+    for txt_frame, seconds in _iter_with_durations(txt_frames, seconds_per_frame):
+        lines = txt_frame.split('\n')
+        if delta and previous_lines is not None and len(lines) == len(previous_lines):
+            yield _get_screen_delta(previous_lines, lines), seconds
+        else:
+            yield ANSI_CURSOR_UP * len(previous_lines or []) + txt_frame + '\n', seconds
+        previous_lines = lines
+
+
+def _get_stream_size(txt_frames):
+    lines = txt_frames[0].split('\n') if len(txt_frames) else []
+    cols = max([len(_ANSI_SGR.sub('', line)) for line in lines] or [0])
+    # the cursor rests on the line below the frame.
+    return cols, len(lines) + 1
+
+
+def _write_asciicast(export_filename, txt_frames, stream):
+    """
+    asciicast v2: a header line, then one [seconds, "o", data] event per
+    frame.
+
+    Events hold what a terminal would receive, after the tty has turned each
+    newline into a carriage return and line feed.
+    """
+    cols, rows = _get_stream_size(txt_frames)
+    with open(export_filename, 'w') as f:
+        f.write(json.dumps({
+            'version': 2,
+            'width': cols,
+            'height': rows,
+            'timestamp': int(time.time()),
+            'env': {'TERM': 'xterm-256color'},
+        }) + '\n')
+        elapsed = 0
+        for data, seconds in stream:
+            f.write(json.dumps([round(elapsed, 6), 'o', data.replace('\n', '\r\n')]) + '\n')
+            elapsed += seconds
+        # the last frame stays up for its duration before styling is reset.
+        f.write(json.dumps([round(elapsed, 6), 'o', ANSI_RESET]) + '\n')
+
+
+def _write_typescript(export_filename, txt_frames, stream):
+    """
+    Raw output in script(1)'s format, timed by a .timing file alongside it
+    for scriptreplay(1).
+    """
+    timing_filename = '{}.timing'.format(os.path.splitext(export_filename)[0])
+    with open(export_filename, 'wb') as f, open(timing_filename, 'w') as timing:
+        f.write('Script started on {}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S')).encode())
+        delay = 0
+        for data, seconds in stream:
+            data = data.encode('utf-8')
+            f.write(data)
+            timing.write('{:.6f} {}\n'.format(delay, len(data)))
+            delay = seconds
+        f.write(ANSI_RESET.encode())
+        timing.write('{:.6f} {}\n'.format(delay, len(ANSI_RESET.encode())))
+
+
+@timed('export_stream')
+def _export_stream(export_filename, display_dirname, stdout, seconds_per_frame, cell_char,
+        frames=None, codec=DEFAULT_CODEC, delta=False):
+    """
+    Concatenates the cached frames into a recording any asciicast player, or
+    scriptreplay(1), can play back as it was displayed.
+    """
+    txt_frames = get_txt_frames(display_dirname, cell_char, frames=frames, codec=codec)
+    stream = _iter_stream(txt_frames, seconds_per_frame, delta)
+
+    if not os.path.isabs(export_filename):
+        export_filename = '{}/{}'.format(os.getcwd(), export_filename)
+    if export_filename.lower().endswith('.cast'):
+        _write_asciicast(export_filename, txt_frames, stream)
+    else:
+        _write_typescript(export_filename, txt_frames, stream)
+    stdout.write('Exported to:\n{}\n'.format(export_filename))
+
+
+def _get_hex_color(color):
+    return '#{:02x}{:02x}{:02x}'.format(*(color if isinstance(color, tuple) else to_rgb(color)))
+
+
+def _iter_runs(txt):
+    """
+    Like parse_txt_frame(), but yields (row, col, text, fg, bg) for each run
+    of characters on a row that share their colors.
+    """
+    run = None
+    for row, col, char, fg, bg in parse_txt_frame(txt):
+        if run is not None and (run[0], run[3], run[4],) == (row, fg, bg,):
+            run[2].append(char)
+            continue
+        if run is not None:
+            yield run[0], run[1], ''.join(run[2]), run[3], run[4]
+        run = [row, col, [char], fg, bg]
+    if run is not None:
+        yield run[0], run[1], ''.join(run[2]), run[3], run[4]
+
+
+class _ColorClasses(object):
+    """
+    Gives each distinct color one short CSS class name, whichever of x256 or
+    truecolor it came from. The terminal's default colors don't need one.
+    Rules are only made for the ways each color is used, e.g. a color only
+    ever used as a foreground has no background rule.
+    """
+
+    def __init__(self):
+        self.names = {}
+        # (prefix, hex color) pairs in the order they were first used.
+        self.used = {}
+
+    def get(self, prefix, color, default):
+        if color == default:
+            return []
+        hex_color = _get_hex_color(color)
+        if hex_color not in self.names:
+            self.names[hex_color] = str(len(self.names))
+        self.used[(prefix, hex_color,)] = True
+        return [prefix + self.names[hex_color]]
+
+    def get_css(self, properties):
+        """
+        `properties` maps each class prefix used to the CSS property it sets.
+        """
+        return ''.join(
+            '.{}{}{{{}:{}}}'.format(prefix, self.names[hex_color], properties[prefix], hex_color)
+            for prefix, hex_color in self.used
+        )
+
+
+def _get_html_frame(txt, classes):
+    parts = []
+    current_row = 0
+    for row, col, text, fg, bg in _iter_runs(txt):
+        parts.append('\n' * (row - current_row))
+        current_row = row
+        names = classes.get('f', fg, DEFAULT_FG) + classes.get('b', bg, DEFAULT_BG)
+        text = html.escape(text)
+        parts.append(
+            '<span class="{}">{}</span>'.format(' '.join(names), text) if names else text)
+    return ''.join(parts)
+
+
+def _get_svg_frame(txt, classes):
+    cell_width, cell_height = SVG_CELL_SIZE
+    parts = []
+    for row, col, text, fg, bg in _iter_runs(txt):
+        x = col * cell_width
+        y = row * cell_height
+        width = len(text) * cell_width
+        # SVG fills both, so one class per color will do.
+        for name in classes.get('c', bg, DEFAULT_BG):
+            parts.append('<rect class="{}" x="{}" y="{}" width="{}" height="{}"/>'.format(
+                name, x, y, width, cell_height))
+        if text.strip():
+            parts.append('<text{} x="{}" y="{}" textLength="{}">{}</text>'.format(
+                ''.join(' class="{}"'.format(name) for name in classes.get('c', fg, DEFAULT_FG)),
+                x, y + SVG_FONT_SIZE, width, html.escape(text)))
+    return ''.join(parts)
+
+
+def _get_keyframes(frames):
+    """
+    `frames` is a list of (frame id, seconds) in the order they're shown.
+    Returns the loop's length, and CSS keyframes for each frame id that
+    only show it when it's due.
+    """
+    total = sum(seconds for frame_id, seconds in frames) or 1
+    steps = {}
+    elapsed = 0
+    for frame_id, seconds in frames:
+        frame_steps = steps.setdefault(frame_id, [])
+        start = round(100 * elapsed / total, 4)
+        elapsed += seconds
+        end = round(100 * elapsed / total, 4)
+        if frame_steps and frame_steps[-1] == (start, 'hidden',):
+            # shown again straight away.
+            frame_steps[-1] = (end, 'hidden',)
+        else:
+            frame_steps += [(start, 'visible',), (end, 'hidden',)]
+
+    return total, ''.join(
+        '@keyframes {0}{{{1}}}#{0}{{animation-name:{0}}}'.format(frame_id, ''.join(
+            '{:g}%{{visibility:{}}}'.format(percent, visibility)
+            for percent, visibility in frame_steps
+        ))
+        for frame_id, frame_steps in steps.items()
+    )
+
+
+def _read_markup_frames(display_dirname, cell_char, seconds_per_frame, frames=None,
+        codec=DEFAULT_CODEC):
+    if frames is None:
+        frames = [
+            (os.path.basename(get_frame_basename(txt_filename, codec)), seconds_per_frame,)
+            for txt_filename in _get_txt_frames(display_dirname, codec)
+        ]
+    txts = {}
+    for frame_name, seconds in frames:
+        if frame_name not in txts:
+            txts[frame_name] = read_frame(
+                get_frame_filename(display_dirname, frame_name, codec), codec,
+            ).replace(STORED_CELL_CHAR, cell_char)
+    return frames, txts
+
+
+@timed('render_markup')
+def render_markup(display_dirname, cell_char, seconds_per_frame, markup_format='html',
+        frames=None, codec=DEFAULT_CODEC):
+    """
+    Returns a self contained HTML page or SVG image of the animation. Each
+    distinct frame is written once, with a CSS animation showing it
+    whenever it's due.
+    """
+    frames, txts = _read_markup_frames(
+        display_dirname, cell_char, seconds_per_frame, frames, codec)
+    frame_ids = {
+        frame_name: 'k{}'.format(i)
+        for i, frame_name in enumerate(txts)
+    }
+    total, keyframes = _get_keyframes([
+        (frame_ids[frame_name], seconds,)
+        for frame_name, seconds in frames
+    ])
+    classes = _ColorClasses()
+    lines = [
+        txt.split('\n')
+        for txt in txts.values()
+    ]
+    rows = max(len(frame_lines) for frame_lines in lines) if lines else 0
+    cols = max([
+        len(_ANSI_SGR.sub('', line))
+        for frame_lines in lines
+        for line in frame_lines
+    ] or [0])
+    common_css = 'visibility:hidden;animation:{:g}s step-end infinite'.format(round(total, 6))
+
+    if markup_format == 'svg':
+        body = ''.join(
+            '<g id="{}">{}</g>'.format(frame_ids[frame_name], _get_svg_frame(txt, classes))
+            for frame_name, txt in txts.items()
+        )
+        width = cols * SVG_CELL_SIZE[0]
+        height = rows * SVG_CELL_SIZE[1]
+        return (
+            '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+            'viewBox="0 0 {0} {1}" xml:space="preserve"><style>'
+            'svg{{background:{2}}}text{{fill:{3};font:{4}px monospace}}g{{{5}}}{6}{7}'
+            '</style><rect width="100%" height="100%" fill="{2}"/>{8}</svg>\n'
+        ).format(width, height, _get_hex_color(DEFAULT_BG), _get_hex_color(DEFAULT_FG),
+            SVG_FONT_SIZE, common_css, classes.get_css({'c': 'fill'}), keyframes, body)
+
+    body = ''.join(
+        '<pre id="{}">{}</pre>'.format(frame_ids[frame_name], _get_html_frame(txt, classes))
+        for frame_name, txt in txts.items()
+    )
+    return (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><style>'
+        'div{{position:relative;width:{0}ch;height:{1}em;background:{2};color:{3};'
+        'font:1em/1.25 monospace}}pre{{position:absolute;margin:0;font:inherit;{4}}}{5}{6}'
+        '</style></head><body><div>{7}</div></body></html>\n'
+    ).format(cols, rows * 1.25, _get_hex_color(DEFAULT_BG), _get_hex_color(DEFAULT_FG),
+        common_css, classes.get_css({'f': 'color', 'b': 'background'}), keyframes, body)
+
+
+def _export_markup(export_filename, display_dirname, stdout, seconds_per_frame, cell_char,
+        frames=None, codec=DEFAULT_CODEC):
+    markup_format = MARKUP_EXPORT_FORMATS[os.path.splitext(export_filename)[1].lower()]
+    markup = render_markup(display_dirname, cell_char, seconds_per_frame, markup_format,
+        frames=frames, codec=codec)
+
+    if not os.path.isabs(export_filename):
+        export_filename = '{}/{}'.format(os.getcwd(), export_filename)
+    with open(export_filename, 'w', encoding='utf-8') as f:
+        f.write(markup)
+    stdout.write('Exported to:\n{}\n'.format(export_filename))
+
+
+def export(export_filename, display_dirname, stdout, seconds_per_frame,
+        cpu_pool_size, output_dirnames, frames=None, codec=DEFAULT_CODEC, display_mode=None,
+        delta=False, **options):
+    """
+    `frames`, if given, is a list of [frame name, seconds] as saved to
+    config.json, so repeated frames are only drawn once.
+
+    Display modes that only use the 256 color palette are written by Pillow
+    when it supports `export_filename`'s format, everything else by ffmpeg.
+    .cast and .ans files are recordings of the text itself, optionally
+    `delta` encoded, and .html and .svg files mark it up.
+    """
+    ext = os.path.splitext(export_filename)[1].lower()
+    if ext in STREAM_EXPORT_EXTS:
+        _export_stream(export_filename, display_dirname, stdout, seconds_per_frame,
+            options['cell_char'], frames=frames, codec=codec, delta=delta)
+        return
+    if ext in MARKUP_EXPORT_FORMATS:
+        _export_markup(export_filename, display_dirname, stdout, seconds_per_frame,
+            options['cell_char'], frames=frames, codec=codec)
+        return
+
+    txt_frames = _get_txt_frames(display_dirname, codec)
+
+    if display_mode in PALETTE_DISPLAY_MODES and get_palette_format(export_filename):
+        _export_palette(export_filename, display_dirname, txt_frames, stdout,
+            seconds_per_frame, cpu_pool_size, frames=frames, codec=codec, **options)
+        return
+
+    _export_txt_frames(txt_frames, cpu_pool_size, stdout, codec=codec, **options)
+
+    _run_ffmpeg(export_filename, display_dirname, stdout, seconds_per_frame, frames)
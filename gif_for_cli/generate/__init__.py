@@ -14,26 +14,80 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 from collections import OrderedDict
+import functools
+import glob
+import hashlib
+import itertools
 import json
 import math
+import os
 import re
+import shutil
 import subprocess
+import time
 
-from PIL import Image
+from PIL import Image, ImageSequence
 
-from ..constants import ANSI_RESET, NOCOLOR_CHARS
+from ..constants import (
+    ANSI_RESET,
+    BRAILLE_MODES,
+    DEFAULT_CODEC,
+    DEFAULT_COLOR_SPACE,
+    DEFAULT_DITHER,
+    DISPLAY_MODES,
+    HALF_BLOCK_MODES,
+)
+from ..instrument import timed, timer
+from ..storage import get_frame_filename, write_frame
 from ..utils import get_sorted_filenames, pool_abstraction
 
+from .color import get_256_indexes, get_linear_cell_grid
+from .manifest import (
+    get_missing_modes,
+    load_manifest,
+    mark_extracted,
+    mark_frame,
+    save_manifest,
+    update_complete,
+)
+from .shared_frames import SharedFrameRing, get_shared_frame, shared_memory
 from .utils import (
-    get_gray,
+    get_gray_histogram,
+    get_nocolor_table,
+    get_256_bg,
     get_256_cell,
+    get_256_fg,
+    get_256_index,
+    get_256_index_cell,
     get_256fgbg_cell,
+    get_256fgbg_oklab_cell,
+    get_braille_lines,
+    get_colored_line,
+    get_half_block_line,
+    get_truecolor_bg,
     get_truecolor_cell,
+    get_truecolor_fg,
     get_avg_for_em,
 )
 
 
-def _save_config(num_frames, seconds, **options):
+class EmptyWindowError(Exception):
+    """
+    Raised when --start and --duration leave no frames to show, before
+    anything is cached for them.
+    """
+
+    def __init__(self, start=0, duration=None):
+        super().__init__('No frames are shown from {:g}s{}, is --start past the end of the clip?'
+            .format(start or 0, '' if duration is None else ' for {:g}s'.format(duration)))
+
+
+def _check_window(num_frames, start=0, duration=None):
+    if not num_frames:
+        raise EmptyWindowError(start, duration)
+
+
+def _save_config(num_frames, seconds, durations=None, frames=None, **options):
     d = {
         key: options.get(key)
         for key in [
@@ -42,25 +96,94 @@ def _save_config(num_frames, seconds, **options):
             'cols',
             'cell_width',
             'cell_height',
+            'color_space',
+            'area_scale',
+            'equalize',
+            'dither',
+            'nocolor_table',
+            'codec',
+            'start',
+            'duration',
         ]
     }
     d['num_frames'] = num_frames
     d['seconds'] = seconds
+    d['durations'] = durations
+    if frames is not None:
+        d['frames'] = frames
 
     with open('{}/config.json'.format(options['output_dirnames']['.']), 'w') as f:
         json.dump(d, f)
 
 
-def _run_ffmpeg(input_source_file, output_dirnames, cols, rows, cell_width,
-        cell_height, **options):
+def _get_ffmpeg_filter(cols, rows, cell_width, cell_height, area_scale=False):
     scale_width = cols * cell_width
     scale_height = rows * cell_height
 
+    if not area_scale:
+        return 'scale=w={}:h={}:force_original_aspect_ratio=decrease'.format(
+            scale_width, scale_height)
+
+    # Fit to the same size as above, then average each cell down to a single
+    # pixel in one go. Partial cells at the edges are dropped, like
+    # get_cell_grid() trims them.
+    scale = 'min({}/iw,{}/ih)'.format(scale_width, scale_height)
+    return "scale=w='trunc({scale}*iw/{cw})':h='trunc({scale}*ih/{ch})':flags=area".format(
+        scale=scale, cw=cell_width, ch=cell_height)
+
+
+def _get_seek_args(start=0, duration=None):
+    # before -i, so ffmpeg seeks to the nearest keyframe instead of decoding
+    # everything up to `start`.
+    args = []
+    if start:
+        args += ['-ss', str(start)]
+    if duration is not None:
+        args += ['-t', str(duration)]
+    return args
+
+
+def _clip_to_window(items, start=0, duration=None):
+    """
+    Takes (item, seconds) pairs played one after another, and yields the
+    ones shown during the `duration` seconds from `start`, with their
+    seconds cut down to what's inside it.
+    """
+    start = start or 0
+    end = None if duration is None else round(start + duration, 6)
+    t = 0
+    for item, seconds in items:
+        # rounded, so an item ending right at `start` isn't let in by float
+        # error with 0 seconds left.
+        item_start, t = t, round(t + seconds, 6)
+        if end is not None and item_start >= end:
+            return
+        if t <= start:
+            continue
+        if item_start < start or (end is not None and t > end):
+            # only part of it is inside the window.
+            seconds = round((t if end is None else min(t, end)) - max(item_start, start), 6)
+        if seconds > 0:
+            yield item, seconds
+
+
+@timed('ffmpeg')
+def _run_ffmpeg(input_source_file, output_dirnames, cols, rows, cell_width,
+        cell_height, area_scale=False, start=0, duration=None, **options):
     cmd = [
-        'ffmpeg',
+        # frames left by an earlier run get overwritten rather than prompted about.
+        'ffmpeg', '-y',
+    ] + _get_seek_args(start, duration) + [
         '-i', input_source_file,
-        '-vf', 'scale=w={}:h={}:force_original_aspect_ratio=decrease'.format(
-            scale_width, scale_height),
+        '-vf', _get_ffmpeg_filter(cols, rows, cell_width, cell_height, area_scale),
+        # one jpg per source frame, rather than repeating frames to make up
+        # a constant frame rate.
+        '-vsync', 'passthrough',
+    ]
+    if area_scale:
+        # Each pixel is a whole cell, so chroma can't be shared between them.
+        cmd += ['-pix_fmt', 'yuvj444p', '-q:v', '2']
+    cmd += [
         '{}/%04d.jpg'.format(output_dirnames['jpg']),
     ]
     p = subprocess.Popen(cmd,
@@ -70,104 +193,1048 @@ def _run_ffmpeg(input_source_file, output_dirnames, cols, rows, cell_width,
     out, err = p.communicate()
     err = err.decode('utf8')
 
-    num_frames = int(re.search(r'frame=\s*(\d+)', err).group(1))
-    hours, minutes, seconds = re.search(r'time=(\d{2}):(\d{2}):(\d{2}.\d{2})', err).groups()
+    # neither is printed when nothing was output, e.g. seeking past the end.
+    frame_match = re.search(r'frame=\s*(\d+)', err)
+    time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2}.\d{2})', err)
+    if frame_match is None or time_match is None:
+        return 0, 0
+    num_frames = int(frame_match.group(1))
+    hours, minutes, seconds = time_match.groups()
     seconds = float(seconds) + (int(minutes) * 60) + (int(hours) * 3600)
     return num_frames, seconds
 
 
+# Like browsers, GIF frames with shorter delays than this are shown for
+# DEFAULT_FRAME_SECONDS instead.
+MIN_GIF_FRAME_SECONDS = 0.02
+DEFAULT_FRAME_SECONDS = 0.1
+
+
+def _get_gif_frame_seconds(frame):
+    seconds = frame.info.get('duration', 0) / 1000
+    return DEFAULT_FRAME_SECONDS if seconds < MIN_GIF_FRAME_SECONDS else seconds
+
+
+def _get_gif_durations(input_source_file, start=0, duration=None):
+    try:
+        img = Image.open(input_source_file)
+    except (OSError, ValueError):
+        return None
+
+    with img:
+        if img.format != 'GIF':
+            return None
+        return _get_pil_durations(img, start, duration)
+
+
+def _get_pil_durations(img, start=0, duration=None):
+    return [
+        seconds
+        for frame, seconds in _clip_to_window(
+            ((None, _get_gif_frame_seconds(frame),) for frame in ImageSequence.Iterator(img)),
+            start,
+            duration,
+        )
+    ]
+
+
+@timed('ffprobe')
+def _run_ffprobe(input_source_file, start=0, duration=None):
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'frame=best_effort_timestamp_time,pkt_duration_time,duration_time',
+        '-of', 'json',
+    ]
+    if start or duration is not None:
+        cmd += ['-read_intervals', '{}%{}'.format(
+            start, '' if duration is None else '+{}'.format(duration))]
+    cmd += [
+        input_source_file,
+    ]
+    try:
+        p = subprocess.Popen(cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except OSError:
+        return None
+    out, err = p.communicate()
+    if p.returncode != 0:
+        return None
+
+    try:
+        frames = json.loads(out.decode('utf8'))['frames']
+        timestamps = [float(frame['best_effort_timestamp_time']) for frame in frames]
+    except (ValueError, KeyError):
+        return None
+    if not frames:
+        return None
+
+    durations = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    last = frames[-1].get('duration_time') or frames[-1].get('pkt_duration_time')
+    if last:
+        durations.append(float(last))
+    else:
+        durations.append(durations[-1] if durations else DEFAULT_FRAME_SECONDS)
+
+    # -read_intervals starts from the keyframe before `start`, ffmpeg only
+    # outputs the frames from `start` on.
+    end = None if duration is None else start + duration
+    return [
+        seconds
+        for timestamp, seconds in zip(timestamps, durations)
+        if timestamp >= start and (end is None or timestamp < end)
+    ] or None
+
+
+def _get_durations(input_source_file, num_frames, start=0, duration=None):
+    """
+    Returns how long each of the `num_frames` extracted frames is shown for,
+    or None if that can't be worked out, in which case they're played
+    evenly spaced.
+    """
+    durations = _get_gif_durations(input_source_file, start, duration)
+    if durations is None:
+        durations = _run_ffprobe(input_source_file, start, duration)
+
+    if durations is None or len(durations) != num_frames:
+        return None
+    return durations
+
+
+def _extract_with_ffmpeg(**options):
+    num_frames, seconds = _run_ffmpeg(**options)
+    frame_names = _get_frame_names(options['output_dirnames']['jpg'])
+
+    durations = _get_durations(options['input_source_file'], len(frame_names),
+        options.get('start', 0), options.get('duration'))
+    if durations is not None:
+        seconds = sum(durations)
+    return num_frames, seconds, durations
+
+
+def _decode_with_pil(input_source_file, output_dirnames, cols, rows, cell_width, cell_height,
+        **options):
+    """
+    Yields the name, scaled RGB image, and duration of each frame of a GIF,
+    once it's been saved to the jpg dir.
+    """
+    max_size = (cols * cell_width, rows * cell_height,)
+    area_scale = options.get('area_scale', False)
+
+    with Image.open(input_source_file) as img:
+        # frames before the window are still decoded, as GIF frames build on
+        # the ones before them, but nothing's done with them.
+        frames = _clip_to_window(
+            ((frame, _get_gif_frame_seconds(frame),) for frame in ImageSequence.Iterator(img)),
+            options.get('start', 0),
+            options.get('duration'),
+        )
+        for i in itertools.count():
+            with timer('pil_decode'):
+                try:
+                    frame, seconds = next(frames)
+                except StopIteration:
+                    return
+
+                frame = frame.convert('RGB')
+                if area_scale:
+                    frame = frame.resize(
+                        _get_area_size(frame.size, max_size, cell_width, cell_height), Image.BOX)
+                else:
+                    size = _fit_size(frame.size, max_size)
+                    if size != frame.size:
+                        frame = frame.resize(size, Image.BICUBIC)
+                frame_name = '{:04d}'.format(i + 1)
+                frame.save('{}/{}.jpg'.format(output_dirnames['jpg'], frame_name), quality=95,
+                    subsampling=0 if area_scale else -1)
+
+            yield frame_name, frame, seconds
+
+
+def _extract_with_pil(input_source_file, output_dirnames, cols, rows, cell_width,
+        cell_height, **options):
+    """
+    Decodes a GIF in this process, which for small GIFs is much quicker than
+    starting ffmpeg. Frames are scaled the same way as with ffmpeg.
+    """
+    durations = [
+        seconds
+        for frame_name, frame, seconds in _decode_with_pil(
+            input_source_file, output_dirnames, cols, rows, cell_width, cell_height, **options)
+    ]
+    return len(durations), sum(durations), durations
+
+
+DECODER_BACKENDS = OrderedDict([
+    ('ffmpeg', _extract_with_ffmpeg),
+    ('pil', _extract_with_pil),
+])
+
+
+def _is_local_gif(input_source_file):
+    try:
+        with open(input_source_file, 'rb') as f:
+            return f.read(6) in (b'GIF87a', b'GIF89a')
+    except OSError:
+        return False
+
+
+def get_decoder(input_source_file, decoder='auto'):
+    """
+    Returns the name of the decoder to extract frames with. 'auto' picks PIL
+    for local GIFs, and ffmpeg for anything else (e.g. mp4s and URLs).
+    """
+    if decoder != 'auto':
+        return decoder
+    return 'pil' if _is_local_gif(input_source_file) else 'ffmpeg'
+
+
+def _fit_size(size, max_size):
+    """
+    Mirrors ffmpeg's force_original_aspect_ratio=decrease.
+    """
+    width, height = size
+    max_width, max_height = max_size
+    scale = min(max_width / width, max_height / height)
+    return (
+        max(1, round(width * scale)),
+        max(1, round(height * scale)),
+    )
+
+
+def _get_area_size(size, max_size, cell_width, cell_height):
+    """
+    Mirrors the area scaling filter from _get_ffmpeg_filter().
+    """
+    width, height = size
+    max_width, max_height = max_size
+    scale = min(max_width / width, max_height / height)
+    return (
+        max(1, int(scale * width / cell_width)),
+        max(1, int(scale * height / cell_height)),
+    )
+
+
 def convert_frame(frame_name, **options):
-    cell_height = options['cell_height']
-    cell_width = options['cell_width']
     output_dirnames = options['output_dirnames']
 
     # for each frame, generate text file with ANSI colors
-    img = Image.open('{}/{}.jpg'.format(output_dirnames['jpg'], frame_name))
+    with timer('image_load'):
+        img = Image.open('{}/{}.jpg'.format(output_dirnames['jpg'], frame_name))
+        img.load()
+
+    return _convert_loaded_frame(img, frame_name, **options)
+
+
+def convert_shared_frame(item, **options):
+    """
+    Like convert_frame(), for `item`s of (frame name, frame, modes) from
+    _stream_frames(). The frame is either an image, or where to find one
+    with get_shared_frame(), and modes are what each entry is missing.
+    """
+    frame_name, frame, modes = item
+    if isinstance(frame, Image.Image):
+        img = frame
+    else:
+        with timer('image_load'):
+            img = get_shared_frame(frame)
+
+    return _convert_loaded_frame(img, frame_name, **dict(
+        options,
+        modes=list(modes[0]),
+        variants=[
+            dict(variant, modes=list(variant_modes))
+            for variant, variant_modes in zip(options.get('variants', ()), modes[1:])
+        ],
+    ))
+
+
+def _convert_loaded_frame(img, frame_name, **options):
+    digests = [convert_img(img, frame_name, **options)]
+
+    # Smaller sizes are derived from the same decoded pixels, rather than
+    # running ffmpeg again for each of them.
+    for variant in options.get('variants', ()):
+        digests.append(convert_variant(img, frame_name, **variant))
+
+    return frame_name, digests
+
+
+def convert_variant(img, frame_name, **options):
+    if not options.get('modes', DISPLAY_MODES):
+        return None
+
+    if options.get('area_scale'):
+        # Already one pixel per cell, and variants share the cell size.
+        size = _fit_size(img.size, (options['cols'], options['rows'],))
+        if size != img.size:
+            img = img.resize(size, Image.BOX)
+        return convert_img(img, frame_name, **options)
+
+    size = _fit_size(img.size, (
+        options['cols'] * options['cell_width'],
+        options['rows'] * options['cell_height'],
+    ))
+    if size != img.size:
+        img = img.resize(size, Image.BICUBIC)
+    return convert_img(img, frame_name, **options)
+
+
+def get_cell_grid(img, cell_width, cell_height, color_space=DEFAULT_COLOR_SPACE):
+    """
+    Returns rows of averaged [r, g, b] colors, one for each cell.
+    """
+    if color_space != 'srgb':
+        return get_linear_cell_grid(img, cell_width, cell_height)
+
     px = img.load()
     width, height = img.size
     # trim image if needed.
     width = width - (width % cell_width)
     height = height - (height % cell_height)
-    cols = math.floor(width / cell_width)
-
-    chars_nocolor = []
-    lines_256 = []
-    lines_256fgbg = []
-    lines_truecolor = []
-
-    for y in range(0, height, cell_height):
-        line_256 = []
-        line_256fgbg = []
-        line_truecolor = []
-        for x in range(0, width, cell_width):
-            rgb = get_avg_for_em(px, x, y, cell_height, cell_width)
-
-            chars_nocolor.append(get_gray(*rgb))
-            line_256.append(get_256_cell(*rgb))
-            line_256fgbg.append(get_256fgbg_cell(*rgb))
-            line_truecolor.append(get_truecolor_cell(*rgb))
-
-        lines_256.append(''.join(line_256))
+
+    return [
+        [
+            get_avg_for_em(px, x, y, cell_height, cell_width)
+            for x in range(0, width, cell_width)
+        ]
+        for y in range(0, height, cell_height)
+    ]
+
+
+def get_pixel_grid(img):
+    """
+    Returns rows of [r, g, b] colors for frames that were already scaled to
+    one pixel per cell.
+    """
+    width = img.size[0]
+    pixels = [list(rgb) for rgb in img.convert('RGB').getdata()]
+    return [
+        pixels[i:i + width]
+        for i in range(0, len(pixels), width)
+    ]
+
+
+def get_half_cell_grid(img, cell_width, cell_height, color_space=DEFAULT_COLOR_SPACE):
+    """
+    Like get_cell_grid(), but with two rows of colors for each row of cells,
+    averaged over their top and bottom halves.
+    """
+    cols = img.size[0] // cell_width
+    rows = img.size[1] // cell_height
+    img = img.convert('RGB').crop((0, 0, cols * cell_width, rows * cell_height,))
+    if cell_height % 2:
+        # Doubling each row of pixels splits odd height cells evenly.
+        img = img.resize((img.size[0], img.size[1] * 2,), Image.NEAREST)
+        cell_height *= 2
+
+    if color_space != 'srgb':
+        return get_linear_cell_grid(img, cell_width, cell_height // 2)
+    return get_pixel_grid(img.reduce((cell_width, cell_height // 2,)))
+
+
+def get_braille_dots(img, cols, rows, cell_width, cell_height):
+    """
+    Scales each cell down to 2x4 pixels, and dithers them to on or off.
+    """
+    img = img.convert('L').crop((0, 0, cols * cell_width, rows * cell_height,))
+    return img.resize((cols * 2, rows * 4,), Image.BOX).convert('1')
+
+
+def _render_nocolor(grid, nocolor_table=None, **options):
+    # Without a table for the whole clip, the gray levels are divided up
+    # between characters for just this frame.
+    if nocolor_table is None:
+        nocolor_table = get_nocolor_table(get_gray_histogram(grid))
+
+    return [
+        ''.join(nocolor_table[r + g + b] for r, g, b in row)
+        for row in grid
+    ]
+
+
+def _matches_whole_grid(color_space=DEFAULT_COLOR_SPACE, dither=DEFAULT_DITHER):
+    # Otherwise, each cell is matched on its own, which is memoized.
+    return color_space == 'oklab' or dither not in (None, DEFAULT_DITHER)
+
+
+def _get_256_indexes(grid, color_space=DEFAULT_COLOR_SPACE, dither=DEFAULT_DITHER):
+    if _matches_whole_grid(color_space, dither):
+        return get_256_indexes(grid, color_space, dither)
+    return [
+        [get_256_index(*rgb) for rgb in row]
+        for row in grid
+    ]
+
+
+def _render_256(grid, color_space=DEFAULT_COLOR_SPACE, dither=DEFAULT_DITHER, **options):
+    if _matches_whole_grid(color_space, dither):
+        return [
+            ''.join(get_256_index_cell(index) for index in row)
+            for row in get_256_indexes(grid, color_space, dither)
+        ]
+
+    return [
+        ''.join(get_256_cell(*rgb) for rgb in row)
+        for row in grid
+    ]
+
+
+def _render_256fgbg(grid, color_space=DEFAULT_COLOR_SPACE, **options):
+    get_cell = get_256fgbg_oklab_cell if color_space == 'oklab' else get_256fgbg_cell
+    return [
         # This output mode can leak the BG color to extra columns.
-        lines_256fgbg.append(''.join(line_256fgbg) + ANSI_RESET)
-        lines_truecolor.append(''.join(line_truecolor))
-
-    # We need to divide up the gray colors into roughly equal buckets,
-    # without adding numpy as a dependency just for the histogram function.
-    num_cells_per_char = len(chars_nocolor) / len(NOCOLOR_CHARS)
-    char_counts = OrderedDict()
-    for cell in sorted(chars_nocolor):
-        char_counts[cell] = char_counts.get(cell, 0) + 1
-    cur_count = 0
-    cur_char_idx = 0
-    char_idxs = {}
-    for cell, cell_num in char_counts.items():
-        if cur_count > num_cells_per_char:
-            cur_count = 0
-            cur_char_idx += 1
-        char_idxs[cell] = cur_char_idx
-        cur_count += cell_num
-
-    lines_nocolor = []
-    line_nocolor = None
-    for i, gray in enumerate(chars_nocolor):
-        if not line_nocolor:
-            line_nocolor = []
-
-        line_nocolor.append(NOCOLOR_CHARS[char_idxs[gray]])
-
-        if (i + 1) % cols == 0:
-            lines_nocolor.append(''.join(line_nocolor))
-            line_nocolor = None
-
-    with open('{}/{}.txt'.format(output_dirnames['nocolor'], frame_name), 'w') as f:
-        f.write('\n'.join(lines_nocolor))
-
-    with open('{}/{}.txt'.format(output_dirnames['256'], frame_name), 'w') as f:
-        f.write('\n'.join(lines_256))
-
-    with open('{}/{}.txt'.format(output_dirnames['256fgbg'], frame_name), 'w') as f:
-        f.write('\n'.join(lines_256fgbg))
-
-    with open('{}/{}.txt'.format(output_dirnames['truecolor'], frame_name), 'w') as f:
-        f.write('\n'.join(lines_truecolor))
-
-
-def _convert_frames(cpu_pool_size, stdout, **options):
+        ''.join(get_cell(*rgb) for rgb in row) + ANSI_RESET
+        for row in grid
+    ]
+
+
+def _render_truecolor(grid, **options):
+    return [
+        ''.join(get_truecolor_cell(*rgb) for rgb in row)
+        for row in grid
+    ]
+
+
+def _render_half_blocks(half_grid, colors, get_fg, get_bg):
+    return [
+        get_half_block_line(colors[i], colors[i + 1], get_fg, get_bg)
+        for i in range(0, len(half_grid) - 1, 2)
+    ]
+
+
+def _render_256half(half_grid, color_space=DEFAULT_COLOR_SPACE, dither=DEFAULT_DITHER,
+        **options):
+    colors = _get_256_indexes(half_grid, color_space, dither)
+    return _render_half_blocks(half_grid, colors, get_256_fg, get_256_bg)
+
+
+def _render_truecolorhalf(half_grid, **options):
+    colors = [
+        [tuple(rgb) for rgb in row]
+        for row in half_grid
+    ]
+    return _render_half_blocks(half_grid, colors, get_truecolor_fg, get_truecolor_bg)
+
+
+def _render_braille(grid, braille_lines=None, **options):
+    return braille_lines
+
+
+def _render_256braille(grid, braille_lines=None, color_space=DEFAULT_COLOR_SPACE,
+        dither=DEFAULT_DITHER, **options):
+    return [
+        get_colored_line(line, indexes, get_256_fg)
+        for line, indexes in zip(braille_lines, _get_256_indexes(grid, color_space, dither))
+    ]
+
+
+RENDERERS = OrderedDict([
+    ('nocolor', _render_nocolor),
+    ('256', _render_256),
+    ('256fgbg', _render_256fgbg),
+    ('truecolor', _render_truecolor),
+    # These are given a grid with twice the rows, see get_half_cell_grid().
+    ('256half', _render_256half),
+    ('truecolorhalf', _render_truecolorhalf),
+    # These are also given braille_lines, see get_braille_lines().
+    ('braille', _render_braille),
+    ('256braille', _render_256braille),
+])
+
+
+def get_sub_cell_img(img, cols, rows, cell_width, cell_height):
+    """
+    Scales each cell down to 2x4 pixels, the most detail any display mode
+    draws inside a cell (braille dots, and half blocks).
+    """
+    img = img.convert('RGB').crop((0, 0, cols * cell_width, rows * cell_height,))
+    return img.resize((cols * 2, rows * 4,), Image.BOX)
+
+
+def get_grid_digest(grid, sub_cell_img=None):
+    """
+    Frames whose cells all average to within a few levels of each other get
+    the same digest, so they're treated as the same frame. With
+    `sub_cell_img`, from get_sub_cell_img(), what's inside the cells has to
+    be within a few levels too.
+    """
+    m = hashlib.md5(bytes(
+        n >> 2
+        for row in grid
+        for rgb in row
+        for n in rgb
+    ))
+    if sub_cell_img is not None:
+        m.update(sub_cell_img.point(lambda n: n >> 2).tobytes())
+    return m.hexdigest()
+
+
+# (output dirname, digest) -> frame name, for frames this process has
+# already written. Each pool worker has its own.
+_written_digests = {}
+
+
+def reset_written_digests():
+    _written_digests.clear()
+
+
+def convert_img(img, frame_name, **options):
+    """
+    Writes a .txt frame for each of `modes` (all display modes by default),
+    and returns the digest of its cells, see get_grid_digest().
+
+    Frames that repeat one this process already wrote aren't rendered again,
+    they're removed in favor of the earlier one once every frame is done.
+    """
     output_dirnames = options['output_dirnames']
+    modes = options.get('modes', DISPLAY_MODES)
+    color_space = options.get('color_space', DEFAULT_COLOR_SPACE)
+    codec = options.get('codec', DEFAULT_CODEC)
+
+    if not modes:
+        return None
+
+    if options.get('area_scale'):
+        grid = get_pixel_grid(img)
+    else:
+        grid = get_cell_grid(img, options['cell_width'], options['cell_height'], color_space)
+
+    # One digest stands for the frame in every mode, whichever of them are
+    # being written now, so it covers the half block and braille modes'
+    # detail even when only whole cells are drawn. With area_scale there's
+    # nothing inside a cell.
+    sub_cell_img = None
+    if not options.get('area_scale'):
+        rows = len(grid)
+        cols = len(grid[0]) if rows else 0
+        sub_cell_img = get_sub_cell_img(img, cols, rows, options['cell_width'],
+            options['cell_height'])
+    digest = get_grid_digest(grid, sub_cell_img)
+    key = (output_dirnames[modes[0]], digest,)
+    if key in _written_digests:
+        return digest
+    _written_digests[key] = frame_name
+
+    half_grid = None
+    if any(mode in HALF_BLOCK_MODES for mode in modes):
+        if options.get('area_scale'):
+            # There's only one pixel per cell to work with.
+            half_grid = [row for row in grid for i in range(2)]
+        else:
+            half_grid = get_half_cell_grid(img, options['cell_width'], options['cell_height'],
+                color_space)
+
+    braille_lines = None
+    if any(mode in BRAILLE_MODES for mode in modes):
+        rows = len(grid)
+        cols = len(grid[0]) if rows else 0
+        cell_size = (1, 1,) if options.get('area_scale') else (
+            options['cell_width'], options['cell_height'],)
+        braille_lines = get_braille_lines(
+            get_braille_dots(img, cols, rows, *cell_size), cols, rows)
+
+    lines = [
+        (mode, RENDERERS[mode](
+            half_grid if mode in HALF_BLOCK_MODES else grid,
+            braille_lines=braille_lines,
+            **options
+        ),)
+        for mode in modes
+    ]
+
+    with timer('write'):
+        for mode, mode_lines in lines:
+            write_frame(
+                get_frame_filename(output_dirnames[mode], frame_name, codec),
+                '\n'.join(mode_lines),
+                codec,
+            )
+
+    return digest
+
 
-    frame_names = [
+# Saving the manifest after every frame would be wasteful for long clips, so
+# it's saved at most this often (in seconds), and once more at the end.
+MANIFEST_SAVE_INTERVAL = 1
+
+
+def _get_frame_names(jpg_dirname):
+    return [
         filename.split('.')[0]
-        for filename in get_sorted_filenames(output_dirnames['jpg'], 'jpg')
+        for filename in get_sorted_filenames(jpg_dirname, 'jpg')
     ]
 
-    pool_abstraction(convert_frame, frame_names, cpu_pool_size, stdout, **options)
 
+def _deduplicate(output_dirnames, manifest):
+    """
+    Removes the .txt files of frames that repeat an earlier one, and saves
+    the frames to play instead, each with how long it's held for, to
+    config.json.
+    """
+    config_filename = '{}/config.json'.format(output_dirnames['.'])
+    with open(config_filename) as f:
+        config = json.load(f)
 
-def generate(**options):
-    # extract frames to files
-    num_frames, seconds = _run_ffmpeg(**options)
+    durations = config.get('durations')
+    if not durations or len(durations) != len(manifest['frame_names']):
+        durations = [config['seconds'] / config['num_frames']] * len(manifest['frame_names'])
+
+    first_frame_names = {}
+    frames = []
+    for frame_name, seconds in zip(manifest['frame_names'], durations):
+        digest = manifest['digests'].get(frame_name)
+        unique_frame_name = first_frame_names.setdefault(digest, frame_name)
+        if digest is None:
+            unique_frame_name = frame_name
+
+        if unique_frame_name != frame_name:
+            for mode in DISPLAY_MODES:
+                txt_filename = get_frame_filename(output_dirnames[mode], frame_name,
+                    manifest['codec'])
+                if os.path.exists(txt_filename):
+                    os.remove(txt_filename)
+
+        if frames and frames[-1][0] == unique_frame_name:
+            frames[-1][1] += seconds
+        else:
+            frames.append([unique_frame_name, seconds])
+
+    config['frames'] = [
+        [frame_name, round(seconds, 6)]
+        for frame_name, seconds in frames
+    ]
+    with open(config_filename, 'w') as f:
+        json.dump(config, f)
+
+    manifest['deduplicated'] = True
+
+
+class _ManifestRecorder(object):
+    """
+    Marks frames as done in each entry's manifest as results come in.
+    """
+
+    def __init__(self, entries, manifests):
+        self.entries = entries
+        self.manifests = manifests
+        self.last_saved = time.time()
+
+    def record(self, modes, result):
+        frame_name, digests = result
+        for manifest, entry_modes, digest in zip(self.manifests, modes, digests):
+            mark_frame(manifest, frame_name, entry_modes, digest)
+
+        if time.time() - self.last_saved >= MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        for entry, manifest in zip(self.entries, self.manifests):
+            if update_complete(manifest) and not manifest['deduplicated']:
+                _deduplicate(entry['output_dirnames'], manifest)
+            save_manifest(entry['output_dirnames']['.'], manifest)
+        self.last_saved = time.time()
+
+
+def _convert_frames(cpu_pool_size, stdout, manifests=None, **options):
+    output_dirnames = options['output_dirnames']
+    entries = [options] + list(options.get('variants', ()))
+    if manifests is None:
+        manifests = [
+            load_manifest(entry['output_dirnames']['.'])
+            for entry in entries
+        ]
+
+    # Group frames by the modes each entry is still missing, which after an
+    # interrupted run is usually just one group.
+    groups = OrderedDict()
+    for frame_name in _get_frame_names(output_dirnames['jpg']):
+        modes = tuple(
+            tuple(get_missing_modes(manifest, frame_name))
+            for manifest in manifests
+        )
+        if any(modes):
+            groups.setdefault(modes, []).append(frame_name)
+
+    recorder = _ManifestRecorder(entries, manifests)
+    try:
+        for modes, frame_names in groups.items():
+            group_options = dict(
+                options,
+                modes=list(modes[0]),
+                variants=[
+                    dict(variant, modes=list(variant_modes))
+                    for variant, variant_modes in zip(entries[1:], modes[1:])
+                ],
+            )
+            # Each process converts its frames in order, so the first frame
+            # with a given digest is always written, which _deduplicate()
+            # relies on. Groups aren't in frame order, so don't carry over.
+            reset_written_digests()
+            pool_abstraction(convert_frame, frame_names, cpu_pool_size, stdout,
+                on_result=functools.partial(recorder.record, modes), **group_options)
+    finally:
+        recorder.save()
+
+
+@timed('nocolor_table')
+def get_clip_nocolor_table(output_dirnames, cell_width, cell_height, area_scale=False,
+        **options):
+    """
+    Divides up the gray levels of every extracted frame between the nocolor
+    characters at once, so a character means the same shade throughout the
+    clip and doesn't flicker when the frame's other cells change.
+    """
+    histogram = None
+    for frame_name in _get_frame_names(output_dirnames['jpg']):
+        with Image.open('{}/{}.jpg'.format(output_dirnames['jpg'], frame_name)) as img:
+            img = img.convert('RGB')
+            # PIL averages the cells, close enough to get_cell_grid() to
+            # pick the buckets.
+            if not area_scale:
+                img = img.crop((
+                    0,
+                    0,
+                    img.size[0] - img.size[0] % cell_width,
+                    img.size[1] - img.size[1] % cell_height,
+                )).reduce((cell_width, cell_height,))
+            histogram = get_gray_histogram([img.getdata()], histogram)
+
+    if histogram is None:
+        return None
+    return ''.join(get_nocolor_table(histogram))
+
+
+def _keep_codec(entry, manifest):
+    """
+    Frames left by an interrupted run were written with the codec it was
+    given, so the rest of the entry is written with it too.
+    """
+    if manifest['frames']:
+        entry['codec'] = manifest['codec']
+    manifest['codec'] = entry.get('codec', DEFAULT_CODEC)
+
+
+def derive(source_output_dirnames, **options):
+    """
+    Generates another size from frames already extracted for an existing
+    cache entry, without running ffmpeg again. Runs in a single process so
+    it can be done in the background during playback.
+    """
+    with open('{}/config.json'.format(source_output_dirnames['.'])) as f:
+        config = json.load(f)
+
+    if options.get('equalize') == 'clip':
+        options['nocolor_table'] = config.get('nocolor_table')
+
+    manifest = load_manifest(options['output_dirnames']['.'])
+    _keep_codec(options, manifest)
+
+    _save_config(
+        config['num_frames'],
+        config['seconds'],
+        durations=config.get('durations'),
+        input_source=config.get('input_source'),
+        input_source_file=config.get('input_source_file'),
+        **options
+    )
+
+    frame_names = _get_frame_names(source_output_dirnames['jpg'])
+    mark_extracted(manifest, config['num_frames'], config['seconds'], frame_names,
+        config.get('durations'))
+
+    recorder = _ManifestRecorder([options], [manifest])
+    reset_written_digests()
+    try:
+        for frame_name in frame_names:
+            modes = get_missing_modes(manifest, frame_name)
+            if not modes:
+                continue
+
+            with timer('image_load'):
+                img = Image.open('{}/{}.jpg'.format(source_output_dirnames['jpg'], frame_name))
+                img.load()
+            digest = convert_variant(img, frame_name, modes=modes, **options)
+            recorder.record((modes,), (frame_name, [digest],))
+    finally:
+        recorder.save()
+
+
+def generate_preview(source_output_dirnames, max_frames, **options):
+    """
+    Converts every so many of the frames already extracted for another
+    cache entry, at most `max_frames` of them, each held until the next one
+    is due. Quick to make whatever the clip's length, so there's something
+    to play while the whole clip is generated.
+    """
+    with open('{}/config.json'.format(source_output_dirnames['.'])) as f:
+        config = json.load(f)
+
+    frame_names = _get_frame_names(source_output_dirnames['jpg'])
+    durations = config.get('durations')
+    if not durations or len(durations) != len(frame_names):
+        durations = [config['seconds'] / config['num_frames']] * len(frame_names)
+    frame_step = max(1, math.ceil(len(frame_names) / max_frames))
+
+    first_frame_names = {}
+    frames = []
+    for i in range(0, len(frame_names), frame_step):
+        with timer('image_load'):
+            img = Image.open('{}/{}.jpg'.format(source_output_dirnames['jpg'], frame_names[i]))
+            img.load()
+        digest = convert_variant(img, frame_names[i], **options)
+        # repeats aren't written again, see convert_img().
+        frame_name = first_frame_names.setdefault(digest, frame_names[i])
+        seconds = sum(durations[i:i + frame_step])
+
+        if frames and frames[-1][0] == frame_name:
+            frames[-1][1] += seconds
+        else:
+            frames.append([frame_name, seconds])
+
+    _save_config(
+        config['num_frames'],
+        config['seconds'],
+        durations=config.get('durations'),
+        frames=[
+            [frame_name, round(seconds, 6)]
+            for frame_name, seconds in frames
+        ],
+        input_source=config.get('input_source'),
+        input_source_file=config.get('input_source_file'),
+        **options
+    )
+
+
+def _link(src, dest):
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        pass
+    except OSError:
+        # e.g. a filesystem without hard links.
+        shutil.copyfile(src, dest)
+
+
+def slice_window(source_output_dirnames, start=0, duration=None, **options):
+    """
+    Makes a complete cache entry for `duration` seconds from `start` out of
+    one for the whole clip, by linking to the frames shown in that window
+    and holding the first and last for only as long as they're in it.
+    Nothing is generated.
+    """
+    with open('{}/config.json'.format(source_output_dirnames['.'])) as f:
+        config = json.load(f)
+    source_manifest = load_manifest(source_output_dirnames['.'])
+    codec = source_manifest['codec']
+
+    frames = config.get('frames') or [
+        [frame_name, config['seconds'] / config['num_frames']]
+        for frame_name in source_manifest['frame_names']
+    ]
+    frames = [
+        [frame_name, round(seconds, 6)]
+        for frame_name, seconds in _clip_to_window(frames, start, duration)
+    ]
+    _check_window(len(frames), start, duration)
+    frame_names = sorted(set(frame_name for frame_name, seconds in frames))
+
+    output_dirnames = options['output_dirnames']
+    for mode in DISPLAY_MODES:
+        for frame_name in frame_names:
+            _link(
+                get_frame_filename(source_output_dirnames[mode], frame_name, codec),
+                get_frame_filename(output_dirnames[mode], frame_name, codec),
+            )
+
+    seconds = sum(seconds for frame_name, seconds in frames)
+    _save_config(
+        len(frames),
+        seconds,
+        frames=frames,
+        input_source=config.get('input_source'),
+        input_source_file=config.get('input_source_file'),
+        **dict(options, codec=codec, start=start, duration=duration)
+    )
+
+    manifest = load_manifest(output_dirnames['.'])
+    manifest['codec'] = codec
+    mark_extracted(manifest, len(frames), seconds, frame_names)
+    for frame_name in frame_names:
+        mark_frame(manifest, frame_name, DISPLAY_MODES)
+    update_complete(manifest)
+    manifest['deduplicated'] = True
+    save_manifest(output_dirnames['.'], manifest)
+
+
+def _remove_frames(jpg_dirname):
+    # Frames left by an interrupted run, or by a cache from before manifests,
+    # would otherwise be mixed in with the new ones.
+    for filename in glob.glob('{}/*.jpg'.format(jpg_dirname)):
+        os.remove(filename)
+
+
+def _is_extracted(manifest, output_dirnames):
+    if not manifest['extracted']:
+        return False
+    frame_names = _get_frame_names(output_dirnames['jpg'])
+    return set(manifest['frame_names']) <= set(frame_names)
+
+
+def _extract(manifest, **options):
+    """
+    Extracts frames with the chosen decoder, unless a previous run already
+    extracted every frame.
+    """
+    output_dirnames = options['output_dirnames']
+
+    if _is_extracted(manifest, output_dirnames):
+        return
+
+    decoder = get_decoder(options['input_source_file'], options.get('decoder', 'auto'))
+    _remove_frames(output_dirnames['jpg'])
+    num_frames, seconds, durations = DECODER_BACKENDS[decoder](**options)
+    frame_names = _get_frame_names(output_dirnames['jpg'])
+    _check_window(num_frames, options.get('start', 0), options.get('duration'))
+
+    mark_extracted(manifest, num_frames, seconds, frame_names, durations)
+    save_manifest(output_dirnames['.'], manifest)
+
+
+def extract(**options):
+    """
+    Extracts frames ahead of generate(), which then skips that step, and
+    saves what's known of the clip to config.json so other entries can be
+    derived from them in the meantime.
+    """
+    manifest = load_manifest(options['output_dirnames']['.'])
+    _extract(manifest, **options)
+    _save_config(manifest['num_frames'], manifest['seconds'], manifest['durations'], **options)
+
+
+def _can_stream(manifest, **options):
+    if _is_extracted(manifest, options['output_dirnames']):
+        return False
+    if get_decoder(options['input_source_file'], options.get('decoder', 'auto')) != 'pil':
+        return False
+    # the whole clip has to be decoded before its table can be made.
+    if options.get('equalize') == 'clip':
+        return False
+    return options['cpu_pool_size'] == 1 or shared_memory is not None
+
+
+def _get_max_frame_size(cols, rows, cell_width, cell_height, area_scale=False, **options):
+    if area_scale:
+        return cols, rows
+    return cols * cell_width, rows * cell_height
+
+
+def _stream_frames(manifests, cpu_pool_size, stdout, **options):
+    """
+    Decodes a GIF with PIL and converts each frame as soon as it's decoded,
+    rather than extracting every frame first and having the workers read
+    them back from disk. Frames get to pool workers through shared memory.
+
+    Returns the recorder of converted frames, which still has to be saved
+    once the manifests are marked as extracted.
+    """
+    output_dirnames = options['output_dirnames']
+    entries = [options] + list(options.get('variants', ()))
+
+    # progress is out of the frames inside the window.
+    with Image.open(options['input_source_file']) as img:
+        total = len(_get_pil_durations(img, options.get('start', 0), options.get('duration')))
+    _check_window(total, options.get('start', 0), options.get('duration'))
+
+    # Until every frame is decoded, nothing is complete.
+    for manifest in manifests:
+        manifest['extracted'] = False
+    _remove_frames(output_dirnames['jpg'])
+    recorder = _ManifestRecorder(entries, manifests)
+    modes_by_frame_name = {}
+    durations = []
+
+    def get_items(put):
+        for frame_name, frame, seconds in _decode_with_pil(**options):
+            durations.append(seconds)
+            modes = tuple(
+                tuple(get_missing_modes(manifest, frame_name))
+                for manifest in manifests
+            )
+            if any(modes):
+                index = len(modes_by_frame_name)
+                modes_by_frame_name[frame_name] = modes
+                yield frame_name, put(index, frame), modes
+
+    def on_result(result):
+        recorder.record(modes_by_frame_name[result[0]], result)
+
+    reset_written_digests()
+    try:
+        if cpu_pool_size == 1:
+            pool_abstraction(convert_shared_frame, get_items(lambda index, frame: frame),
+                cpu_pool_size, stdout, on_result=on_result, total=total, **options)
+        else:
+            # enough slots for every worker to have a frame queued up behind
+            # the one it's converting.
+            num_slots = 2 * (cpu_pool_size or os.cpu_count() or 1)
+            with SharedFrameRing(num_slots, _get_max_frame_size(**options)) as ring:
+                pool_abstraction(convert_shared_frame, get_items(ring.put), cpu_pool_size,
+                    stdout, on_result=on_result, max_pending=num_slots, total=total, **options)
+    finally:
+        # so frames converted before an interruption aren't converted again.
+        recorder.save()
+
+    mark_extracted(manifests[0], len(durations), sum(durations),
+        _get_frame_names(output_dirnames['jpg']), durations)
+    return recorder
+
+
+def generate(variants=(), **options):
+    """
+    `variants` is a list of dicts, each with its own cols, rows, cell_width,
+    cell_height, and output_dirnames. They're derived from the frames
+    extracted for `options`, so these should be the largest size requested.
+
+    Progress is recorded in each entry's manifest, so running this again
+    after an interruption only converts the frames and modes that are
+    missing.
+    """
+    entries = [options] + list(variants)
+    manifests = [
+        load_manifest(entry['output_dirnames']['.'])
+        for entry in entries
+    ]
+    for entry, manifest in zip(entries, manifests):
+        _keep_codec(entry, manifest)
+
+    recorder = None
+    if _can_stream(manifests[0], **options):
+        recorder = _stream_frames(manifests, variants=variants, **options)
+    else:
+        # extract frames to files
+        _extract(manifests[0], **options)
+    num_frames = manifests[0]['num_frames']
+    seconds = manifests[0]['seconds']
+    durations = manifests[0]['durations']
+
+    if options.get('equalize') == 'clip':
+        # Every size shares the table worked out at the largest one.
+        options['nocolor_table'] = get_clip_nocolor_table(**options)
+        variants = [
+            dict(variant, nocolor_table=options['nocolor_table'])
+            for variant in variants
+        ]
+        entries = [options] + variants
 
-    _save_config(num_frames, seconds, **options)
+    for entry, manifest in zip(entries, manifests):
+        _save_config(num_frames, seconds, durations, **dict(options, **entry))
+        mark_extracted(manifest, num_frames, seconds, manifests[0]['frame_names'], durations)
 
-    _convert_frames(**options)
+    if recorder is not None:
+        recorder.save()
+    else:
+        _convert_frames(manifests=manifests, variants=variants, **options)
@@ -0,0 +1,209 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Linear-light cell averaging, OKLab palette matching and dithering. All of
+them work on a whole frame at once with PIL's image operations, so the
+per-cell work left in Python is a table lookup.
+"""
+from bisect import bisect
+
+from PIL import Image, ImageChops, ImageFilter
+from x256 import x256
+
+from ..constants import DEFAULT_COLOR_SPACE
+from ..utils import memoize
+
+
+def _srgb_to_linear(c):
+    if c <= 0.04045:
+        return c / 12.92
+    return ((c + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_oklab(r, g, b):
+    # https://bottosson.github.io/posts/oklab/
+    l = 0.4122214708 * r + 0.5363325363 * g + 0.0514459929 * b  # noqa: E741
+    m = 0.2119034982 * r + 0.6806995451 * g + 0.1073969566 * b
+    s = 0.0883024619 * r + 0.2817188376 * g + 0.6299787005 * b
+    l, m, s = l ** (1 / 3), m ** (1 / 3), s ** (1 / 3)  # noqa: E741
+    return (
+        0.2104542553 * l + 0.7936177850 * m - 0.0040720406 * s,
+        1.9779984951 * l - 2.4285922050 * m + 0.4505937099 * s,
+        0.0259040371 * l + 0.7827717662 * m - 0.8086757711 * s,
+    )
+
+
+def srgb_to_oklab(r, g, b):
+    return _linear_to_oklab(*(_TO_LINEAR[c] for c in (r, g, b)))
+
+
+_TO_LINEAR = [_srgb_to_linear(i / 255) for i in range(256)]
+# Linear values halfway between each 8 bit level, to find the nearest one.
+_LINEAR_MIDPOINTS = [(a + b) / 2 for a, b in zip(_TO_LINEAR, _TO_LINEAR[1:])]
+
+# OKLab, scaled and offset to fit in 8 bit RGB channels. Every axis uses the
+# same scale, so distances between encoded colors are still comparable.
+_OKLAB_SCALE = 255
+_OKLAB_OFFSETS = (0, 128, 128)
+
+
+def _encode_oklab(lab):
+    return tuple(
+        min(255, max(0, round(offset + _OKLAB_SCALE * n)))
+        for n, offset in zip(lab, _OKLAB_OFFSETS)
+    )
+
+
+@memoize
+def _get_oklab_filter():
+    # Built on first use, as it takes a moment and is only needed for oklab.
+    return ImageFilter.Color3DLUT.generate(
+        33,
+        lambda r, g, b: tuple(
+            n / 255
+            for n in _encode_oklab(_linear_to_oklab(
+                _srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)))
+        ),
+    )
+
+
+_PALETTE_OKLAB = [srgb_to_oklab(*rgb) for rgb in x256.colors]
+_PALETTE_IMG = Image.new('P', (1, 1,))
+_PALETTE_IMG.putpalette([
+    n
+    for lab in _PALETTE_OKLAB
+    for n in _encode_oklab(lab)
+])
+
+
+def get_linear_cell_grid(img, cell_width, cell_height):
+    """
+    Like get_cell_grid(), but averages each cell in linear light, so thin
+    bright details don't get darkened.
+    """
+    cols = img.size[0] // cell_width
+    rows = img.size[1] // cell_height
+    img = img.crop((0, 0, cols * cell_width, rows * cell_height,))
+
+    bands = [
+        band.point(_TO_LINEAR, 'F').reduce((cell_width, cell_height,)).getdata()
+        for band in img.split()
+    ]
+    cells = [
+        [bisect(_LINEAR_MIDPOINTS, n) for n in rgb]
+        for rgb in zip(*bands)
+    ]
+
+    return [
+        cells[i:i + cols]
+        for i in range(0, len(cells), cols)
+    ]
+
+
+_SRGB_PALETTE_IMG = Image.new('P', (1, 1,))
+_SRGB_PALETTE_IMG.putpalette([
+    n
+    for rgb in x256.colors
+    for n in rgb
+])
+
+# 4x4 Bayer matrix, thresholds in the order they're reached.
+BAYER_MATRIX = (
+    (0, 8, 2, 10,),
+    (12, 4, 14, 6,),
+    (3, 11, 1, 9,),
+    (15, 7, 13, 5,),
+)
+# How far ordered dithering nudges each channel, about a step of the 256
+# color palette's 6x6x6 cube.
+BAYER_SPREAD = 40
+
+
+@memoize
+def _get_bayer_img(size):
+    """
+    The Bayer matrix tiled over `size`, scaled to 0-BAYER_SPREAD. The same
+    cell always gets the same nudge, so still areas don't flicker.
+    """
+    tile = Image.new('L', (4, 4,))
+    tile.putdata([
+        round((n + 0.5) * BAYER_SPREAD / 16)
+        for row in BAYER_MATRIX
+        for n in row
+    ])
+    img = Image.new('L', size)
+    for y in range(0, size[1], 4):
+        for x in range(0, size[0], 4):
+            img.paste(tile, (x, y,))
+    return Image.merge('RGB', (img, img, img,))
+
+
+def _get_grid_img(grid, cols, rows):
+    return Image.frombytes('RGB', (cols, rows,), bytes(
+        n
+        for row in grid
+        for rgb in row
+        for n in rgb
+    ))
+
+
+def get_256_indexes(grid, color_space=DEFAULT_COLOR_SPACE, dither=None):
+    """
+    Returns rows of the closest 256 color palette index for each cell of
+    `grid`, compared in OKLab for the oklab color space.
+
+    `dither` may be 'bayer', to nudge cells by an ordered threshold before
+    matching them, or 'floyd', for PIL's Floyd-Steinberg error diffusion
+    over the whole grid.
+    """
+    rows = len(grid)
+    cols = len(grid[0]) if rows else 0
+    if not cols:
+        return [[] for row in grid]
+
+    img = _get_grid_img(grid, cols, rows)
+    if dither == 'bayer':
+        # thresholded in sRGB, where the same nudge to every channel keeps
+        # the hue. OKLab's a and b would shift it instead.
+        img = ImageChops.add(img, _get_bayer_img(img.size), offset=-BAYER_SPREAD // 2)
+    palette = _SRGB_PALETTE_IMG
+    if color_space == 'oklab':
+        img = img.filter(_get_oklab_filter())
+        palette = _PALETTE_IMG
+
+    indexes = img.quantize(
+        palette=palette,
+        dither=Image.FLOYDSTEINBERG if dither == 'floyd' else Image.NONE,
+    ).tobytes()
+
+    return [
+        list(indexes[i:i + cols])
+        for i in range(0, len(indexes), cols)
+    ]
+
+
+def top_2_oklab_colors(r, g, b):
+    """
+    Same as top_2_colors(), but with distances in OKLab.
+    """
+    lab = srgb_to_oklab(r, g, b)
+    distances = sorted(
+        (sum((n - m) ** 2 for n, m in zip(lab, palette_lab)), index,)
+        for index, palette_lab in enumerate(_PALETTE_OKLAB)
+    )
+    return tuple(
+        {'distance': distance, 'index': index}
+        for distance, index in distances[:2]
+    )
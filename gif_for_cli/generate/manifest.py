@@ -0,0 +1,139 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Tracks how far generation of a cache entry got, so an interrupted run can
+pick up where it left off instead of starting over.
+"""
+import json
+import os
+
+from ..constants import DEFAULT_CODEC, DISPLAY_MODES
+from ..storage import get_frame_filename
+from ..utils import get_sorted_filenames
+
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def _get_manifest_filename(dirname):
+    return '{}/{}'.format(dirname, MANIFEST_FILENAME)
+
+
+def _load_legacy_manifest(dirname):
+    """
+    Makes a manifest for a cache entry written before manifests were, from
+    the frames it has on disk, so it's only converted again for the display
+    modes it's missing.
+
+    Those entries saved config.json once their frames were extracted, without
+    the durations key every entry has now.
+    """
+    try:
+        with open('{}/config.json'.format(dirname)) as f:
+            config = json.load(f)
+        frame_names = [
+            filename.split('.')[0]
+            for filename in get_sorted_filenames('{}/jpg'.format(dirname), 'jpg')
+        ]
+    except (OSError, ValueError):
+        return {}
+
+    if 'durations' in config or not frame_names:
+        return {}
+
+    manifest = {}
+    mark_extracted(manifest, config['num_frames'], config['seconds'], frame_names)
+    manifest['frames'] = {}
+    for frame_name in frame_names:
+        mark_frame(manifest, frame_name, [
+            mode
+            for mode in DISPLAY_MODES
+            if os.path.exists(get_frame_filename('{}/{}'.format(dirname, mode), frame_name))
+        ])
+    update_complete(manifest)
+    return manifest
+
+
+def load_manifest(dirname):
+    try:
+        with open(_get_manifest_filename(dirname)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = _load_legacy_manifest(dirname)
+    except (OSError, ValueError):
+        manifest = {}
+
+    manifest.setdefault('extracted', False)
+    manifest.setdefault('complete', False)
+    manifest.setdefault('frame_names', [])
+    # seconds each frame is shown for, if known.
+    manifest.setdefault('durations', None)
+    # frame name -> display modes written for it.
+    manifest.setdefault('frames', {})
+    # frame name -> digest of its cell grid, see get_grid_digest().
+    manifest.setdefault('digests', {})
+    manifest.setdefault('deduplicated', False)
+    # how the .txt frames are stored, frames written before this was
+    # recorded are plain text.
+    manifest.setdefault('codec', DEFAULT_CODEC)
+    return manifest
+
+
+def save_manifest(dirname, manifest):
+    filename = _get_manifest_filename(dirname)
+    tmp_filename = '{}.tmp'.format(filename)
+    # write then rename, so a crash never leaves a half written manifest.
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_filename, filename)
+
+
+def is_complete(dirname):
+    # Entries cached before a display mode was added are resumed to add it.
+    manifest = load_manifest(dirname)
+    return manifest['complete'] and update_complete(manifest)
+
+
+def get_missing_modes(manifest, frame_name):
+    done = manifest['frames'].get(frame_name, ())
+    return [mode for mode in DISPLAY_MODES if mode not in done]
+
+
+def mark_frame(manifest, frame_name, modes, digest=None):
+    if digest is not None:
+        manifest['digests'][frame_name] = digest
+
+    done = manifest['frames'].get(frame_name, [])
+    manifest['frames'][frame_name] = [
+        mode
+        for mode in DISPLAY_MODES
+        if mode in done or mode in modes
+    ]
+
+
+def mark_extracted(manifest, num_frames, seconds, frame_names, durations=None):
+    manifest['extracted'] = True
+    manifest['num_frames'] = num_frames
+    manifest['seconds'] = seconds
+    manifest['frame_names'] = list(frame_names)
+    manifest['durations'] = durations
+
+
+def update_complete(manifest):
+    manifest['complete'] = manifest['extracted'] and not any(
+        get_missing_modes(manifest, frame_name)
+        for frame_name in manifest['frame_names']
+    )
+    return manifest['complete']
@@ -0,0 +1,79 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Hands decoded frames to pool workers through shared memory, so their
+pixels are never pickled, and workers don't have to read them back from
+disk.
+"""
+from PIL import Image
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    # Python < 3.8.
+    shared_memory = None
+
+
+class SharedFrameRing(object):
+    """
+    `num_slots` fixed size slots in a shared memory block. Frame `index` is
+    copied into slot `index % num_slots`, so a frame's slot is only reused
+    once `num_slots` later frames have been put, and the caller has to make
+    sure it's been read by then.
+    """
+
+    def __init__(self, num_slots, max_size):
+        self.num_slots = num_slots
+        self.slot_size = max_size[0] * max_size[1] * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * self.slot_size)
+
+    def put(self, index, img):
+        """
+        Returns a description of where `img` went, for get_shared_frame().
+        """
+        data = img.convert('RGB').tobytes()
+        if len(data) > self.slot_size:
+            raise ValueError('{}x{} frame is too big for its slot'.format(*img.size))
+
+        offset = (index % self.num_slots) * self.slot_size
+        self.shm.buf[offset:offset + len(data)] = data
+        return (self.shm.name, offset, img.size)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# shared memory name -> block, attached once per worker process.
+_attached = {}
+
+
+def get_shared_frame(shared_frame):
+    """
+    Reads back a frame put into a SharedFrameRing, in any process.
+    """
+    name, offset, size = shared_frame
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+
+    num_bytes = size[0] * size[1] * 3
+    return Image.frombuffer(
+        'RGB', size, _attached[name].buf[offset:offset + num_bytes], 'raw', 'RGB', 0, 1)
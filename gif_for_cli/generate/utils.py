@@ -21,24 +21,72 @@ from statistics import mean
 import requests
 from x256 import x256
 
+from .color import top_2_oklab_colors
 from .x256fgbg_utils import top_2_colors
-from ..constants import X256FGBG_CHARS, STORED_CELL_CHAR
+from ..constants import (
+    ANSI_RESET,
+    BRAILLE_BLANK,
+    BRAILLE_DOTS,
+    FULL_BLOCK,
+    LOWER_HALF_BLOCK,
+    NOCOLOR_CHARS,
+    STORED_CELL_CHAR,
+    UPPER_HALF_BLOCK,
+    X256FGBG_CHARS,
+)
+from ..instrument import timed
 from ..utils import memoize
 
 
-@memoize
-def get_gray(*rgb):
-    return mean(rgb)
+# Gray levels are r + g + b, which orders cells the same as their mean
+# without any division.
+NUM_GRAY_LEVELS = 3 * 255 + 1
+
+
+def get_gray_histogram(grid, histogram=None):
+    """
+    Counts the cells of `grid` at each gray level, adding to `histogram` if
+    given.
+    """
+    if histogram is None:
+        histogram = [0] * NUM_GRAY_LEVELS
+    for row in grid:
+        for r, g, b in row:
+            histogram[r + g + b] += 1
+    return histogram
+
+
+def get_nocolor_table(histogram):
+    """
+    Returns a NOCOLOR_CHARS character for each gray level, dividing up the
+    cells counted in `histogram` into roughly equal buckets.
+    """
+    num_cells_per_char = sum(histogram) / len(NOCOLOR_CHARS)
+    table = []
+    cur_count = 0
+    cur_char_idx = 0
+    for num_cells in histogram:
+        if num_cells and cur_count > num_cells_per_char:
+            cur_count = 0
+            cur_char_idx += 1
+        table.append(NOCOLOR_CHARS[cur_char_idx])
+        cur_count += num_cells
+    return table
 
 
 @memoize
+@timed('get_256_cell')
 def get_256_cell(r, g, b):
     return u'\u001b[38;5;{}m{}'.format(x256.from_rgb(r, g, b), STORED_CELL_CHAR)
 
 
 @memoize
-def get_256fgbg_cell(r, g, b):
-    best, second = top_2_colors(r, g, b)
+@timed('get_256_index_cell')
+def get_256_index_cell(index):
+    return u'\u001b[38;5;{}m{}'.format(index, STORED_CELL_CHAR)
+
+
+def _get_fgbg_cell(best, second):
     # if the best color is an exact match, use a blank space for the FG color.
     char = ' '
     if best['distance'] != 0:
@@ -58,10 +106,129 @@ def get_256fgbg_cell(r, g, b):
 
 
 @memoize
+@timed('get_256fgbg_cell')
+def get_256fgbg_cell(r, g, b):
+    return _get_fgbg_cell(*top_2_colors(r, g, b))
+
+
+@memoize
+@timed('get_256fgbg_oklab_cell')
+def get_256fgbg_oklab_cell(r, g, b):
+    return _get_fgbg_cell(*top_2_oklab_colors(r, g, b))
+
+
+@memoize
+@timed('get_truecolor_cell')
 def get_truecolor_cell(r, g, b):
     return u'\u001b[38;2;{};{};{}m{}'.format(r, g, b, STORED_CELL_CHAR)
 
 
+@memoize
+def get_256_index(r, g, b):
+    return x256.from_rgb(r, g, b)
+
+
+@memoize
+def get_256_fg(index):
+    return u'\u001b[38;5;{}m'.format(index)
+
+
+@memoize
+def get_256_bg(index):
+    return u'\u001b[48;5;{}m'.format(index)
+
+
+@memoize
+def get_truecolor_fg(rgb):
+    return u'\u001b[38;2;{};{};{}m'.format(*rgb)
+
+
+@memoize
+def get_truecolor_bg(rgb):
+    return u'\u001b[48;2;{};{};{}m'.format(*rgb)
+
+
+def _get_half_block_choices(top, bottom):
+    # (char, FG color, BG color), None being whatever it already is.
+    if top == bottom:
+        return ((' ', None, top,), (FULL_BLOCK, top, None,),)
+    return ((UPPER_HALF_BLOCK, top, bottom,), (LOWER_HALF_BLOCK, bottom, top,),)
+
+
+@timed('get_half_block_line')
+def get_half_block_line(tops, bottoms, get_fg, get_bg):
+    """
+    Draws a row of cells with `tops` and `bottoms` colors, picking for each
+    cell whichever block character needs the fewest colors changed from the
+    cell before, so runs of colors are only set once.
+    """
+    parts = []
+    fg = bg = None
+    for top, bottom in zip(tops, bottoms):
+        char, new_fg, new_bg = min(
+            _get_half_block_choices(top, bottom),
+            key=lambda choice: (choice[1] not in (None, fg)) + (choice[2] not in (None, bg)),
+        )
+        if new_fg not in (None, fg):
+            parts.append(get_fg(new_fg))
+            fg = new_fg
+        if new_bg not in (None, bg):
+            parts.append(get_bg(new_bg))
+            bg = new_bg
+        parts.append(char)
+    # The BG color would leak to extra columns.
+    parts.append(ANSI_RESET)
+    return ''.join(parts)
+
+
+# Braille dot masks, one per byte, to characters.
+_BRAILLE_CHARS = {
+    mask: ord(BRAILLE_BLANK) + mask
+    for mask in range(256)
+}
+# Pixels that are on (255) to each dot's bit.
+_BRAILLE_BITS = {
+    bit: bytes.maketrans(b'\xff', bytes([bit]))
+    for x, y, bit in BRAILLE_DOTS
+}
+
+
+@timed('get_braille_lines')
+def get_braille_lines(dots, cols, rows):
+    """
+    `dots` is a 1 bit image with 2x4 pixels per cell. Each row of cells is
+    packed into braille characters a whole row at a time: a cell's dots each
+    have their own bit, so OR-ing the rows of pixels for every dot together
+    as big integers leaves one byte per cell holding its mask.
+    """
+    width = cols * 2
+    data = dots.convert('L').tobytes()
+    lines = []
+    for row in range(rows):
+        mask = 0
+        for x, y, bit in BRAILLE_DOTS:
+            offset = (row * 4 + y) * width + x
+            mask |= int.from_bytes(
+                data[offset:offset + width - x:2].translate(_BRAILLE_BITS[bit]), 'big')
+        lines.append(mask.to_bytes(cols, 'big').decode('latin-1').translate(_BRAILLE_CHARS))
+    return lines
+
+
+def get_colored_line(chars, colors, get_fg):
+    """
+    Colors each of `chars`, only setting the FG color when it changes.
+    """
+    parts = []
+    fg = None
+    for char, color in zip(chars, colors):
+        if color != fg:
+            parts.append(get_fg(color))
+            fg = color
+        parts.append(char)
+    return ''.join(parts)
+
+
+@timed('get_avg_for_em')
 def get_avg_for_em(px, x, y, cell_height, cell_width):
     pixels = [
         px[sx, sy]
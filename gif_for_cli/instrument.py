@@ -0,0 +1,179 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Lightweight timers and counters for --profile. Everything here is a no-op
+until enable() is called, so the instrumented hot paths only pay for a
+flag check.
+"""
+from contextlib import contextmanager
+import cProfile
+import functools
+import json
+import time
+
+
+enabled = False
+_timers = {}
+_counters = {}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    _timers.clear()
+    _counters.clear()
+
+
+def add_time(name, seconds, calls=1):
+    timer = _timers.setdefault(name, [0, 0.0])
+    timer[0] += calls
+    timer[1] += seconds
+
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+@contextmanager
+def timer(name):
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def timed(name):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def get_stats():
+    return {
+        'timers': {
+            name: {'calls': calls, 'seconds': seconds}
+            for name, (calls, seconds) in _timers.items()
+        },
+        'counters': dict(_counters),
+    }
+
+
+def merge_stats(stats):
+    for name, timer in stats['timers'].items():
+        add_time(name, timer['seconds'], timer['calls'])
+    for name, n in stats['counters'].items():
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def call_with_stats(callable, item, **options):
+    """
+    Runs in a pool worker, and sends back whatever was gathered during the
+    call along with its result so it can be merged in the parent.
+    """
+    enable()
+    reset()
+    result = callable(item, **options)
+    return result, get_stats()
+
+
+def merge_result(result_and_stats):
+    result, stats = result_and_stats
+    merge_stats(stats)
+    return result
+
+
+def _get_memo_hit_rates(counters):
+    hit_rates = {}
+    for name, hits in counters.items():
+        if name.startswith('memoize:') and name.endswith(':hits'):
+            f_name = name[len('memoize:'):-len(':hits')]
+            misses = counters.get('memoize:{}:misses'.format(f_name), 0)
+            hit_rates[f_name] = hits / (hits + misses)
+    return hit_rates
+
+
+def get_report():
+    stats = get_stats()
+    stats['memo_hit_rates'] = _get_memo_hit_rates(stats['counters'])
+    return stats
+
+
+def write_report(stdout):
+    report = get_report()
+
+    stdout.write('Profile:\n')
+    stdout.write('{:<24}{:>10}{:>12}\n'.format('stage', 'calls', 'seconds'))
+    timers = sorted(report['timers'].items(), key=lambda item: -item[1]['seconds'])
+    for name, timer in timers:
+        stdout.write('{:<24}{:>10}{:>12.3f}\n'.format(name, timer['calls'], timer['seconds']))
+
+    for name, hit_rate in sorted(report['memo_hit_rates'].items()):
+        stdout.write('{} memo hit rate: {:.1%}\n'.format(name, hit_rate))
+
+    for name, n in sorted(report['counters'].items()):
+        if not name.startswith('memoize:'):
+            stdout.write('{}: {}\n'.format(name, n))
+    stdout.flush()
+
+
+@contextmanager
+def profile(filename, stdout):
+    """
+    `filename` may be '-' to print a breakdown, a .json file for the timers
+    and counters, or any other file for a cProfile dump of this process.
+    """
+    reset()
+    enable()
+    profiler = None
+    if filename not in ('-', '') and not filename.endswith('.json'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        disable()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(filename)
+        elif filename.endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump(get_report(), f, indent=2)
+        else:
+            write_report(stdout)
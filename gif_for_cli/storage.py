@@ -0,0 +1,68 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Reads and writes the .txt frames of a cache entry, optionally compressed.
+Frames are compressed one by one, so any of them can be read on its own
+while playing, and the codec gets its own extension so a directory never
+has to be guessed at.
+"""
+import lzma
+import zlib
+
+from .constants import DEFAULT_CODEC
+
+
+# codec -> (extension, compress, decompress)
+_CODECS = {
+    'none': ('txt', None, None,),
+    'zlib': ('txt.zz', lambda data: zlib.compress(data, 9), zlib.decompress,),
+    'lzma': ('txt.xz', lzma.compress, lzma.decompress,),
+}
+
+
+def get_frame_ext(codec=DEFAULT_CODEC):
+    return _CODECS[codec][0]
+
+
+def get_frame_filename(dirname, frame_name, codec=DEFAULT_CODEC):
+    return '{}/{}.{}'.format(dirname, frame_name, get_frame_ext(codec))
+
+
+def get_frame_basename(filename, codec=DEFAULT_CODEC):
+    """
+    Strips the codec's extension, '0001.txt.zz' -> '0001'.
+    """
+    return filename[:-len(get_frame_ext(codec)) - 1]
+
+
+def write_frame(filename, txt, codec=DEFAULT_CODEC):
+    ext, compress, decompress = _CODECS[codec]
+    if compress is None:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(txt)
+        return
+
+    with open(filename, 'wb') as f:
+        f.write(compress(txt.encode('utf8')))
+
+
+def read_frame(filename, codec=DEFAULT_CODEC):
+    ext, compress, decompress = _CODECS[codec]
+    if decompress is None:
+        with open(filename, encoding='utf-8') as f:
+            return f.read()
+
+    with open(filename, 'rb') as f:
+        return decompress(f.read()).decode('utf8')
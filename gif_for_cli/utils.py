@@ -14,9 +14,29 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import argparse
-from multiprocessing import Pool
+import collections
+import functools
+from multiprocessing import Pool, get_context
 import itertools
 import os
+import threading
+
+from . import instrument
+from .constants import (
+    CODECS,
+    COLOR_SPACES,
+    DECODERS,
+    DEFAULT_CODEC,
+    DEFAULT_COLOR_SPACE,
+    DEFAULT_COLS,
+    DEFAULT_DITHER,
+    DEFAULT_EQUALIZE,
+    DEFAULT_ROWS,
+    DISPLAY_MODES,
+    DITHER_MODES,
+    EQUALIZE_MODES,
+    SIZE_BUCKETS,
+)
 
 
 def memoize(f):
@@ -24,15 +44,22 @@ def memoize(f):
     Caveat: Presumes each arg is hashable, and therefore a valid dict key.
     """
     d = {}
+    hits_name = 'memoize:{}:hits'.format(f.__name__)
+    misses_name = 'memoize:{}:misses'.format(f.__name__)
 
     def wrapper(*args):
         if args in d:
+            if instrument.enabled:
+                instrument.count(hits_name)
             return d[args]
 
+        if instrument.enabled:
+            instrument.count(misses_name)
         res = f(*args)
         d[args] = res
         return res
 
+    wrapper.cache_clear = d.clear
     return wrapper
 
 
@@ -56,6 +83,34 @@ def _pool_type(val):
     return val
 
 
+def _start_type(val):
+    val = float(val)
+    if val < 0:
+        raise argparse.ArgumentTypeError('--start can\'t be negative')
+    return val
+
+
+def _duration_type(val):
+    val = float(val)
+    if val <= 0:
+        raise argparse.ArgumentTypeError('--duration must be more than 0')
+    return val
+
+
+def _sizes_type(val):
+    sizes = []
+    for size in val.split(','):
+        try:
+            cols, rows = [int(n) for n in size.lower().split('x')]
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'Sizes must look like COLSxROWS, e.g. 80x20,240x60')
+        if cols <= 0 or rows <= 0:
+            raise argparse.ArgumentTypeError('Minimum size is 1x1')
+        sizes.append((cols, rows,))
+    return sizes
+
+
 def get_parser(environ):
     default_display_mode = _get_default_display_mode(environ)
 
@@ -95,7 +150,7 @@ def get_parser(environ):
         dest='display_mode',
         type=str,
         default=default_display_mode,
-        choices=['nocolor', '256', '256fgbg', 'truecolor'],
+        choices=DISPLAY_MODES,
         help='Override the auto-detected color support.',
     )
     parser.add_argument(
@@ -105,6 +160,22 @@ def get_parser(environ):
         default='#',
         help='Character to use for each colorized cell/block. e.g. #, \u2588, etc.',
     )
+    parser.add_argument(
+        '--mosaic',
+        dest='mosaic',
+        type=str,
+        nargs='+',
+        default=[],
+        help="""More input sources to play at the same time as the first one,
+    tiled in a grid. Each clip keeps its own frame rate.""",
+    )
+    parser.add_argument(
+        '--mosaic-cols',
+        dest='mosaic_cols',
+        type=int,
+        default=None,
+        help='Number of tiles per row with --mosaic. Defaults to a roughly square grid.',
+    )
     parser.add_argument(
         '-l',
         dest='num_loops',
@@ -117,14 +188,16 @@ def get_parser(environ):
         '--cols',
         dest='cols',
         type=int,
-        default=160,
-        help='Maximum number of columns.',
+        default=None,
+        help="""Maximum number of columns. If neither --cols nor --rows are given,
+    the largest of a few preset sizes that fits the terminal is used, falling back
+    to {}x{}.""".format(DEFAULT_COLS, DEFAULT_ROWS),
     )
     parser.add_argument(
         '--rows',
         dest='rows',
         type=int,
-        default=40,
+        default=None,
         help='Maximum number of rows.',
     )
     parser.add_argument(
@@ -141,6 +214,77 @@ def get_parser(environ):
         default=6,
         help='Number of pixels in height you want mapped to a single character.',
     )
+    parser.add_argument(
+        '--sizes',
+        dest='sizes',
+        type=_sizes_type,
+        default=[],
+        help="""Additional COLSxROWS sizes to cache alongside --cols/--rows,
+    e.g. 80x20,240x60. Frames are only decoded once, at the largest size.""",
+    )
+    parser.add_argument(
+        '--start',
+        dest='start',
+        type=_start_type,
+        default=0,
+        help="""Seconds into the clip to start from. ffmpeg seeks there without
+    decoding what comes before.""",
+    )
+    parser.add_argument(
+        '--duration',
+        dest='duration',
+        type=_duration_type,
+        default=None,
+        help="""Seconds of the clip to use, from --start. Windows of a clip that's
+    already cached whole are cut out of it without generating anything.""",
+    )
+    parser.add_argument(
+        '--color-space',
+        dest='color_space',
+        type=str,
+        default=DEFAULT_COLOR_SPACE,
+        choices=COLOR_SPACES,
+        help="""How cells are averaged and matched to the 256 color palette.
+    linear averages in linear light, oklab also picks palette colors by
+    perceptual distance.""",
+    )
+    parser.add_argument(
+        '--equalize',
+        dest='equalize',
+        type=str,
+        default=DEFAULT_EQUALIZE,
+        choices=EQUALIZE_MODES,
+        help="""How the nocolor display mode spreads its characters over gray
+    levels. frame does it for each frame, clip once for the whole clip, so
+    characters don't flicker when the rest of the frame changes.""",
+    )
+    parser.add_argument(
+        '--dither',
+        dest='dither',
+        type=str,
+        default=DEFAULT_DITHER,
+        choices=DITHER_MODES,
+        help="""How the 256, 256half and 256braille display modes dither colors
+    to smooth out banding. bayer is ordered and steady from frame to frame,
+    floyd diffuses the error for the most accurate colors.""",
+    )
+    parser.add_argument(
+        '--area-scale',
+        dest='area_scale',
+        action='store_true',
+        help="""Have the decoder average each cell down to a single pixel, so
+    only color matching is left to do in Python. Output is close to, but not
+    the same as, the default.""",
+    )
+    parser.add_argument(
+        '--codec',
+        dest='codec',
+        type=str,
+        default=DEFAULT_CODEC,
+        choices=CODECS,
+        help="""How frames are compressed in the cache. Each frame is
+    decompressed as it's played. Only applies to newly generated frames.""",
+    )
 
     # generation related options, but doens't affect generated output.
     parser.add_argument(
@@ -149,6 +293,22 @@ def get_parser(environ):
         type=_pool_type,
         default=None,
     )
+    parser.add_argument(
+        '--decoder',
+        dest='decoder',
+        type=str,
+        default='auto',
+        choices=DECODERS,
+        help="""How frames are extracted. auto uses PIL for local GIFs, which avoids
+    starting ffmpeg, and ffmpeg for everything else.""",
+    )
+    parser.add_argument(
+        '--preview',
+        dest='preview',
+        action='store_true',
+        help="""When the GIF isn't cached yet, start playing a few frames at a small
+    size right away, and switch to the full output once it's generated.""",
+    )
     parser.add_argument(
         '--no-display',
         dest='no_display',
@@ -156,6 +316,23 @@ def get_parser(environ):
         help='Skip displaying ASCII in terminal, useful for pre-caching output.',
     )
 
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        action='store_true',
+        help="""Time each stage (ffmpeg, image loading, averaging, color matching,
+    writes) and print a breakdown when done.""",
+    )
+    parser.add_argument(
+        '--profile-output',
+        dest='profile_output',
+        type=str,
+        default='-',
+        help="""Where --profile writes to. A filename ending in .json gets the
+    breakdown, any other filename gets a cProfile dump. Defaults to printing the
+    breakdown.""",
+    )
+
     # export related options, doens't affect generated output.
     parser.add_argument(
         '--export',
@@ -164,23 +341,78 @@ def get_parser(environ):
         default='',
         help="""Specify a filename (.gif, .mp4, etc.) for ffmpeg to export to.
     Useful for sharing animated ASCII art outside a CLI environment. ASCII is
-    not output to the terminal.""",
+    not output to the terminal. .cast (asciicast v2) and .ans (with a
+    scriptreplay .timing file) record the text itself instead.""",
+    )
+    parser.add_argument(
+        '--export-delta',
+        action='store_true',
+        help="""For .cast and .ans exports, only rewrite the lines that changed
+    from the previous frame.""",
     )
 
     return parser
 
 
-def get_output_dirnames(home_dir, version, input_source_hash, cols, rows, cell_width, cell_height):
+def _get_environ_size(environ, key):
+    try:
+        return int(environ[key])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_terminal_size(stdout, environ):
+    """
+    Like shutil.get_terminal_size(), COLUMNS and LINES take precedence over
+    the size of the terminal, so users can override it.
+    """
+    try:
+        size = os.get_terminal_size(stdout.fileno())
+        columns, lines = size.columns, size.lines
+    except (AttributeError, ValueError, OSError):
+        columns = lines = None
+
+    columns = _get_environ_size(environ, 'COLUMNS') or columns
+    lines = _get_environ_size(environ, 'LINES') or lines
+    if not columns or not lines:
+        return None
+    return columns, lines
+
+
+def get_size_bucket(terminal_size):
+    cols, lines = terminal_size
+    # leave a line for the cursor after the last row.
+    buckets = [
+        bucket
+        for bucket in SIZE_BUCKETS
+        if bucket[0] <= cols and bucket[1] <= lines - 1
+    ]
+    if buckets:
+        return buckets[-1]
+    return SIZE_BUCKETS[0]
+
+
+def get_output_dirnames(home_dir, version, input_source_hash, cols, rows, cell_width, cell_height,
+        color_space=DEFAULT_COLOR_SPACE, area_scale=False, equalize=DEFAULT_EQUALIZE, start=0,
+        duration=None, dither=DEFAULT_DITHER):
     # include generator options in path
     output_dirnames = {
-        '.': '{}/.cache/gif-for-cli/{}/{}-{}cols-{}rows-cw{}px-ch{}px'.format(
+        '.': '{}/.cache/gif-for-cli/{}/{}-{}cols-{}rows-cw{}px-ch{}px{}{}{}{}{}{}'.format(
             home_dir,
             version,
             input_source_hash,
             cols,
             rows,
             cell_width,
-            cell_height
+            cell_height,
+            # left out for the default, so existing caches are still found, see
+            # load_manifest() for how ones from before manifests are picked up.
+            '' if color_space == DEFAULT_COLOR_SPACE else '-' + color_space,
+            '-area' if area_scale else '',
+            '' if equalize == DEFAULT_EQUALIZE else '-equalize-' + equalize,
+            '' if dither == DEFAULT_DITHER else '-dither-' + dither,
+            '-from{:g}s'.format(start) if start else '',
+            '' if duration is None else '-for{:g}s'.format(duration),
         ),
     }
     output_dirnames['jpg'] = '{}/jpg'.format(output_dirnames['.'])
@@ -188,6 +420,10 @@ def get_output_dirnames(home_dir, version, input_source_hash, cols, rows, cell_w
     output_dirnames['256'] = '{}/256'.format(output_dirnames['.'])
     output_dirnames['256fgbg'] = '{}/256fgbg'.format(output_dirnames['.'])
     output_dirnames['truecolor'] = '{}/truecolor'.format(output_dirnames['.'])
+    output_dirnames['256half'] = '{}/256half'.format(output_dirnames['.'])
+    output_dirnames['truecolorhalf'] = '{}/truecolorhalf'.format(output_dirnames['.'])
+    output_dirnames['braille'] = '{}/braille'.format(output_dirnames['.'])
+    output_dirnames['256braille'] = '{}/256braille'.format(output_dirnames['.'])
     return output_dirnames
 
 
@@ -208,23 +444,90 @@ def _log_frame_progress(total, results, stdout):
     stdout.write('\n')
 
 
-def pool_abstraction(callable, items, pool_size, stdout, **options):
-    total = len(items)
+def _call_for_each(results, on_result):
+    for result in results:
+        on_result(result)
+        yield result
+
+
+_NO_ITEM = object()
+
+
+def _apply_bounded(pool, callable, items, max_pending, options):
+    """
+    Submits `items` to `pool` as earlier ones finish, so no more than
+    `max_pending` are in flight, and the next item isn't taken from `items`
+    until then.
+    """
+    pending = collections.deque()
+    items = iter(items)
+    while True:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+            continue
+
+        item = next(items, _NO_ITEM)
+        if item is _NO_ITEM:
+            break
+        pending.append(pool.apply_async(callable, [item], options))
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def _get_pool(pool_size):
+    if threading.current_thread() is threading.main_thread():
+        return Pool(pool_size)
+    # e.g. generating behind a --preview. Forking copies whatever locks the
+    # other threads hold at that moment, so workers are started fresh.
+    return get_context('spawn').Pool(pool_size)
+
+
+def pool_abstraction(callable, items, pool_size, stdout, on_result=None, max_pending=None,
+        total=None, **options):
+    """
+    `on_result`, if given, is called in this process with each result as
+    it comes in.
+
+    `max_pending`, if given, limits how many items are handed to the pool
+    at once, and `items` may then be a generator that's only advanced as
+    earlier items finish. `total` is the number of items, for progress,
+    when `items` has no len().
+    """
+    if total is None:
+        total = len(items)
 
     if pool_size == 1:
         results = (
             callable(item, **options)
             for item in items
         )
+        if on_result is not None:
+            results = _call_for_each(results, on_result)
         _log_frame_progress(total, results, stdout)
     else:
-        with Pool(pool_size) as pool:
-            # we need this consumed instantly in order for the tasks to begin
-            # execution in parallel.
-            results = [
-                pool.apply_async(callable, [item], options)
-                for item in items
-            ]
-            # then use a generator to iterate as they execute.
-            results = (r.get() for r in results)
+        with _get_pool(pool_size) as pool:
+            if instrument.enabled:
+                # workers send back their timers and counters with each
+                # result, so they can be aggregated here.
+                submitted_callable = functools.partial(instrument.call_with_stats, callable)
+            else:
+                submitted_callable = callable
+
+            if max_pending is not None:
+                results = _apply_bounded(pool, submitted_callable, items, max_pending, options)
+            else:
+                # we need this consumed instantly in order for the tasks to
+                # begin execution in parallel.
+                results = [
+                    pool.apply_async(submitted_callable, [item], options)
+                    for item in items
+                ]
+                # then use a generator to iterate as they execute.
+                results = (r.get() for r in results)
+
+            if instrument.enabled:
+                results = (instrument.merge_result(result) for result in results)
+            if on_result is not None:
+                results = _call_for_each(results, on_result)
             _log_frame_progress(total, results, stdout)
@@ -58,7 +58,7 @@ setup(
         'console_scripts': ['gif-for-cli=gif_for_cli.__main__:main'],
     },
     install_requires=[
-        'Pillow>=5.1.0',  # PIL Software License
+        'Pillow>=7.0.0',  # PIL Software License
         'requests>=2.18.4',  # Apache License 2.0
         'x256>=0.0.3',  # MIT License
     ],
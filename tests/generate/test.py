@@ -15,18 +15,48 @@ limitations under the License.
 """
 import io
 import json
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock, Mock
 
 from PIL import Image
 
+from gif_for_cli.constants import DISPLAY_MODES
+from gif_for_cli.storage import get_frame_ext
 from gif_for_cli.generate import (
     _run_ffmpeg,
     _save_config,
     convert_frame,
+    convert_img,
+    convert_shared_frame,
     _convert_frames,
+    _deduplicate,
+    _extract,
+    _extract_with_pil,
+    _get_durations,
+    DECODER_BACKENDS,
+    EmptyWindowError,
+    derive,
     generate,
+    generate_preview,
+    get_clip_nocolor_table,
+    slice_window,
+    _clip_to_window,
+    get_decoder,
+    get_grid_digest,
+    get_half_cell_grid,
+    get_sub_cell_img,
+    reset_written_digests,
 )
+from gif_for_cli.generate.manifest import (
+    get_missing_modes,
+    load_manifest,
+    mark_extracted,
+    mark_frame,
+    save_manifest,
+)
+from gif_for_cli.generate.shared_frames import shared_memory
 
 
 @patch('gif_for_cli.generate.open')
@@ -40,6 +70,7 @@ class TestSaveConfig(unittest.TestCase):
             'cols': 160,
             'cell_width': 3,
             'cell_height': 6,
+            'color_space': 'oklab',
             'output_dirnames': {'.': 'foo'},
         }
 
@@ -48,7 +79,7 @@ class TestSaveConfig(unittest.TestCase):
         f.close = lambda *args, **kwargs: None
         mocked_open.return_value = f
 
-        _save_config(num_frames, seconds, **options)
+        _save_config(num_frames, seconds, [0.15] * 10, **options)
 
         content = json.loads(f.getvalue())
 
@@ -59,8 +90,17 @@ class TestSaveConfig(unittest.TestCase):
             'cols': options['cols'],
             'cell_width': options['cell_width'],
             'cell_height': options['cell_height'],
+            'color_space': options['color_space'],
+            'area_scale': None,
+            'equalize': None,
+            'dither': None,
+            'nocolor_table': None,
+            'codec': None,
+            'start': None,
+            'duration': None,
             'num_frames': num_frames,
             'seconds': seconds,
+            'durations': [0.15] * 10,
         })
 
 
@@ -102,17 +142,642 @@ video:258kB audio:0kB subtitle:0kB other streams:0kB global headers:0kB muxing o
 
         self.assertEqual(num_frames, 11)
         self.assertEqual(seconds, 1.1)
+        # no padding frames for variable frame rates.
+        self.assertIn('passthrough', mock_Popen.call_args[0][0])
+
+    def test_area_scale(self, mock_Popen):
+        mock_process = Mock()
+        mock_process.returncode = 0
+        mock_process.communicate.return_value = (b'', b'frame=   11 time=00:00:01.10',)
+        mock_Popen.return_value = mock_process
+
+        _run_ffmpeg('foo.gif', {'jpg': 'foo/jpg'}, 160, 40, 3, 6, area_scale=True)
+
+        cmd = mock_Popen.call_args[0][0]
+        vf = cmd[cmd.index('-vf') + 1]
+        self.assertIn('flags=area', vf)
+        self.assertIn('/3)', vf)
+        self.assertIn('/6)', vf)
+        self.assertIn('yuvj444p', cmd)
+
+    def test_window(self, mock_Popen):
+        mock_process = Mock()
+        mock_process.returncode = 0
+        mock_process.communicate.return_value = (b'', b'frame=   11 time=00:00:01.10',)
+        mock_Popen.return_value = mock_process
+
+        _run_ffmpeg('foo.mp4', {'jpg': 'foo/jpg'}, 160, 40, 3, 6, start=12.5, duration=2)
+
+        # seeking before -i skips decoding up to the start.
+        cmd = mock_Popen.call_args[0][0]
+        self.assertEqual(cmd[:7], ['ffmpeg', '-y', '-ss', '12.5', '-t', '2', '-i'])
+
+    def test_nothing_output(self, mock_Popen):
+        mock_process = Mock()
+        mock_process.returncode = 0
+        mock_process.communicate.return_value = (b'', b'Output file is empty, nothing was encoded',)
+        mock_Popen.return_value = mock_process
+
+        num_frames, seconds = _run_ffmpeg('foo.mp4', {'jpg': 'foo/jpg'}, 160, 40, 3, 6, start=60)
+
+        self.assertEqual((num_frames, seconds,), (0, 0,))
+
+
+class TestDecoders(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.gif_filename = '{}/foo.gif'.format(self.tmp_dir.name)
+        frames = [Image.new('RGB', (100, 50,), (i * 80, 0, 0,)) for i in range(3)]
+        frames[0].save(self.gif_filename, save_all=True, append_images=frames[1:],
+            duration=[500, 0, 30])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_decoder(self):
+        self.assertEqual(get_decoder(self.gif_filename), 'pil')
+        self.assertEqual(get_decoder(self.gif_filename, 'ffmpeg'), 'ffmpeg')
+        self.assertEqual(get_decoder('https://example.com/foo.gif'), 'ffmpeg')
+
+        mp4_filename = '{}/foo.mp4'.format(self.tmp_dir.name)
+        with open(mp4_filename, 'wb') as f:
+            f.write(b'\x00\x00\x00\x18ftypmp42')
+        self.assertEqual(get_decoder(mp4_filename), 'ffmpeg')
+        self.assertEqual(get_decoder(mp4_filename, 'pil'), 'pil')
+
+    def test_extract_with_pil(self):
+        output_dirnames = {'jpg': self.tmp_dir.name}
+
+        num_frames, seconds, durations = _extract_with_pil(
+            self.gif_filename, output_dirnames, cols=40, rows=10, cell_width=3, cell_height=6)
+
+        self.assertEqual(num_frames, 3)
+        self.assertEqual(durations, [0.5, 0.1, 0.03])
+        self.assertAlmostEqual(seconds, 0.63)
+        self.assertEqual(sorted(
+            filename
+            for filename in os.listdir(self.tmp_dir.name)
+            if filename.endswith('.jpg')
+        ), ['0001.jpg', '0002.jpg', '0003.jpg'])
+
+        # 100x50 fit into 120x60, same as ffmpeg would.
+        with Image.open('{}/0003.jpg'.format(self.tmp_dir.name)) as img:
+            self.assertEqual(img.size, (120, 60,))
+
+    def test_extract_with_pil_window(self):
+        output_dirnames = {'jpg': self.tmp_dir.name}
+
+        num_frames, seconds, durations = _extract_with_pil(
+            self.gif_filename, output_dirnames, cols=40, rows=10, cell_width=3, cell_height=6,
+            start=0.45, duration=0.1)
+
+        self.assertEqual(durations, [0.05, 0.05])
+        self.assertEqual(sorted(
+            filename
+            for filename in os.listdir(self.tmp_dir.name)
+            if filename.endswith('.jpg')
+        ), ['0001.jpg', '0002.jpg'])
+        with Image.open('{}/0002.jpg'.format(self.tmp_dir.name)) as img:
+            self.assertGreater(img.getpixel((0, 0,))[0], 60)
+
+    def test_extract_with_pil_area_scale(self):
+        output_dirnames = {'jpg': self.tmp_dir.name}
+
+        _extract_with_pil(self.gif_filename, output_dirnames, cols=40, rows=10, cell_width=3,
+            cell_height=6, area_scale=True)
+
+        # one pixel per 3x6 cell of the 120x60 fit.
+        with Image.open('{}/0003.jpg'.format(self.tmp_dir.name)) as img:
+            self.assertEqual(img.size, (40, 10,))
+
+    @patch('gif_for_cli.generate._run_ffmpeg')
+    @patch('gif_for_cli.generate._extract_with_pil')
+    def test_extract(self, mock_extract_with_pil, mock_run_ffmpeg):
+        mock_extract_with_pil.return_value = (3, 0.63, [0.5, 0.1, 0.03])
+        output_dirnames = {'.': self.tmp_dir.name, 'jpg': self.tmp_dir.name}
+        manifest = load_manifest(self.tmp_dir.name)
+
+        with patch.dict(DECODER_BACKENDS, pil=mock_extract_with_pil):
+            _extract(manifest, input_source_file=self.gif_filename,
+                output_dirnames=output_dirnames)
+
+        self.assertEqual(mock_run_ffmpeg.call_count, 0)
+        self.assertEqual(mock_extract_with_pil.call_count, 1)
+        self.assertEqual(manifest['durations'], [0.5, 0.1, 0.03])
+
+    def test_extract_empty_window(self):
+        output_dirnames = {'.': self.tmp_dir.name, 'jpg': self.tmp_dir.name}
+        manifest = load_manifest(self.tmp_dir.name)
+
+        with self.assertRaises(EmptyWindowError):
+            _extract(manifest, input_source_file=self.gif_filename,
+                output_dirnames=output_dirnames, cols=40, rows=10, cell_width=3, cell_height=6,
+                start=5)
+
+        # nothing is recorded as extracted.
+        self.assertFalse(os.path.exists('{}/manifest.json'.format(self.tmp_dir.name)))
+
+    def extract_over_stale_frames(self, manifest):
+        jpg_dirname = '{}/jpg'.format(self.tmp_dir.name)
+        os.makedirs(jpg_dirname)
+        for frame_name in ['0001', '0002', '0003', '0004', '0005']:
+            Image.new('RGB', (4, 4,)).save('{}/{}.jpg'.format(jpg_dirname, frame_name))
+        output_dirnames = {'.': self.tmp_dir.name, 'jpg': jpg_dirname}
+
+        _extract(manifest, input_source_file=self.gif_filename, output_dirnames=output_dirnames,
+            cols=40, rows=10, cell_width=3, cell_height=6)
+
+        self.assertEqual(sorted(os.listdir(jpg_dirname)), ['0001.jpg', '0002.jpg', '0003.jpg'])
+        with Image.open('{}/0001.jpg'.format(jpg_dirname)) as img:
+            self.assertEqual(img.size, (120, 60,))
+        self.assertEqual(manifest['frame_names'], ['0001', '0002', '0003'])
+
+    def test_extract_pre_manifest_cache(self):
+        # frames from before manifests were kept, with no record of them.
+        self.extract_over_stale_frames(load_manifest(self.tmp_dir.name))
+
+    def test_extract_interrupted(self):
+        manifest = load_manifest(self.tmp_dir.name)
+        manifest['frame_names'] = ['0001', '0002', '0003', '0004', '0005']
+        self.extract_over_stale_frames(manifest)
+
+
+class TestGetGridDigest(unittest.TestCase):
+    def setUp(self):
+        reset_written_digests()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dirnames = {
+            mode: '{}/{}'.format(self.tmp_dir.name, mode)
+            for mode in DISPLAY_MODES
+        }
+        for dirname in self.output_dirnames.values():
+            os.makedirs(dirname)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_img(self, top, bottom):
+        # one 3x6 cell, which averages to the same color either way round.
+        img = Image.new('RGB', (3, 6,), bottom)
+        img.paste(top, (0, 0, 3, 3,))
+        return img
+
+    def test(self):
+        grid = [[[100, 100, 100]]]
+        light_top = get_sub_cell_img(self.get_img((200,) * 3, (0,) * 3), 1, 1, 3, 6)
+        dark_top = get_sub_cell_img(self.get_img((0,) * 3, (200,) * 3), 1, 1, 3, 6)
+        nearly_light_top = get_sub_cell_img(self.get_img((201,) * 3, (1,) * 3), 1, 1, 3, 6)
+
+        self.assertEqual(get_grid_digest(grid), get_grid_digest([[[101, 101, 101]]]))
+        self.assertNotEqual(get_grid_digest(grid, light_top), get_grid_digest(grid, dark_top))
+        self.assertEqual(get_grid_digest(grid, light_top),
+            get_grid_digest(grid, nearly_light_top))
+
+    def test_convert_img(self):
+        light_top = self.get_img((200,) * 3, (0,) * 3)
+        dark_top = self.get_img((0,) * 3, (200,) * 3)
+
+        digests = [
+            convert_img(img, frame_name, output_dirnames=self.output_dirnames, cell_width=3,
+                cell_height=6, modes=['nocolor'])
+            for frame_name, img in [('0001', light_top,), ('0002', dark_top,)]
+        ]
+
+        # the cells are the same, but the half block modes would draw them
+        # differently.
+        self.assertNotEqual(digests[0], digests[1])
+        self.assertEqual(sorted(os.listdir(self.output_dirnames['nocolor'])),
+            ['0001.txt', '0002.txt'])
+
+
+class TestAreaScale(unittest.TestCase):
+    def setUp(self):
+        reset_written_digests()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dirnames = {
+            key: '{}/{}'.format(self.tmp_dir.name, key)
+            for key in ['jpg'] + DISPLAY_MODES
+        }
+        for dirname in self.output_dirnames.values():
+            os.makedirs(dirname)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def convert(self, img, **options):
+        img.save('{}/0001.png'.format(self.tmp_dir.name))
+        img.save('{}/0001.jpg'.format(self.output_dirnames['jpg']), quality=95, subsampling=0)
+        reset_written_digests()
+        convert_frame('0001', output_dirnames=self.output_dirnames, cols=4, rows=2,
+            cell_width=3, cell_height=6, **options)
+        with open('{}/0001.txt'.format(self.output_dirnames['256'])) as f:
+            return f.read()
+
+    def test_parity(self):
+        # flat cells come out the same whether the decoder or Python averages them.
+        img = Image.new('RGB', (12, 12,))
+        for i, color in enumerate([(255, 0, 0), (0, 128, 0), (0, 0, 255), (200, 200, 200)]):
+            img.paste(color, (i * 3, 0, i * 3 + 3, 12,))
+
+        expected = self.convert(img)
+        actual = self.convert(img.resize((4, 2,), Image.BOX), area_scale=True)
+
+        self.assertEqual(actual, expected)
+
+
+class TestEqualize(unittest.TestCase):
+    def setUp(self):
+        reset_written_digests()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dirnames = {
+            key: '{}/{}'.format(self.tmp_dir.name, key)
+            for key in ['jpg'] + DISPLAY_MODES
+        }
+        for dirname in self.output_dirnames.values():
+            os.makedirs(dirname)
+
+        # a gradient, and the same with its brighter half turned black.
+        for i, black in enumerate([False, True]):
+            img = Image.new('RGB', (120, 6,))
+            for col in range(40):
+                gray = 0 if black and col >= 20 else col * 5
+                img.paste((gray, gray, gray,), (col * 3, 0, col * 3 + 3, 6,))
+            img.save('{}/{:04d}.jpg'.format(self.output_dirnames['jpg'], i + 1), quality=100)
+
+        self.options = {
+            'output_dirnames': self.output_dirnames,
+            'cols': 40,
+            'rows': 1,
+            'cell_width': 3,
+            'cell_height': 6,
+            'modes': ['nocolor'],
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def render(self, **options):
+        lines = []
+        for frame_name in ['0001', '0002']:
+            convert_frame(frame_name, **dict(self.options, **options))
+            with open('{}/{}.txt'.format(self.output_dirnames['nocolor'], frame_name)) as f:
+                lines.append(f.read())
+        return lines
+
+    def test_frame(self):
+        first, second = self.render()
+
+        # the unchanged half is drawn differently once the rest turns black.
+        self.assertNotEqual(first[:20], second[:20])
+
+    def test_clip(self):
+        nocolor_table = get_clip_nocolor_table(**self.options)
+
+        self.assertEqual(len(nocolor_table), 766)
+
+        first, second = self.render(nocolor_table=nocolor_table)
+
+        self.assertEqual(first[:20], second[:20])
+        self.assertNotEqual(first[20:], second[20:])
+
+
+class TestStreamFrames(unittest.TestCase):
+    def setUp(self):
+        reset_written_digests()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.gif_filename = '{}/foo.gif'.format(self.tmp_dir.name)
+        # the last frame repeats the first.
+        frames = [Image.new('RGB', (60, 30,), (i % 2 * 200, 0, 0,)) for i in range(3)]
+        frames[0].save(self.gif_filename, save_all=True, append_images=frames[1:],
+            duration=[200, 100, 300])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_entry(self, cols, rows):
+        dirname = '{}/{}x{}'.format(self.tmp_dir.name, cols, rows)
+        output_dirnames = {
+            key: '{}/{}'.format(dirname, key)
+            for key in ['jpg'] + DISPLAY_MODES
+        }
+        output_dirnames['.'] = dirname
+        for output_dirname in output_dirnames.values():
+            os.makedirs(output_dirname, exist_ok=True)
+        return {
+            'cols': cols,
+            'rows': rows,
+            'cell_width': 3,
+            'cell_height': 6,
+            'output_dirnames': output_dirnames,
+        }
+
+    def generate(self, cpu_pool_size, codec='none'):
+        entry = dict(self.get_entry(20, 5), codec=codec)
+        variant = dict(self.get_entry(10, 3), codec=codec)
+
+        with patch('gif_for_cli.generate._extract') as mock_extract:
+            generate(
+                stdout=io.StringIO(),
+                input_source='foo',
+                input_source_file=self.gif_filename,
+                cpu_pool_size=cpu_pool_size,
+                variants=[variant],
+                **entry
+            )
+
+        # decoded and converted in one go.
+        self.assertEqual(mock_extract.call_count, 0)
+
+        for e in [entry, variant]:
+            manifest = load_manifest(e['output_dirnames']['.'])
+            self.assertTrue(manifest['complete'])
+            self.assertEqual(manifest['frame_names'], ['0001', '0002', '0003'])
+            self.assertEqual(manifest['durations'], [0.2, 0.1, 0.3])
+
+            with open('{}/config.json'.format(e['output_dirnames']['.'])) as f:
+                config = json.load(f)
+            self.assertEqual(config['frames'], [['0001', 0.2], ['0002', 0.1], ['0001', 0.3]])
+            self.assertEqual(config['codec'], codec)
+
+            ext = get_frame_ext(codec)
+            for mode in DISPLAY_MODES:
+                self.assertEqual(
+                    sorted(os.listdir(e['output_dirnames'][mode])),
+                    ['0001.' + ext, '0002.' + ext],
+                )
+
+        self.assertEqual(
+            sorted(os.listdir(entry['output_dirnames']['jpg'])),
+            ['0001.jpg', '0002.jpg', '0003.jpg'],
+        )
+
+    def test(self):
+        self.generate(1)
+
+    @unittest.skipIf(shared_memory is None, 'needs multiprocessing.shared_memory')
+    def test_pool(self):
+        self.generate(2)
+
+    def test_codec(self):
+        self.generate(1, 'zlib')
+
+    def test_resumed_codec(self):
+        entry = self.get_entry(20, 5)
+        manifest = load_manifest(entry['output_dirnames']['.'])
+        manifest['codec'] = 'lzma'
+        mark_frame(manifest, '0001', DISPLAY_MODES)
+        save_manifest(entry['output_dirnames']['.'], manifest)
+
+        generate(
+            stdout=io.StringIO(),
+            input_source='foo',
+            input_source_file=self.gif_filename,
+            cpu_pool_size=1,
+            codec='zlib',
+            **entry
+        )
+
+        # the rest of the entry is written like its first frame was.
+        with open('{}/config.json'.format(entry['output_dirnames']['.'])) as f:
+            self.assertEqual(json.load(f)['codec'], 'lzma')
+        self.assertEqual(sorted(os.listdir(entry['output_dirnames']['nocolor'])),
+            ['0002.txt.xz', '0003.txt.xz'])
+
+    def test_interrupted(self):
+        entry = self.get_entry(20, 5)
+
+        def convert_first(item, **options):
+            if item[0] != '0001':
+                raise KeyboardInterrupt()
+            return convert_shared_frame(item, **options)
+
+        with patch('gif_for_cli.generate.convert_shared_frame', side_effect=convert_first):
+            with self.assertRaises(KeyboardInterrupt):
+                generate(stdout=io.StringIO(), input_source='foo',
+                    input_source_file=self.gif_filename, cpu_pool_size=1, **entry)
+
+        # the frame converted before the interruption is kept.
+        manifest = load_manifest(entry['output_dirnames']['.'])
+        self.assertFalse(manifest['extracted'])
+        self.assertEqual(get_missing_modes(manifest, '0001'), [])
+        self.assertEqual(get_missing_modes(manifest, '0002'), DISPLAY_MODES)
+
+    def test_empty_window(self):
+        entry = self.get_entry(20, 5)
+
+        with self.assertRaises(EmptyWindowError):
+            generate(stdout=io.StringIO(), input_source='foo',
+                input_source_file=self.gif_filename, cpu_pool_size=1, start=5, **entry)
+
+        self.assertFalse(load_manifest(entry['output_dirnames']['.'])['complete'])
+        self.assertFalse(os.path.exists('{}/config.json'.format(entry['output_dirnames']['.'])))
+
+    def test_window_progress(self):
+        entry = self.get_entry(20, 5)
+        stdout = io.StringIO()
+
+        generate(stdout=stdout, input_source='foo', input_source_file=self.gif_filename,
+            cpu_pool_size=1, start=0.2, duration=0.1, **entry)
+
+        self.assertIn('Processed 1/1 frames', stdout.getvalue())
+
+
+class TestClipToWindow(unittest.TestCase):
+    def test(self):
+        items = [('a', 1,), ('b', 2,), ('c', 1,)]
+
+        self.assertEqual(list(_clip_to_window(items)), items)
+        self.assertEqual(list(_clip_to_window(items, 1)), [('b', 2,), ('c', 1,)])
+        self.assertEqual(list(_clip_to_window(items, 0.5, 1)), [('a', 0.5,), ('b', 0.5,)])
+        self.assertEqual(list(_clip_to_window(items, 1.5)), [('b', 1.5,), ('c', 1,)])
+        self.assertEqual(list(_clip_to_window(items, 5)), [])
+
+    def test_float_error(self):
+        # 0.1 * 3 adds up to just over 0.3.
+        items = [('{:04d}'.format(i), 0.1,) for i in range(1, 10)]
+
+        self.assertEqual(list(_clip_to_window(items, 0.3, 0.5)), items[3:8])
+
+    def test_zero_seconds(self):
+        items = [('a', 1,), ('b', 0,), ('c', 1,)]
+
+        self.assertEqual(list(_clip_to_window(items)), [('a', 1,), ('c', 1,)])
+
+    def test_stops_early(self):
+        def items():
+            yield 'a', 1
+            yield 'b', 1
+            raise AssertionError('read past the window')
+
+        self.assertEqual(list(_clip_to_window(items(), 0, 1)), [('a', 1,)])
+
+
+class TestSliceWindow(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_output_dirnames(self, name):
+        dirname = '{}/{}'.format(self.tmp_dir.name, name)
+        output_dirnames = {
+            mode: '{}/{}'.format(dirname, mode)
+            for mode in DISPLAY_MODES
+        }
+        output_dirnames['.'] = dirname
+        for output_dirname in output_dirnames.values():
+            os.makedirs(output_dirname, exist_ok=True)
+        return output_dirnames
+
+    def test(self):
+        source_output_dirnames = self.get_output_dirnames('whole')
+        for mode in DISPLAY_MODES:
+            for frame_name in ['0001', '0002', '0004']:
+                with open('{}/{}.txt'.format(source_output_dirnames[mode], frame_name), 'w') as f:
+                    f.write(frame_name)
+        with open('{}/config.json'.format(source_output_dirnames['.']), 'w') as f:
+            json.dump({
+                'input_source': 'foo.mp4',
+                'num_frames': 4,
+                'seconds': 1.0,
+                'frames': [['0001', 0.25], ['0002', 0.25], ['0001', 0.25], ['0004', 0.25]],
+            }, f)
+        manifest = load_manifest(source_output_dirnames['.'])
+        mark_extracted(manifest, 4, 1.0, ['0001', '0002', '0003', '0004'])
+        save_manifest(source_output_dirnames['.'], manifest)
+
+        output_dirnames = self.get_output_dirnames('window')
+        slice_window(source_output_dirnames, start=0.3, duration=0.5, cols=80,
+            output_dirnames=output_dirnames)
+
+        with open('{}/config.json'.format(output_dirnames['.'])) as f:
+            config = json.load(f)
+        self.assertEqual(config['frames'], [['0002', 0.2], ['0001', 0.25], ['0004', 0.05]])
+        self.assertEqual(config['start'], 0.3)
+        self.assertEqual(config['duration'], 0.5)
+        self.assertEqual(config['input_source'], 'foo.mp4')
+
+        self.assertTrue(load_manifest(output_dirnames['.'])['complete'])
+        for mode in DISPLAY_MODES:
+            self.assertEqual(sorted(os.listdir(output_dirnames[mode])),
+                ['0001.txt', '0002.txt', '0004.txt'])
+        self.assertTrue(os.path.samefile(
+            '{}/0004.txt'.format(source_output_dirnames['nocolor']),
+            '{}/0004.txt'.format(output_dirnames['nocolor']),
+        ))
+
+    def test_empty(self):
+        source_output_dirnames = self.get_output_dirnames('whole')
+        with open('{}/config.json'.format(source_output_dirnames['.']), 'w') as f:
+            json.dump({'num_frames': 1, 'seconds': 1.5, 'frames': [['0001', 1.5]]}, f)
+        manifest = load_manifest(source_output_dirnames['.'])
+        mark_extracted(manifest, 1, 1.5, ['0001'])
+        save_manifest(source_output_dirnames['.'], manifest)
+
+        output_dirnames = self.get_output_dirnames('window')
+        with self.assertRaises(EmptyWindowError):
+            slice_window(source_output_dirnames, start=5, cols=80,
+                output_dirnames=output_dirnames)
+
+        self.assertFalse(load_manifest(output_dirnames['.'])['complete'])
+        self.assertFalse(os.path.exists('{}/config.json'.format(output_dirnames['.'])))
+
+
+class TestGetDurations(unittest.TestCase):
+    def test_gif(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = '{}/foo.gif'.format(tmp_dir)
+            frames = [Image.new('RGB', (4, 4,), (i * 80, 0, 0,)) for i in range(3)]
+            frames[0].save(filename, save_all=True, append_images=frames[1:],
+                duration=[500, 0, 30])
+
+            # a 0 delay is shown at the usual rate.
+            self.assertEqual(_get_durations(filename, 3), [0.5, 0.1, 0.03])
+            self.assertIsNone(_get_durations(filename, 4))
+
+    @patch('gif_for_cli.generate.subprocess.Popen')
+    def test_ffprobe(self, mock_Popen):
+        mock_process = Mock()
+        mock_process.returncode = 0
+        mock_process.communicate.return_value = (json.dumps({'frames': [
+            {'best_effort_timestamp_time': '0.000000', 'pkt_duration_time': '0.040000'},
+            {'best_effort_timestamp_time': '0.040000', 'pkt_duration_time': '0.040000'},
+            {'best_effort_timestamp_time': '0.120000', 'pkt_duration_time': '0.060000'},
+        ]}).encode('utf8'), b'',)
+        mock_Popen.return_value = mock_process
+
+        durations = _get_durations('https://example.com/foo.mp4', 3)
+
+        self.assertEqual(mock_Popen.call_args[0][0][0], 'ffprobe')
+        self.assertEqual([round(seconds, 3) for seconds in durations], [0.04, 0.08, 0.06])
+
+    @patch('gif_for_cli.generate.subprocess.Popen')
+    def test_ffprobe_window(self, mock_Popen):
+        mock_process = Mock()
+        mock_process.returncode = 0
+        # read from the keyframe before the start.
+        mock_process.communicate.return_value = (json.dumps({'frames': [
+            {'best_effort_timestamp_time': '9.000000'},
+            {'best_effort_timestamp_time': '10.000000'},
+            {'best_effort_timestamp_time': '10.500000'},
+            {'best_effort_timestamp_time': '11.000000'},
+        ]}).encode('utf8'), b'',)
+        mock_Popen.return_value = mock_process
+
+        durations = _get_durations('https://example.com/foo.mp4', 2, 10, 1)
+
+        cmd = mock_Popen.call_args[0][0]
+        self.assertEqual(cmd[cmd.index('-read_intervals') + 1], '10%+1')
+        self.assertEqual(durations, [0.5, 0.5])
+
+    @patch('gif_for_cli.generate.subprocess.Popen')
+    def test_no_ffprobe(self, mock_Popen):
+        mock_Popen.side_effect = FileNotFoundError
+
+        self.assertIsNone(_get_durations('foo.mp4', 3))
+
+
+class TestGetHalfCellGrid(unittest.TestCase):
+    def test(self):
+        im = Image.new('RGB', (6, 6,))
+        im.paste((255, 0, 0,), (0, 0, 6, 3,))
+
+        grid = get_half_cell_grid(im, 3, 6)
+
+        self.assertEqual(grid, [
+            [[255, 0, 0], [255, 0, 0]],
+            [[0, 0, 0], [0, 0, 0]],
+        ])
+
+    def test_odd_cell_height(self):
+        im = Image.new('RGB', (3, 3,))
+        im.paste((255, 255, 255,), (0, 0, 3, 1,))
+
+        # the middle row of pixels is split between both halves.
+        self.assertEqual(get_half_cell_grid(im, 3, 3), [
+            [[170, 170, 170]],
+            [[0, 0, 0]],
+        ])
+        self.assertEqual(len(get_half_cell_grid(im, 3, 3, 'linear')), 2)
 
 
 @patch('gif_for_cli.generate.Image')
 class TestConvertFrame(unittest.TestCase):
+    def setUp(self):
+        reset_written_digests()
+
+    def mock_open_image(self, mock_Image, im):
+        mock_Image.open.return_value = im
+        mock_Image.BOX = Image.BOX
+
     def test(self, mock_Image):
         im = Image.new('RGB', (100, 100,))
         # this exercises some code branches that handle multiple colors
         for i in range(0, 10):
             im.putpixel((i, 0,), (255, 255, 5 * i,))
 
-        mock_Image.open.return_value = im
+        self.mock_open_image(mock_Image, im)
 
         frame_name = '0001'
         options = {
@@ -124,27 +789,150 @@ class TestConvertFrame(unittest.TestCase):
                 '256': 'foo/256',
                 '256fgbg': 'foo/256fgbg',
                 'truecolor': 'foo/truecolor',
+                '256half': 'foo/256half',
+                'truecolorhalf': 'foo/truecolorhalf',
+                'braille': 'foo/braille',
+                '256braille': 'foo/256braille',
             },
         }
 
-        with patch('gif_for_cli.generate.open') as mocked_open:
+        with patch('gif_for_cli.storage.open') as mocked_open:
+            convert_frame(frame_name, **options)
+
+        self.assertEqual(mock_Image.open.call_count, 1)
+        self.assertEqual(mocked_open.call_count, 8)
+
+    def test_repeated_frame(self, mock_Image):
+        self.mock_open_image(mock_Image, Image.new('RGB', (30, 12,), (10, 20, 30,)))
+
+        output_dirnames = {
+            'jpg': 'foo/jpg',
+            'nocolor': 'foo/nocolor',
+            '256': 'foo/256',
+            '256fgbg': 'foo/256fgbg',
+            'truecolor': 'foo/truecolor',
+            '256half': 'foo/256half',
+            'truecolorhalf': 'foo/truecolorhalf',
+            'braille': 'foo/braille',
+            '256braille': 'foo/256braille',
+        }
+
+        with patch('gif_for_cli.storage.open') as mocked_open:
+            first = convert_frame('0001', cell_height=6, cell_width=3,
+                output_dirnames=output_dirnames)
+            second = convert_frame('0002', cell_height=6, cell_width=3,
+                output_dirnames=output_dirnames)
+
+        # only the first is written.
+        self.assertEqual(mocked_open.call_count, 8)
+        self.assertEqual(first[0], '0001')
+        self.assertEqual(second[0], '0002')
+        self.assertEqual(first[1], second[1])
+
+    def test_color_spaces(self, mock_Image):
+        im = Image.new('RGB', (30, 12,))
+        for i in range(0, 30):
+            im.putpixel((i, 0,), (255, 8 * i, 5 * i,))
+        self.mock_open_image(mock_Image, im)
+
+        output_dirnames = {
+            'jpg': 'foo/jpg',
+            'nocolor': 'foo/nocolor',
+            '256': 'foo/256',
+            '256fgbg': 'foo/256fgbg',
+            'truecolor': 'foo/truecolor',
+            '256half': 'foo/256half',
+            'truecolorhalf': 'foo/truecolorhalf',
+            'braille': 'foo/braille',
+            '256braille': 'foo/256braille',
+        }
+
+        for color_space in ['linear', 'oklab']:
+            reset_written_digests()
+            with patch('gif_for_cli.storage.open') as mocked_open:
+                convert_frame('0001', cell_height=6, cell_width=3, color_space=color_space,
+                    output_dirnames=output_dirnames)
+
+            self.assertEqual(mocked_open.call_count, 8)
+            write = mocked_open.return_value.__enter__.return_value.write
+            for call in write.call_args_list:
+                lines = call[0][0].split('\n')
+                self.assertEqual(len(lines), 2)
+
+            truecolor = write.call_args_list[3][0][0].split('\n')
+            # the bright top row lifts the linear light average more.
+            self.assertEqual(truecolor[0].count('\u001b[38;2;'), 10)
+            self.assertNotEqual(truecolor[0], truecolor[1])
+
+    def test_variants(self, mock_Image):
+        im = Image.new('RGB', (120, 60,))
+        self.mock_open_image(mock_Image, im)
+        mock_Image.BICUBIC = Image.BICUBIC
+
+        frame_name = '0001'
+        options = {
+            'cell_height': 6,
+            'cell_width': 3,
+            'output_dirnames': {
+                'jpg': 'foo/jpg',
+                'nocolor': 'foo/nocolor',
+                '256': 'foo/256',
+                '256fgbg': 'foo/256fgbg',
+                'truecolor': 'foo/truecolor',
+                '256half': 'foo/256half',
+                'truecolorhalf': 'foo/truecolorhalf',
+                'braille': 'foo/braille',
+                '256braille': 'foo/256braille',
+            },
+            'variants': [
+                {
+                    'cols': 20,
+                    'rows': 20,
+                    'cell_height': 6,
+                    'cell_width': 3,
+                    'output_dirnames': {
+                        'nocolor': 'bar/nocolor',
+                        '256': 'bar/256',
+                        '256fgbg': 'bar/256fgbg',
+                        'truecolor': 'bar/truecolor',
+                        '256half': 'bar/256half',
+                        'truecolorhalf': 'bar/truecolorhalf',
+                        'braille': 'bar/braille',
+                        '256braille': 'bar/256braille',
+                    },
+                },
+            ],
+        }
+
+        with patch('gif_for_cli.storage.open') as mocked_open:
             convert_frame(frame_name, **options)
 
         self.assertEqual(mock_Image.open.call_count, 1)
-        self.assertEqual(mocked_open.call_count, 4)
+        self.assertEqual(mocked_open.call_count, 16)
+        self.assertEqual(mocked_open.call_args_list[8][0][0], 'bar/nocolor/0001.txt')
 
+        # 120x60 fit into 60x120 is 60x30, i.e. 20 cols and 5 rows.
+        lines = mocked_open.return_value.__enter__.return_value.write.call_args_list[8][0][0]
+        lines = lines.split('\n')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(len(lines[0]), 20)
 
+
+@patch('gif_for_cli.generate.save_manifest')
 @patch('gif_for_cli.generate.get_sorted_filenames')
 @patch('gif_for_cli.generate.convert_frame')
 @patch('gif_for_cli.utils.Pool')
 class TestConvertFrames(unittest.TestCase):
-    def test_1_cpu(self, mock_Pool, mock_convert_frame, mock_get_sorted_filenames):
+    def test_1_cpu(self, mock_Pool, mock_convert_frame, mock_get_sorted_filenames,
+            mock_save_manifest):
         mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+        mock_convert_frame.side_effect = lambda frame_name, **options: (frame_name, [None])
 
         options = {
             'cpu_pool_size': 1,
             'stdout': io.StringIO(),
             'output_dirnames': {
+                '.': 'foo',
                 'jpg': 'foo/jpg',
             },
         }
@@ -167,8 +955,10 @@ class TestConvertFrames(unittest.TestCase):
             'Processed 2/2 frames...',
         ])
 
-    def test_2_cpus(self, mock_Pool, mock_convert_frame, mock_get_sorted_filenames):
+    def test_2_cpus(self, mock_Pool, mock_convert_frame, mock_get_sorted_filenames,
+            mock_save_manifest):
         mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+        mock_convert_frame.side_effect = lambda frame_name, **options: (frame_name, [None])
         mock_pool = MagicMock()
         mock_pool.__enter__.return_value = mock_pool
 
@@ -183,6 +973,7 @@ class TestConvertFrames(unittest.TestCase):
             'cpu_pool_size': 2,
             'stdout': io.StringIO(),
             'output_dirnames': {
+                '.': 'foo',
                 'jpg': 'foo/jpg',
             },
         }
@@ -206,19 +997,293 @@ class TestConvertFrames(unittest.TestCase):
         ])
 
 
+@patch('gif_for_cli.generate._deduplicate')
+@patch('gif_for_cli.generate.save_manifest')
+@patch('gif_for_cli.generate.get_sorted_filenames')
+@patch('gif_for_cli.generate.convert_img')
+@patch('gif_for_cli.generate._save_config')
+@patch('gif_for_cli.generate.Image')
+class TestDerive(unittest.TestCase):
+    def test(self, mock_Image, mock_save_config, mock_convert_img, mock_get_sorted_filenames,
+            mock_save_manifest, mock_deduplicate):
+        mock_Image.open.return_value = Image.new('RGB', (480, 240,))
+        mock_Image.BICUBIC = Image.BICUBIC
+        mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+
+        source_output_dirnames = {'.': 'foo', 'jpg': 'foo/jpg'}
+        options = {
+            'cols': 80,
+            'rows': 20,
+            'cell_width': 3,
+            'cell_height': 6,
+            'output_dirnames': {'.': 'bar'},
+        }
+
+        with patch('gif_for_cli.generate.open') as mocked_open:
+            mocked_open.return_value = io.StringIO(json.dumps({
+                'input_source': 'foo.gif',
+                'input_source_file': 'foo.gif',
+                'num_frames': 2,
+                'seconds': 0.2,
+            }))
+
+            derive(source_output_dirnames, **options)
+
+        self.assertEqual(mocked_open.call_args[0][0], 'foo/config.json')
+        self.assertEqual(mock_save_config.call_count, 1)
+        self.assertEqual(mock_save_config.call_args[0], (2, 0.2,))
+        self.assertEqual(mock_save_config.call_args[1]['input_source'], 'foo.gif')
+        self.assertEqual(mock_save_config.call_args[1]['output_dirnames'], {'.': 'bar'})
+
+        self.assertEqual(mock_Image.open.call_args_list[1][0][0], 'foo/jpg/0002.jpg')
+        self.assertEqual(mock_convert_img.call_count, 2)
+        img = mock_convert_img.call_args[0][0]
+        self.assertEqual(img.size, (240, 120,))
+        self.assertEqual(mock_convert_img.call_args[0][1], '0002')
+        self.assertEqual(mock_deduplicate.call_count, 1)
+
+
+class TestGeneratePreview(unittest.TestCase):
+    def setUp(self):
+        reset_written_digests()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_output_dirnames = {
+            '.': self.tmp_dir.name,
+            'jpg': '{}/jpg'.format(self.tmp_dir.name),
+        }
+        os.makedirs(self.source_output_dirnames['jpg'])
+        for i in range(5):
+            Image.new('RGB', (60, 30,), (200 if i == 3 else 0, 0, 0,)).save(
+                '{}/{:04d}.jpg'.format(self.source_output_dirnames['jpg'], i + 1))
+        with open('{}/config.json'.format(self.tmp_dir.name), 'w') as f:
+            json.dump({
+                'input_source': 'foo.gif',
+                'num_frames': 5,
+                'seconds': 0.9,
+                'durations': [0.1, 0.2, 0.3, 0.2, 0.1],
+            }, f)
+
+        self.output_dirnames = {
+            key: '{}/preview/{}'.format(self.tmp_dir.name, key)
+            for key in DISPLAY_MODES
+        }
+        self.output_dirnames['.'] = '{}/preview'.format(self.tmp_dir.name)
+        for output_dirname in self.output_dirnames.values():
+            os.makedirs(output_dirname, exist_ok=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def generate_preview(self, max_frames):
+        generate_preview(self.source_output_dirnames, max_frames, cols=10, rows=5,
+            cell_width=3, cell_height=6, modes=['nocolor'], output_dirnames=self.output_dirnames)
+
+        with open('{}/config.json'.format(self.output_dirnames['.'])) as f:
+            return json.load(f)
+
+    def test(self):
+        config = self.generate_preview(2)
+
+        # every 3rd frame, held for as long as the frames it stands in for.
+        self.assertEqual(config['frames'], [['0001', 0.6], ['0004', 0.3]])
+        self.assertEqual(config['seconds'], 0.9)
+        self.assertEqual(config['input_source'], 'foo.gif')
+        self.assertEqual(sorted(os.listdir(self.output_dirnames['nocolor'])),
+            ['0001.txt', '0004.txt'])
+        self.assertEqual(os.listdir(self.output_dirnames['truecolor']), [])
+
+    def test_repeated_frame(self):
+        config = self.generate_preview(5)
+
+        self.assertEqual(config['frames'], [['0001', 0.6], ['0004', 0.2], ['0001', 0.1]])
+        self.assertEqual(sorted(os.listdir(self.output_dirnames['nocolor'])),
+            ['0001.txt', '0004.txt'])
+
+
+@patch('gif_for_cli.generate._get_durations', Mock(return_value=None))
+@patch('gif_for_cli.generate.save_manifest')
+@patch('gif_for_cli.generate.load_manifest')
+@patch('gif_for_cli.generate.get_sorted_filenames')
 @patch('gif_for_cli.generate._run_ffmpeg')
 @patch('gif_for_cli.generate._save_config')
 @patch('gif_for_cli.generate._convert_frames')
 class TestGenerate(unittest.TestCase):
-    def test(self, mock_convert_frames, mock_save_config, mock_run_ffmpeg):
-        mock_run_ffmpeg.return_value = (11, 1.1,)
+    def setUp(self):
+        self.options = {
+            'input_source_file': 'foo.gif',
+            'cols': 160,
+            'rows': 40,
+            'output_dirnames': {'.': 'foo', 'jpg': 'foo/jpg'},
+        }
 
-        options = {}
+    def test(self, mock_convert_frames, mock_save_config, mock_run_ffmpeg,
+            mock_get_sorted_filenames, mock_load_manifest, mock_save_manifest):
+        mock_run_ffmpeg.return_value = (11, 1.1,)
+        mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+        mock_load_manifest.side_effect = lambda dirname: load_manifest('/nonexistent')
 
-        generate(**options)
+        generate(**self.options)
 
         self.assertEqual(mock_convert_frames.call_count, 1)
         self.assertEqual(mock_save_config.call_count, 1)
         self.assertEqual(mock_save_config.call_args[0][0], 11)
         self.assertEqual(mock_save_config.call_args[0][1], 1.1)
         self.assertEqual(mock_run_ffmpeg.call_count, 1)
+
+        manifest = mock_save_manifest.call_args[0][1]
+        self.assertTrue(manifest['extracted'])
+        self.assertEqual(manifest['frame_names'], ['0001', '0002'])
+
+    def test_durations(self, mock_convert_frames, mock_save_config, mock_run_ffmpeg,
+            mock_get_sorted_filenames, mock_load_manifest, mock_save_manifest):
+        mock_run_ffmpeg.return_value = (2, 0.2,)
+        mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+        mock_load_manifest.side_effect = lambda dirname: load_manifest('/nonexistent')
+
+        with patch('gif_for_cli.generate._get_durations') as mock_get_durations:
+            mock_get_durations.return_value = [0.5, 0.25]
+            generate(**self.options)
+
+        self.assertEqual(mock_get_durations.call_args[0], ('foo.gif', 2, 0, None,))
+        self.assertEqual(mock_save_config.call_args[0], (2, 0.75, [0.5, 0.25],))
+
+    def test_variants(self, mock_convert_frames, mock_save_config, mock_run_ffmpeg,
+            mock_get_sorted_filenames, mock_load_manifest, mock_save_manifest):
+        mock_run_ffmpeg.return_value = (11, 1.1,)
+        mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+        mock_load_manifest.side_effect = lambda dirname: load_manifest('/nonexistent')
+
+        variant = {
+            'cols': 80,
+            'rows': 20,
+            'output_dirnames': {'.': 'bar'},
+        }
+
+        generate(variants=[variant], **self.options)
+
+        self.assertEqual(mock_run_ffmpeg.call_count, 1)
+        self.assertEqual(mock_save_config.call_count, 2)
+        self.assertEqual(mock_save_config.call_args_list[0][1]['output_dirnames'],
+            self.options['output_dirnames'])
+        self.assertEqual(mock_save_config.call_args_list[1][1]['output_dirnames'], {'.': 'bar'})
+        self.assertEqual(mock_save_config.call_args_list[1][1]['cols'], 80)
+        self.assertEqual(mock_convert_frames.call_count, 1)
+        self.assertEqual(mock_convert_frames.call_args[1]['variants'], [variant])
+
+        manifests = mock_convert_frames.call_args[1]['manifests']
+        self.assertEqual(len(manifests), 2)
+        self.assertEqual(manifests[1]['frame_names'], ['0001', '0002'])
+
+    def test_resume(self, mock_convert_frames, mock_save_config, mock_run_ffmpeg,
+            mock_get_sorted_filenames, mock_load_manifest, mock_save_manifest):
+        mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg']
+        manifest = load_manifest('/nonexistent')
+        mark_extracted(manifest, 2, 0.2, ['0001', '0002'])
+        mock_load_manifest.return_value = manifest
+
+        generate(**self.options)
+
+        self.assertEqual(mock_run_ffmpeg.call_count, 0)
+        self.assertEqual(mock_save_config.call_args[0], (2, 0.2, None,))
+        self.assertEqual(mock_convert_frames.call_count, 1)
+
+    def test_resume_missing_jpgs(self, mock_convert_frames, mock_save_config, mock_run_ffmpeg,
+            mock_get_sorted_filenames, mock_load_manifest, mock_save_manifest):
+        mock_run_ffmpeg.return_value = (2, 0.2,)
+        mock_get_sorted_filenames.return_value = ['0001.jpg']
+        manifest = load_manifest('/nonexistent')
+        mark_extracted(manifest, 2, 0.2, ['0001', '0002'])
+        mock_load_manifest.return_value = manifest
+
+        generate(**self.options)
+
+        self.assertEqual(mock_run_ffmpeg.call_count, 1)
+
+
+@patch('gif_for_cli.generate._deduplicate')
+@patch('gif_for_cli.generate.save_manifest')
+@patch('gif_for_cli.generate.get_sorted_filenames')
+@patch('gif_for_cli.generate.convert_frame')
+class TestConvertFramesResume(unittest.TestCase):
+    def test(self, mock_convert_frame, mock_get_sorted_filenames, mock_save_manifest,
+            mock_deduplicate):
+        mock_get_sorted_filenames.return_value = ['0001.jpg', '0002.jpg', '0003.jpg']
+        mock_convert_frame.side_effect = lambda frame_name, **options: (frame_name, [None])
+
+        manifest = load_manifest('/nonexistent')
+        mark_extracted(manifest, 3, 0.3, ['0001', '0002', '0003'])
+        mark_frame(manifest, '0001', DISPLAY_MODES)
+        mark_frame(manifest, '0002', ['nocolor', '256'])
+
+        _convert_frames(
+            cpu_pool_size=1,
+            stdout=io.StringIO(),
+            manifests=[manifest],
+            output_dirnames={'.': 'foo', 'jpg': 'foo/jpg'},
+        )
+
+        self.assertEqual(mock_convert_frame.call_count, 2)
+        self.assertEqual(mock_convert_frame.call_args_list[0][0][0], '0002')
+        self.assertEqual(mock_convert_frame.call_args_list[0][1]['modes'],
+            ['256fgbg', 'truecolor', '256half', 'truecolorhalf', 'braille', '256braille'])
+        self.assertEqual(mock_convert_frame.call_args_list[1][0][0], '0003')
+        self.assertEqual(mock_convert_frame.call_args_list[1][1]['modes'], DISPLAY_MODES)
+
+        saved = mock_save_manifest.call_args[0][1]
+        self.assertTrue(saved['complete'])
+        self.assertEqual(mock_deduplicate.call_count, 1)
+
+
+class TestDeduplicate(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dirnames = {'.': self.tmp_dir.name}
+        for mode in DISPLAY_MODES:
+            self.output_dirnames[mode] = '{}/{}'.format(self.tmp_dir.name, mode)
+            os.makedirs(self.output_dirnames[mode])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test(self):
+        frame_names = ['0001', '0002', '0003', '0004']
+        with open('{}/config.json'.format(self.tmp_dir.name), 'w') as f:
+            json.dump({'num_frames': 4, 'seconds': 0.4}, f)
+        for mode in DISPLAY_MODES:
+            # the second frame was left unrendered by convert_img().
+            for frame_name in ['0001', '0003', '0004']:
+                open('{}/{}.txt'.format(self.output_dirnames[mode], frame_name), 'w').close()
+
+        manifest = load_manifest(self.tmp_dir.name)
+        mark_extracted(manifest, 4, 0.4, frame_names)
+        for frame_name, digest in zip(frame_names, ['a', 'a', 'b', 'a']):
+            mark_frame(manifest, frame_name, DISPLAY_MODES, digest)
+
+        _deduplicate(self.output_dirnames, manifest)
+
+        self.assertTrue(manifest['deduplicated'])
+        with open('{}/config.json'.format(self.tmp_dir.name)) as f:
+            config = json.load(f)
+        self.assertEqual([frame_name for frame_name, seconds in config['frames']],
+            ['0001', '0003', '0001'])
+        self.assertEqual([round(seconds, 3) for frame_name, seconds in config['frames']],
+            [0.2, 0.1, 0.1])
+        for mode in DISPLAY_MODES:
+            self.assertEqual(sorted(os.listdir(self.output_dirnames[mode])),
+                ['0001.txt', '0003.txt'])
+
+    def test_durations(self):
+        frame_names = ['0001', '0002', '0003']
+        with open('{}/config.json'.format(self.tmp_dir.name), 'w') as f:
+            json.dump({'num_frames': 3, 'seconds': 0.6, 'durations': [0.1, 0.4, 0.1]}, f)
+
+        manifest = load_manifest(self.tmp_dir.name)
+        mark_extracted(manifest, 3, 0.6, frame_names)
+        for frame_name, digest in zip(frame_names, ['a', 'a', 'b']):
+            mark_frame(manifest, frame_name, DISPLAY_MODES, digest)
+
+        _deduplicate(self.output_dirnames, manifest)
+
+        with open('{}/config.json'.format(self.tmp_dir.name)) as f:
+            config = json.load(f)
+        self.assertEqual(config['frames'], [['0001', 0.5], ['0003', 0.1]])
@@ -0,0 +1,136 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import unittest
+
+from PIL import Image
+
+from x256 import x256
+
+from gif_for_cli.generate.color import (
+    get_256_indexes,
+    get_linear_cell_grid,
+    srgb_to_oklab,
+    top_2_oklab_colors,
+)
+
+
+class TestSrgbToOklab(unittest.TestCase):
+    def test(self):
+        L, a, b = srgb_to_oklab(255, 255, 255)
+        self.assertAlmostEqual(L, 1, places=3)
+        self.assertAlmostEqual(a, 0, places=3)
+        self.assertAlmostEqual(b, 0, places=3)
+
+        self.assertEqual(srgb_to_oklab(0, 0, 0), (0, 0, 0,))
+
+
+class TestGetLinearCellGrid(unittest.TestCase):
+    def test(self):
+        # half black, half white.
+        img = Image.new('RGB', (7, 4,))
+        for x in range(7):
+            img.putpixel((x, 0,), (255, 255, 255,))
+            img.putpixel((x, 1,), (255, 255, 255,))
+
+        grid = get_linear_cell_grid(img, 3, 4)
+
+        # the extra column is trimmed.
+        self.assertEqual(len(grid), 1)
+        self.assertEqual(len(grid[0]), 2)
+        # 50% linear light is much brighter than the 128 a gamma space mean gives.
+        self.assertEqual(grid[0][0], [188, 188, 188])
+
+    def test_uniform(self):
+        img = Image.new('RGB', (6, 6,), (10, 128, 250,))
+
+        self.assertEqual(get_linear_cell_grid(img, 3, 6), [[[10, 128, 250]] * 2])
+
+
+class TestGet256Indexes(unittest.TestCase):
+    def setUp(self):
+        # a blue halfway between two steps of the palette's cube.
+        self.grid = [[[0, 0, 115]] * 8] * 8
+
+    def get_mean_blue(self, indexes):
+        blues = [x256.colors[index][2] for row in indexes for index in row]
+        return sum(blues) / len(blues)
+
+    def test(self):
+        grid = [[list(x256.colors[index]) for index in (21, 196, 244)]]
+
+        indexes = get_256_indexes(grid)
+
+        self.assertEqual([list(x256.colors[index]) for index in indexes[0]], grid[0])
+
+    def test_bayer(self):
+        plain = get_256_indexes(self.grid)
+        indexes = get_256_indexes(self.grid, dither='bayer')
+
+        self.assertEqual(len({index for row in plain for index in row}), 1)
+        self.assertGreater(len({index for row in indexes for index in row}), 1)
+        # the pattern repeats every 4 cells, and is the same every frame.
+        self.assertEqual(indexes[0][:4], indexes[0][4:])
+        self.assertEqual(indexes[:4], indexes[4:])
+        self.assertEqual(indexes, get_256_indexes(self.grid, dither='bayer'))
+        self.assertLess(abs(self.get_mean_blue(indexes) - 115),
+            abs(self.get_mean_blue(plain) - 115))
+
+    def test_floyd(self):
+        plain = get_256_indexes(self.grid)
+        indexes = get_256_indexes(self.grid, dither='floyd')
+
+        self.assertGreater(len({index for row in indexes for index in row}), 1)
+        self.assertLess(abs(self.get_mean_blue(indexes) - 115),
+            abs(self.get_mean_blue(plain) - 115))
+
+    def test_empty(self):
+        self.assertEqual(get_256_indexes([]), [])
+
+    def test_oklab(self):
+        grid = [
+            [[0, 0, 0], [255, 255, 255]],
+            [[255, 0, 0], [128, 128, 128]],
+        ]
+
+        indexes = get_256_indexes(grid, 'oklab')
+
+        self.assertEqual(indexes, [
+            [top_2_oklab_colors(*rgb)[0]['index'] for rgb in row]
+            for row in grid
+        ])
+
+    def test_oklab_bayer(self):
+        grid = [[[128, 128, 128]] * 8] * 8
+
+        indexes = get_256_indexes(grid, 'oklab', 'bayer')
+
+        # grey is dithered between greys, rather than picking up a hue.
+        self.assertGreater(len({index for row in indexes for index in row}), 1)
+        for row in indexes:
+            for index in row:
+                r, g, b = x256.colors[index]
+                self.assertTrue(r == g == b, (r, g, b,))
+
+
+class TestTop2OklabColors(unittest.TestCase):
+    def test(self):
+        best, second = top_2_oklab_colors(0, 0, 0)
+        self.assertEqual(best['distance'], 0)
+        self.assertEqual(second['distance'], 0)
+
+        best, second = top_2_oklab_colors(100, 50, 200)
+        self.assertGreater(best['distance'], 0)
+        self.assertLessEqual(best['distance'], second['distance'])
@@ -0,0 +1,142 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from gif_for_cli.constants import DISPLAY_MODES
+from gif_for_cli.generate.manifest import (
+    get_missing_modes,
+    is_complete,
+    load_manifest,
+    mark_extracted,
+    mark_frame,
+    save_manifest,
+    update_complete,
+)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dirname = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_missing(self):
+        manifest = load_manifest(self.dirname)
+
+        self.assertFalse(manifest['extracted'])
+        self.assertFalse(manifest['complete'])
+        self.assertEqual(manifest['frame_names'], [])
+        self.assertFalse(is_complete(self.dirname))
+
+    def test_load_corrupt(self):
+        with open('{}/manifest.json'.format(self.dirname), 'w') as f:
+            f.write('{"extracted": tr')
+
+        self.assertFalse(load_manifest(self.dirname)['extracted'])
+
+    def test_save_and_load(self):
+        manifest = load_manifest(self.dirname)
+        mark_extracted(manifest, 2, 0.2, ['0001', '0002'])
+        mark_frame(manifest, '0001', ['256', 'nocolor'])
+        save_manifest(self.dirname, manifest)
+
+        self.assertEqual(os.listdir(self.dirname), ['manifest.json'])
+
+        manifest = load_manifest(self.dirname)
+        self.assertTrue(manifest['extracted'])
+        self.assertEqual(manifest['num_frames'], 2)
+        self.assertEqual(manifest['seconds'], 0.2)
+        self.assertEqual(manifest['frames'], {'0001': ['nocolor', '256']})
+
+    def test_missing_modes(self):
+        manifest = load_manifest(self.dirname)
+        mark_frame(manifest, '0001', ['nocolor'])
+        mark_frame(manifest, '0001', ['truecolor'])
+
+        self.assertEqual(get_missing_modes(manifest, '0001'),
+            ['256', '256fgbg', '256half', 'truecolorhalf', 'braille', '256braille'])
+        self.assertEqual(get_missing_modes(manifest, '0002'), DISPLAY_MODES)
+
+    def test_update_complete(self):
+        manifest = load_manifest(self.dirname)
+        self.assertFalse(update_complete(manifest))
+
+        mark_extracted(manifest, 2, 0.2, ['0001', '0002'])
+        mark_frame(manifest, '0001', DISPLAY_MODES)
+        self.assertFalse(update_complete(manifest))
+
+        mark_frame(manifest, '0002', DISPLAY_MODES)
+        self.assertTrue(update_complete(manifest))
+
+        save_manifest(self.dirname, manifest)
+        self.assertTrue(is_complete(self.dirname))
+
+    def test_is_complete_new_mode(self):
+        manifest = load_manifest(self.dirname)
+        mark_extracted(manifest, 1, 0.1, ['0001'])
+        mark_frame(manifest, '0001', DISPLAY_MODES[:-1])
+        # as saved before the last display mode was added.
+        manifest['complete'] = True
+        save_manifest(self.dirname, manifest)
+
+        self.assertFalse(is_complete(self.dirname))
+
+    def _write_legacy_entry(self, modes_by_frame_name):
+        os.mkdir('{}/jpg'.format(self.dirname))
+        for mode in DISPLAY_MODES[:4]:
+            os.mkdir('{}/{}'.format(self.dirname, mode))
+        for frame_name, modes in modes_by_frame_name.items():
+            open('{}/jpg/{}.jpg'.format(self.dirname, frame_name), 'w').close()
+            for mode in modes:
+                open('{}/{}/{}.txt'.format(self.dirname, mode, frame_name), 'w').close()
+        with open('{}/config.json'.format(self.dirname), 'w') as f:
+            json.dump({'num_frames': len(modes_by_frame_name), 'seconds': 0.2}, f)
+
+    def test_load_legacy(self):
+        self._write_legacy_entry({
+            '0001': DISPLAY_MODES[:4],
+            '0002': DISPLAY_MODES[:2],
+        })
+
+        manifest = load_manifest(self.dirname)
+        self.assertTrue(manifest['extracted'])
+        self.assertFalse(manifest['complete'])
+        self.assertEqual(manifest['num_frames'], 2)
+        self.assertEqual(manifest['seconds'], 0.2)
+        self.assertEqual(manifest['frame_names'], ['0001', '0002'])
+        self.assertEqual(get_missing_modes(manifest, '0001'), DISPLAY_MODES[4:])
+        self.assertEqual(get_missing_modes(manifest, '0002'), DISPLAY_MODES[2:])
+        self.assertFalse(is_complete(self.dirname))
+
+    def test_load_legacy_complete(self):
+        with patch('gif_for_cli.generate.manifest.DISPLAY_MODES', DISPLAY_MODES[:4]):
+            self._write_legacy_entry({'0001': DISPLAY_MODES[:4]})
+
+            self.assertTrue(load_manifest(self.dirname)['complete'])
+
+    def test_load_without_manifest(self):
+        # written by this version, but stopped before its manifest was saved.
+        self._write_legacy_entry({'0001': DISPLAY_MODES[:4]})
+        with open('{}/config.json'.format(self.dirname), 'w') as f:
+            json.dump({'num_frames': 1, 'seconds': 0.1, 'durations': None}, f)
+
+        self.assertFalse(load_manifest(self.dirname)['extracted'])
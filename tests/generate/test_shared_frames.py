@@ -0,0 +1,59 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from multiprocessing import Pool
+import unittest
+
+from PIL import Image
+
+from gif_for_cli.generate.shared_frames import SharedFrameRing, get_shared_frame, shared_memory
+
+
+def _get_pixel(shared_frame, xy):
+    return get_shared_frame(shared_frame).getpixel(xy)
+
+
+@unittest.skipIf(shared_memory is None, 'needs multiprocessing.shared_memory')
+class TestSharedFrameRing(unittest.TestCase):
+    def test(self):
+        with SharedFrameRing(2, (4, 3,)) as ring:
+            shared_frame = ring.put(0, Image.new('RGB', (4, 2,), (1, 2, 3,)))
+            img = get_shared_frame(shared_frame)
+
+            self.assertEqual(img.size, (4, 2,))
+            self.assertEqual(img.getpixel((3, 1,)), (1, 2, 3,))
+
+    def test_slots(self):
+        with SharedFrameRing(2, (4, 3,)) as ring:
+            first = ring.put(0, Image.new('RGB', (4, 3,), (1, 1, 1,)))
+            second = ring.put(1, Image.new('RGB', (4, 3,), (2, 2, 2,)))
+            # wraps around to the first slot.
+            third = ring.put(2, Image.new('RGB', (4, 3,), (3, 3, 3,)))
+
+            self.assertEqual(third[1], first[1])
+            self.assertEqual(get_shared_frame(second).getpixel((0, 0,)), (2, 2, 2,))
+            self.assertEqual(get_shared_frame(first).getpixel((0, 0,)), (3, 3, 3,))
+
+    def test_too_big(self):
+        with SharedFrameRing(2, (4, 3,)) as ring:
+            with self.assertRaises(ValueError):
+                ring.put(0, Image.new('RGB', (5, 3,)))
+
+    def test_other_process(self):
+        with SharedFrameRing(1, (4, 3,)) as ring:
+            shared_frame = ring.put(0, Image.new('RGB', (4, 3,), (4, 5, 6,)))
+
+            with Pool(1) as pool:
+                self.assertEqual(pool.apply(_get_pixel, [shared_frame, (2, 2,)]), (4, 5, 6,))
@@ -19,9 +19,16 @@ from unittest.mock import patch, Mock
 
 from PIL import Image
 
+from gif_for_cli.constants import NOCOLOR_CHARS
 from gif_for_cli.generate.utils import (
-    get_gray,
+    get_gray_histogram,
+    get_nocolor_table,
+    get_256_bg,
     get_256_cell,
+    get_256_fg,
+    get_braille_lines,
+    get_colored_line,
+    get_half_block_line,
     get_truecolor_cell,
     get_avg_for_em,
     process_input_source,
@@ -31,12 +38,45 @@ from ..fixtures import empty_gif_response, gif_response
 api_key = 'TQ7VXFHXBJQ5'
 
 
-class TestGetGray(unittest.TestCase):
+class TestGetGrayHistogram(unittest.TestCase):
     def test(self):
-        self.assertAlmostEqual(
-            get_gray(0, 128, 255),
-            127.66666666
-        )
+        histogram = get_gray_histogram([[(0, 0, 0), (1, 2, 3)], [(1, 2, 3), (255, 255, 255)]])
+
+        self.assertEqual(len(histogram), 766)
+        self.assertEqual(histogram[0], 1)
+        self.assertEqual(histogram[6], 2)
+        self.assertEqual(histogram[765], 1)
+        self.assertEqual(sum(histogram), 4)
+
+        # adds to an existing histogram, e.g. for a whole clip.
+        get_gray_histogram([[(0, 0, 0)]], histogram)
+        self.assertEqual(histogram[0], 2)
+
+
+class TestGetNocolorTable(unittest.TestCase):
+    def test(self):
+        histogram = [0] * 766
+        for level in range(0, 766, 10):
+            histogram[level] = 1
+
+        table = get_nocolor_table(histogram)
+
+        self.assertEqual(len(table), 766)
+        self.assertEqual(table[0], NOCOLOR_CHARS[0])
+        self.assertEqual(table[765], NOCOLOR_CHARS[-1])
+        # every char is used, in order of brightness.
+        self.assertEqual(''.join(sorted(set(table), key=NOCOLOR_CHARS.index)), NOCOLOR_CHARS)
+        self.assertEqual(table, sorted(table, key=NOCOLOR_CHARS.index))
+
+    def test_few_levels(self):
+        histogram = [0] * 766
+        histogram[100] = 50
+        histogram[600] = 50
+
+        table = get_nocolor_table(histogram)
+
+        self.assertEqual(table[100], NOCOLOR_CHARS[0])
+        self.assertEqual(table[600], NOCOLOR_CHARS[1])
 
 
 class TestGet256Cell(unittest.TestCase):
@@ -55,6 +95,55 @@ class TestGetTruecolorCell(unittest.TestCase):
         )
 
 
+class TestGetHalfBlockLine(unittest.TestCase):
+    def test(self):
+        line = get_half_block_line([1, 1, 2, 2, 3], [2, 2, 1, 2, 3], get_256_fg, get_256_bg)
+
+        # colors are only set when they change, flipping which half is the
+        # FG color to avoid it where possible.
+        self.assertEqual(line, ''.join([
+            u'\u001b[38;5;1m\u001b[48;5;2m\u2580',
+            u'\u2580',
+            u'\u2584',
+            ' ',
+            u'\u001b[48;5;3m ',
+            u'\u001b[0m',
+        ]))
+
+    def test_full_block(self):
+        line = get_half_block_line([1, 2, 2], [2, 1, 1], get_256_fg, get_256_bg)
+
+        self.assertEqual(line, u'\u001b[38;5;1m\u001b[48;5;2m\u2580\u2584\u2584\u001b[0m')
+
+        line = get_half_block_line([1, 1, 3], [2, 1, 3], get_256_fg, get_256_bg)
+
+        self.assertEqual(line, u'\u001b[38;5;1m\u001b[48;5;2m\u2580\u2588\u001b[48;5;3m \u001b[0m')
+
+
+class TestGetBrailleLines(unittest.TestCase):
+    def test(self):
+        dots = Image.new('1', (4, 8,))
+        # every dot of the first cell, the top left and bottom right dots of
+        # the second, and only the bottom left of the cell below.
+        dots.paste(1, (0, 0, 2, 4,))
+        dots.putpixel((2, 0,), 1)
+        dots.putpixel((3, 3,), 1)
+        dots.putpixel((2, 7,), 1)
+
+        self.assertEqual(get_braille_lines(dots, 2, 2), [
+            u'\u28ff\u2881',
+            u'\u2800\u2840',
+        ])
+
+
+class TestGetColoredLine(unittest.TestCase):
+    def test(self):
+        self.assertEqual(
+            get_colored_line('abc', [1, 1, 2], get_256_fg),
+            u'\u001b[38;5;1mab\u001b[38;5;2mc',
+        )
+
+
 class TestGetAvgForEm(unittest.TestCase):
     def setUp(self):
         self.im = Image.new('RGB', (100, 100,))
@@ -0,0 +1,78 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+from gif_for_cli.benchmark import main
+
+
+@patch('gif_for_cli.benchmark.shutil.which')
+class TestBenchmark(unittest.TestCase):
+    def test(self, mock_which):
+        mock_which.return_value = None
+        stdout = io.StringIO()
+
+        main(['--frames', '2', '--cols', '8', '--rows', '4'], stdout)
+
+        results = json.loads(stdout.getvalue())
+
+        self.assertEqual(results['params']['clip'], 'synthetic')
+        self.assertEqual(results['params']['num_frames'], 2)
+        self.assertEqual(results['stages']['ffmpeg'], {'skipped': 'ffmpeg not found'})
+
+        for name in [
+            'pil_decode',
+            'get_avg_for_em',
+            'top_2_colors',
+            'convert_frame',
+            'convert_frame:area_scale',
+            'convert_frame:nocolor',
+            'convert_frame:256',
+            'convert_frame:256fgbg',
+            'convert_frame:truecolor',
+            'display_txt_frames:truecolor',
+            'export_txt_frame:truecolor',
+            'render_palette_frame:256',
+            'convert_frame:256:dither-none',
+            'convert_frame:256:dither-bayer',
+            'convert_frame:256:dither-floyd',
+            'render_markup:html:256',
+            'render_markup:svg:truecolor',
+        ]:
+            stage = results['stages'][name]
+            self.assertGreater(stage['seconds'], 0)
+            self.assertGreater(stage['frames_per_second'], 0)
+            self.assertGreater(stage['cells_per_second'], 0)
+            self.assertGreater(stage['cumulative_peak_rss_bytes'], 0)
+
+        stage = results['stages']['display_txt_frames:nocolor']
+        self.assertGreater(stage['bytes_emitted'], 2 * 8 * 4)
+
+        self.assertGreater(results['stages']['render_markup:html:256']['bytes_written'], 0)
+        self.assertGreater(results['stages']['export_txt_frame:256']['bytes_written'], 0)
+
+        for codec in ['zlib', 'lzma']:
+            self.assertGreater(results['stages']['read_frame:' + codec]['frames_per_second'], 0)
+            self.assertLess(results['stages']['read_frame:' + codec]['bytes_stored'],
+                results['stages']['read_frame:none']['bytes_stored'])
+
+    def test_clip_requires_ffmpeg(self, mock_which):
+        mock_which.return_value = None
+
+        with patch('sys.stderr', io.StringIO()), self.assertRaises(SystemExit):
+            main(['--clip', 'foo.gif'], io.StringIO())
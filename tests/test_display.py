@@ -14,11 +14,36 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import io
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 
-from gif_for_cli.constants import ANSI_CURSOR_UP, ANSI_RESET, STORED_CELL_CHAR
-from gif_for_cli.display import display_txt_frames, get_txt_frames, display
+from gif_for_cli.constants import ANSI_CURSOR_UP, ANSI_ERASE_DOWN, ANSI_RESET, STORED_CELL_CHAR
+from gif_for_cli.display import (
+    ResizableTxtFrames,
+    TxtFrames,
+    _FdWriter,
+    _prepare_frames,
+    display_mosaic,
+    display_txt_frames,
+    get_txt_frames,
+    display,
+)
+
+
+class FakeClock(object):
+    """
+    Stands in for time.monotonic(), only moving forward when slept on.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
 
 
 class TestDisplayTxtFrames(unittest.TestCase):
@@ -37,10 +62,13 @@ class TestDisplayTxtFrames(unittest.TestCase):
 
         txt_frames = self.txt_frames
         num_loops = 3
+        clock = FakeClock()
 
-        with patch('time.sleep') as mock_sleep:
-            display_txt_frames(txt_frames, stdout, num_loops, self.seconds_per_frame)
+        with patch('time.monotonic', clock.monotonic), \
+                patch('time.sleep', side_effect=clock.sleep) as mock_sleep:
+            finished = display_txt_frames(txt_frames, stdout, num_loops, self.seconds_per_frame)
 
+        self.assertTrue(finished)
         self.assertEqual(mock_sleep.call_count, num_loops * len(txt_frames))
         for call in mock_sleep.call_args_list:
             self.assertEqual(call[0][0], self.seconds_per_frame)
@@ -55,6 +83,75 @@ class TestDisplayTxtFrames(unittest.TestCase):
 
         self.assertEqual(output, self.txt_frames * num_loops)
 
+    def test_durations(self):
+        stdout = io.StringIO()
+
+        txt_frames = TimedFrames(self.txt_frames[:2], [0.5, 0.1])
+        clock = FakeClock()
+
+        with patch('time.monotonic', clock.monotonic), \
+                patch('time.sleep', side_effect=clock.sleep) as mock_sleep:
+            display_txt_frames(txt_frames, stdout, 1, self.seconds_per_frame)
+
+        sleeps = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(sleeps), 2)
+        self.assertAlmostEqual(sleeps[0], 0.5)
+        self.assertAlmostEqual(sleeps[1], 0.1)
+
+    def test_slow_stdout(self):
+        clock = FakeClock()
+
+        class SlowStdout(io.StringIO):
+            def write(self, s):
+                # each frame takes 2.5 frames' time to get through.
+                if not s.startswith(ANSI_RESET):
+                    clock.sleep(500)
+                return super().write(s)
+
+        stdout = SlowStdout()
+
+        with patch('time.monotonic', clock.monotonic), patch('time.sleep', clock.sleep):
+            display_txt_frames(self.txt_frames, stdout, 1, self.seconds_per_frame)
+
+        # frames that were already overdue were skipped to keep up.
+        output = stdout.getvalue()
+        shown = [
+            str(i)
+            for i in range(self.num_frames)
+            if str(i) * self.width in output
+        ]
+        self.assertEqual(shown, ['0', '2', '4'])
+        # the last frame starts being written at 1000, the end of its slot.
+        self.assertEqual(clock.now, 1500)
+
+    def test_skipped_switch(self):
+        clock = FakeClock()
+        txt_frames = [
+            'a',
+            ANSI_ERASE_DOWN + 'b',
+            'c',
+            'd',
+        ]
+
+        class SlowStdout(io.StringIO):
+            def write(self, s):
+                if s.endswith('a\n'):
+                    clock.sleep(450)
+                return super().write(s)
+
+        stdout = SlowStdout()
+
+        with patch('time.monotonic', clock.monotonic), patch('time.sleep', clock.sleep):
+            display_txt_frames(txt_frames, stdout, 1, self.seconds_per_frame)
+
+        # the erase from the skipped frame is carried over to the next one.
+        self.assertEqual(stdout.getvalue(), ''.join([
+            'a\n',
+            ANSI_CURSOR_UP + ANSI_ERASE_DOWN + 'c\n',
+            ANSI_CURSOR_UP + 'd\n',
+            ANSI_RESET,
+        ]))
+
     def test_0_loops(self):
         stdout = io.StringIO()
 
@@ -62,20 +159,23 @@ class TestDisplayTxtFrames(unittest.TestCase):
         num_loops = 0
         error_after_num_loops = 5
         error_after_num_sleep_calls = error_after_num_loops * len(txt_frames)
+        clock = FakeClock()
 
-        with patch('time.sleep') as mock_sleep:
+        with patch('time.monotonic', clock.monotonic), patch('time.sleep') as mock_sleep:
             num_sleep_calls = 0
 
             def sleep_side_effect(s):
                 nonlocal num_sleep_calls
                 num_sleep_calls += 1
+                clock.sleep(s)
                 if num_sleep_calls >= error_after_num_sleep_calls:
                     raise KeyboardInterrupt()
                 return
             mock_sleep.side_effect = sleep_side_effect
 
-            display_txt_frames(txt_frames, stdout, num_loops, self.seconds_per_frame)
+            finished = display_txt_frames(txt_frames, stdout, num_loops, self.seconds_per_frame)
 
+        self.assertFalse(finished)
         self.assertEqual(mock_sleep.call_count, error_after_num_loops * len(txt_frames))
         for call in mock_sleep.call_args_list:
             self.assertEqual(call[0][0], self.seconds_per_frame)
@@ -91,7 +191,236 @@ class TestDisplayTxtFrames(unittest.TestCase):
         self.assertEqual(output, self.txt_frames * error_after_num_loops)
 
 
-@patch('gif_for_cli.display.open')
+class TestFdWriter(unittest.TestCase):
+    def test_display(self):
+        txt_frames = ['\u2588a\nb', '\u2588c\nd']
+
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as stdout:
+            stdout.write('before\n')
+            with patch('time.sleep'):
+                display_txt_frames(txt_frames, stdout, 1, 0)
+            stdout.seek(0)
+            output = stdout.read()
+
+        self.assertEqual(output, ''.join([
+            'before\n',
+            '\u2588a\nb\n',
+            ANSI_CURSOR_UP * 2 + '\u2588c\nd\n',
+            ANSI_RESET,
+        ]))
+
+    @patch('gif_for_cli.display.select.select')
+    @patch('gif_for_cli.display.os.writev')
+    def test_partial_writes(self, mock_writev, mock_select):
+        written = []
+
+        def writev_side_effect(fd, chunks):
+            if not written:
+                written.append(b'')
+                raise BlockingIOError()
+            # only ever gets 3 bytes through.
+            data = b''.join(bytes(chunk) for chunk in chunks)[:3]
+            written.append(data)
+            return len(data)
+        mock_writev.side_effect = writev_side_effect
+
+        writer = _FdWriter(Mock(), 1)
+        writer.write(b'ab', b'', b'cdefg')
+
+        self.assertEqual(b''.join(written), b'abcdefg')
+        self.assertEqual(mock_select.call_count, 1)
+
+
+class TestPrepareFrames(unittest.TestCase):
+    def test(self):
+        encode = Mock(side_effect=lambda s: s.encode('utf8'))
+
+        prepared_frames = list(_prepare_frames(['a', 'b\nc'], 3, 0.1, encode))
+
+        self.assertEqual(prepared_frames, [
+            (b'a\n', 1, 0.1, False),
+            (b'b\nc\n', 2, 0.1, False),
+        ] * 3)
+        # later loops are played from memory.
+        self.assertEqual(encode.call_count, 2)
+
+    def test_too_big_to_cache(self):
+        encode = Mock(side_effect=lambda s: s.encode('utf8'))
+
+        list(_prepare_frames(['a', 'b'], 3, 0.1, encode, max_cache_size=3))
+
+        self.assertEqual(encode.call_count, 6)
+
+    def test_resizable(self):
+        encode = Mock(side_effect=lambda s: s.encode('utf8'))
+
+        list(_prepare_frames(ResizableTxtFrames(['a', 'b']), 3, 0.1, encode))
+
+        self.assertEqual(encode.call_count, 6)
+
+
+class TestDisplayMosaic(unittest.TestCase):
+    def test(self):
+        stdout = io.StringIO()
+        clock = FakeClock()
+        tiles = [
+            (['a1', 'a2'], 1, 2, 1),
+            (TimedFrames(['b'], [3]), 1, 2, 2),
+        ]
+
+        with patch('time.monotonic', clock.monotonic), patch('time.sleep', clock.sleep):
+            display_mosaic(tiles, stdout, 1, 2)
+
+        # only the lines that changed are written again.
+        self.assertEqual(stdout.getvalue(), ''.join([
+            'a1 b \n',
+            '     \n',
+            ANSI_CURSOR_UP * 2 + 'a2 b \n\n',
+            ANSI_CURSOR_UP * 2 + 'a1 b \n\n',
+            ANSI_RESET,
+        ]))
+        # the longest clip plays once.
+        self.assertEqual(clock.now, 3)
+
+    def test_rows_and_colors(self):
+        stdout = io.StringIO()
+        colored = '\u001b[38;5;1m#\u001b[0m'
+        tiles = [
+            ([colored], 1, 2, 1),
+            (['b'], 1, 2, 1),
+            (['c'], 1, 2, 1),
+        ]
+
+        with patch('time.sleep'):
+            display_mosaic(tiles, stdout, 1, 2)
+
+        self.assertEqual(stdout.getvalue(), ''.join([
+            # the visible width is padded, without colors spilling over.
+            colored + '  ' + 'b \n',
+            'c \n',
+            ANSI_RESET,
+        ]))
+
+    def test_skips_when_behind(self):
+        clock = FakeClock()
+
+        class SlowStdout(io.StringIO):
+            def write(self, s):
+                if not s.startswith(ANSI_RESET):
+                    clock.sleep(2.5)
+                return super().write(s)
+
+        stdout = SlowStdout()
+        tiles = [(['0', '1', '2', '3', '4'], 1, 1, 1)]
+
+        with patch('time.monotonic', clock.monotonic), patch('time.sleep', clock.sleep):
+            display_mosaic(tiles, stdout, 1, 1)
+
+        self.assertEqual(stdout.getvalue(), ''.join([
+            '0\n',
+            ANSI_CURSOR_UP + '2\n',
+            ANSI_RESET,
+        ]))
+        # stops once the clip's time is up, rather than finishing late.
+        self.assertEqual(clock.now, 5)
+
+
+class TestTxtFrames(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for i in range(10):
+            filename = os.path.join(self.tmp_dir.name, '{:04d}.txt'.format(i))
+            with open(filename, 'w') as f:
+                f.write('{}{}'.format(i, STORED_CELL_CHAR))
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_stream(self):
+        txt_frames = TxtFrames(self.filenames, '$', prefetch=2)
+
+        self.assertEqual(len(txt_frames), 10)
+        self.assertEqual(txt_frames[3], '3$')
+        self.assertEqual(list(txt_frames), ['{}$'.format(i) for i in range(10)])
+
+    def test_cached_after_first_pass(self):
+        txt_frames = TxtFrames(self.filenames, '$', prefetch=2)
+        list(txt_frames)
+
+        with patch('gif_for_cli.storage.open') as mock_open:
+            self.assertEqual(list(txt_frames), ['{}$'.format(i) for i in range(10)])
+
+        self.assertEqual(mock_open.call_count, 0)
+
+    def test_too_big_to_cache(self):
+        txt_frames = TxtFrames(self.filenames, '$', prefetch=2, max_cache_size=5)
+        list(txt_frames)
+
+        with patch('gif_for_cli.storage.open', wraps=open) as mock_open:
+            self.assertEqual(list(txt_frames), ['{}$'.format(i) for i in range(10)])
+
+        self.assertEqual(mock_open.call_count, 10)
+
+    def test_abandoned_stream(self):
+        txt_frames = TxtFrames(self.filenames, '$', prefetch=2)
+
+        stream = iter(txt_frames)
+        self.assertEqual(next(stream), '0$')
+        stream.close()
+
+        # a partial pass mustn't be mistaken for the whole clip.
+        self.assertEqual(len(list(txt_frames)), 10)
+
+    def test_read_error(self):
+        txt_frames = TxtFrames(self.filenames + ['does-not-exist.txt'], '$', prefetch=2)
+
+        with self.assertRaises(FileNotFoundError):
+            list(txt_frames)
+
+
+class TestResizableTxtFrames(unittest.TestCase):
+    def test_switch(self):
+        txt_frames = ResizableTxtFrames(['a0', 'a1', 'a2', 'a3'])
+
+        output = []
+        for txt_frame in txt_frames:
+            output.append(txt_frame)
+            if len(output) == 2:
+                txt_frames.switch(['b0', 'b1', 'b2', 'b3'])
+
+        self.assertEqual(output, ['a0', 'a1', ANSI_ERASE_DOWN + 'b2', 'b3'])
+        self.assertEqual(list(txt_frames), ['b0', 'b1', 'b2', 'b3'])
+
+    def test_switch_with_durations(self):
+        txt_frames = ResizableTxtFrames(TimedFrames(['a0', 'a1', 'a2', 'a3'], [0.1] * 4))
+
+        output = []
+        for txt_frame, seconds in txt_frames.iter_with_durations(0.1):
+            output.append((txt_frame, seconds,))
+            if len(output) == 3:
+                # b1 is held from 0.1s to 0.3s.
+                txt_frames.switch(TimedFrames(['b0', 'b1', 'b3'], [0.1, 0.2, 0.1]))
+
+        self.assertEqual(output, [
+            ('a0', 0.1,),
+            ('a1', 0.1,),
+            ('a2', 0.1,),
+            (ANSI_ERASE_DOWN + 'b3', 0.1,),
+        ])
+
+
+class TimedFrames(list):
+    def __init__(self, txt_frames, durations):
+        super().__init__(txt_frames)
+        self.durations = durations
+
+    def get_durations(self, seconds_per_frame):
+        return self.durations
+
+
+@patch('gif_for_cli.storage.open')
 @patch('gif_for_cli.display.get_sorted_filenames')
 class TestGetTxtFrames(unittest.TestCase):
     def test(self, mock_get_sorted_filenames, mock_open):
@@ -113,6 +442,18 @@ class TestGetTxtFrames(unittest.TestCase):
         self.assertEqual(mock_open.call_args_list[0][0][0], display_dirname + '/' + '0001.txt')
         self.assertEqual(mock_open.call_args_list[1][0][0], display_dirname + '/' + '0002.txt')
 
+    def test_frames(self, mock_get_sorted_filenames, mock_open):
+        mock_open.side_effect = lambda *args, **kwargs: io.StringIO(STORED_CELL_CHAR * 10)
+
+        txt_frames = get_txt_frames('some-dir', '$', [['0001', 0.2], ['0003', 0.1]])
+
+        self.assertEqual(len(txt_frames), 2)
+        self.assertEqual(txt_frames.get_durations(0.1), [0.2, 0.1])
+        self.assertEqual(list(txt_frames), ['$' * 10, '$' * 10])
+
+        self.assertEqual(mock_get_sorted_filenames.call_count, 0)
+        self.assertEqual(mock_open.call_args_list[1][0][0], 'some-dir/0003.txt')
+
 
 @patch('gif_for_cli.display.get_txt_frames')
 @patch('gif_for_cli.display.display_txt_frames')
@@ -129,9 +470,59 @@ class TestDisplay(unittest.TestCase):
         self.assertEqual(mock_get_txt_frames.call_count, 1)
         self.assertEqual(mock_get_txt_frames.call_args[0][0], display_dirname)
         self.assertEqual(mock_get_txt_frames.call_args[0][1], cell_char)
+        # only the encoded frames are kept between loops.
+        self.assertEqual(mock_get_txt_frames.call_args[1]['max_cache_size'], 0)
 
         self.assertEqual(mock_display_txt_frames.call_count, 1)
         self.assertEqual(mock_display_txt_frames.call_args[0][0], mock_get_txt_frames.return_value)
         self.assertEqual(mock_display_txt_frames.call_args[0][1], stdout)
         self.assertEqual(mock_display_txt_frames.call_args[0][2], num_loops)
         self.assertEqual(mock_display_txt_frames.call_args[0][3], seconds_per_frame)
+
+    @patch('gif_for_cli.display.signal')
+    def test_on_play(self, mock_signal, mock_display_txt_frames, mock_get_txt_frames):
+        on_play = Mock()
+
+        display('some-dir', io.StringIO(), 3, '$', 0.1, on_play=on_play)
+
+        self.assertEqual(on_play.call_count, 1)
+        # frames that can switch size aren't encoded ahead, so are kept as text.
+        self.assertNotIn('max_cache_size', mock_get_txt_frames.call_args[1])
+        txt_frames = mock_display_txt_frames.call_args[0][0]
+        switch = on_play.call_args[0][0]
+        switch('other-dir', [['0001', 0.5]])
+        self.assertEqual(txt_frames._pending, mock_get_txt_frames.return_value)
+        self.assertEqual(mock_get_txt_frames.call_args[0][0], 'other-dir')
+        # no resize handler.
+        self.assertEqual(mock_signal.signal.call_count, 0)
+
+    @patch('gif_for_cli.display.get_terminal_size')
+    @patch('gif_for_cli.display.signal')
+    def test_on_resize(self, mock_signal, mock_get_terminal_size, mock_display_txt_frames,
+            mock_get_txt_frames):
+        stdout = io.StringIO()
+        on_resize = Mock()
+        mock_get_terminal_size.return_value = (80, 24,)
+
+        def resize(txt_frames, *args):
+            handler = mock_signal.signal.call_args_list[0][0][1]
+            handler(mock_signal.SIGWINCH, None)
+            switch = on_resize.call_args[0][1]
+            switch('other-dir', [['0001', 0.5]], 'zlib')
+            self.assertEqual(txt_frames.txt_frames, mock_get_txt_frames.return_value)
+            self.assertEqual(txt_frames._pending, mock_get_txt_frames.return_value)
+        mock_display_txt_frames.side_effect = resize
+
+        display('some-dir', stdout, 3, '$', 0.1, on_resize=on_resize)
+
+        self.assertEqual(on_resize.call_count, 1)
+        self.assertEqual(on_resize.call_args[0][0], (80, 24,))
+        self.assertEqual(mock_get_txt_frames.call_args_list[1][0],
+            ('other-dir', '$', [['0001', 0.5]], 'zlib',))
+
+        # the previous handler is restored.
+        self.assertEqual(mock_signal.signal.call_count, 2)
+        self.assertEqual(
+            mock_signal.signal.call_args_list[1][0][1],
+            mock_signal.signal.return_value,
+        )
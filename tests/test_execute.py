@@ -15,10 +15,14 @@ limitations under the License.
 """
 import io
 import json
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 
-from gif_for_cli.execute import execute
+from gif_for_cli.execute import _get_resize_handler, execute
+from gif_for_cli.generate import EmptyWindowError
+from gif_for_cli.generate.manifest import load_manifest, save_manifest
 
 
 @patch('gif_for_cli.execute.process_input_source')
@@ -64,7 +68,7 @@ class TestExecute(unittest.TestCase):
         # for some reaosn, this intercepts some locale laoding
         paths = sorted([
             call[0][0]
-            for call in mock_exists.call_args_list[-6:]
+            for call in mock_exists.call_args_list[-10:]
         ])
 
         self.assertTrue(paths[0].endswith(
@@ -74,18 +78,30 @@ class TestExecute(unittest.TestCase):
             '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256'
         ))
         self.assertTrue(paths[2].endswith(
-            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256fgbg'
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256braille'
         ))
         self.assertTrue(paths[3].endswith(
-            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/jpg'
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256fgbg'
         ))
         self.assertTrue(paths[4].endswith(
-            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/nocolor'
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256half'
         ))
         self.assertTrue(paths[5].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/braille'
+        ))
+        self.assertTrue(paths[6].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/jpg'
+        ))
+        self.assertTrue(paths[7].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/nocolor'
+        ))
+        self.assertTrue(paths[8].endswith(
             '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/truecolor'
         ))
-        self.assertEqual(mock_makedirs.call_count, 6)
+        self.assertTrue(paths[9].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/truecolorhalf'
+        ))
+        self.assertEqual(mock_makedirs.call_count, 10)
         self.assertEqual(mock_generate.call_count, 1)
         self.assertEqual(mocked_open.call_count, 1)
         self.assertEqual(mock_display.call_count, 1)
@@ -128,7 +144,7 @@ class TestExecute(unittest.TestCase):
         # for some reaosn, this intercepts some locale laoding
         paths = sorted([
             call[0][0]
-            for call in mock_exists.call_args_list[-6:]
+            for call in mock_exists.call_args_list[-10:]
         ])
 
         self.assertTrue(paths[0].endswith(
@@ -138,18 +154,30 @@ class TestExecute(unittest.TestCase):
             '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256'
         ))
         self.assertTrue(paths[2].endswith(
-            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256fgbg'
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256braille'
         ))
         self.assertTrue(paths[3].endswith(
-            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/jpg'
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256fgbg'
         ))
         self.assertTrue(paths[4].endswith(
-            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/nocolor'
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/256half'
         ))
         self.assertTrue(paths[5].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/braille'
+        ))
+        self.assertTrue(paths[6].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/jpg'
+        ))
+        self.assertTrue(paths[7].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/nocolor'
+        ))
+        self.assertTrue(paths[8].endswith(
             '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/truecolor'
         ))
-        self.assertEqual(mock_makedirs.call_count, 6)
+        self.assertTrue(paths[9].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/truecolorhalf'
+        ))
+        self.assertEqual(mock_makedirs.call_count, 10)
         self.assertEqual(mock_generate.call_count, 1)
         self.assertEqual(mocked_open.call_count, 1)
         self.assertEqual(mock_display.call_count, 0)
@@ -183,18 +211,14 @@ class TestExecute(unittest.TestCase):
                 'seconds': seconds,
             }))
 
-            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
-                mock_exists.return_value = True
+            with patch('gif_for_cli.execute.is_complete') as mock_is_complete:
+                mock_is_complete.return_value = True
 
                 execute(environ, argv, stdout)
 
         self.assertEqual(mock_process_input_source.call_count, 1)
-        # for some reaosn, this intercepts some locale laoding
-        paths = sorted([
-            call[0][0]
-            for call in mock_exists.call_args_list[-6:]
-        ])
-        self.assertTrue(paths[0].endswith(
+        self.assertEqual(mock_is_complete.call_count, 1)
+        self.assertTrue(mock_is_complete.call_args[0][0].endswith(
             '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px'
         ))
         self.assertEqual(mock_makedirs.call_count, 0)
@@ -232,18 +256,14 @@ class TestExecute(unittest.TestCase):
                 'seconds': seconds,
             }))
 
-            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
-                mock_exists.return_value = True
+            with patch('gif_for_cli.execute.is_complete') as mock_is_complete:
+                mock_is_complete.return_value = True
 
                 execute(environ, argv, stdout)
 
         self.assertEqual(mock_process_input_source.call_count, 1)
-        # for some reaosn, this intercepts some locale laoding
-        paths = sorted([
-            call[0][0]
-            for call in mock_exists.call_args_list[-6:]
-        ])
-        self.assertTrue(paths[0].endswith(
+        self.assertEqual(mock_is_complete.call_count, 1)
+        self.assertTrue(mock_is_complete.call_args[0][0].endswith(
             '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px'
         ))
         self.assertEqual(mock_makedirs.call_count, 0)
@@ -251,3 +271,434 @@ class TestExecute(unittest.TestCase):
         self.assertEqual(mocked_open.call_count, 1)
         self.assertEqual(mock_display.call_count, 0)
         self.assertEqual(mock_export.call_count, 1)
+
+    def test_new_sizes(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        environ = {}
+        argv = ['--sizes', '80x20,240x60,160x40']
+        stdout = io.StringIO()
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.return_value = io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute(environ, argv, stdout)
+
+        self.assertEqual(mock_makedirs.call_count, 30)
+        self.assertEqual(mock_generate.call_count, 1)
+
+        # the largest size is decoded, the rest are derived from it.
+        kwargs = mock_generate.call_args[1]
+        self.assertEqual((kwargs['cols'], kwargs['rows'],), (240, 60,))
+        self.assertEqual(
+            [(variant['cols'], variant['rows'],) for variant in kwargs['variants']],
+            [(160, 40,), (80, 20,)],
+        )
+        self.assertTrue(kwargs['variants'][0]['output_dirnames']['.'].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px'
+        ))
+
+        # the display uses --cols/--rows.
+        self.assertEqual(mock_display.call_count, 1)
+        self.assertTrue(mock_display.call_args[1]['display_dirname'].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-160cols-40rows-cw3px-ch6px/nocolor'
+        ))
+
+    def test_profile(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        environ = {}
+        # the input source isn't taken as a --profile filename.
+        argv = ['--profile', 'foo.gif']
+        stdout = io.StringIO()
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.return_value = io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute(environ, argv, stdout)
+
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(mock_display.call_count, 1)
+        self.assertTrue(stdout.getvalue().startswith('Profile:\n'))
+        self.assertEqual(mock_process_input_source.call_args[0][0], 'foo.gif')
+
+    def test_fit_to_terminal(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        environ = {'COLUMNS': '100', 'LINES': '24'}
+        argv = []
+        stdout = io.StringIO()
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.return_value = io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute(environ, argv, stdout)
+
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(mock_generate.call_args[1]['cols'], 80)
+        self.assertEqual(mock_generate.call_args[1]['rows'], 20)
+        self.assertTrue(mock_display.call_args[1]['display_dirname'].endswith(
+            '/d41d8cd98f00b204e9800998ecf8427e-80cols-20rows-cw3px-ch6px/nocolor'
+        ))
+        self.assertIsNotNone(mock_display.call_args[1]['on_resize'])
+
+    def test_fixed_size_when_not_displayed(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        for argv in [['--no-display'], ['--export', 'foo.gif']]:
+            with patch('gif_for_cli.execute.open') as mocked_open:
+                mocked_open.side_effect = lambda *args: io.StringIO(json.dumps({
+                    'num_frames': 11,
+                    'seconds': 1.1,
+                }))
+
+                with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                    mock_exists.return_value = False
+
+                    execute({'COLUMNS': '100', 'LINES': '24'}, argv, io.StringIO())
+
+            # not whatever terminal it was run from.
+            self.assertEqual(mock_generate.call_args[1]['cols'], 160)
+            self.assertEqual(mock_generate.call_args[1]['rows'], 40)
+
+    def test_explicit_size(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        environ = {'COLUMNS': '100', 'LINES': '24'}
+        argv = ['--cols', '100']
+        stdout = io.StringIO()
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.return_value = io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute(environ, argv, stdout)
+
+        self.assertEqual(mock_generate.call_args[1]['cols'], 100)
+        self.assertEqual(mock_generate.call_args[1]['rows'], 40)
+        self.assertIsNone(mock_display.call_args[1]['on_resize'])
+
+    @patch('gif_for_cli.execute.get_txt_frames')
+    @patch('gif_for_cli.execute.display_mosaic')
+    def test_mosaic(self, mock_display_mosaic, mock_get_txt_frames, mock_export, mock_display,
+            mock_generate, mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        environ = {'COLUMNS': '200', 'LINES': '50'}
+        argv = ['a', '--mosaic', 'b', 'c']
+        stdout = io.StringIO()
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.side_effect = lambda *args: io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute(environ, argv, stdout)
+
+        self.assertEqual(
+            [call[0][0] for call in mock_process_input_source.call_args_list],
+            ['a', 'b', 'c'],
+        )
+        # 2x2 tiles of 99x24 fit 80x20 each.
+        self.assertEqual(mock_generate.call_count, 3)
+        for call in mock_generate.call_args_list:
+            self.assertEqual(call[1]['cols'], 80)
+            self.assertEqual(call[1]['rows'], 20)
+        self.assertEqual(mock_display.call_count, 0)
+        self.assertEqual(mock_display_mosaic.call_count, 1)
+
+        tiles, _, num_loops, mosaic_cols = mock_display_mosaic.call_args[0]
+        self.assertEqual(len(tiles), 3)
+        self.assertEqual(tiles[0][1:], (0.1, 80, 20,))
+        self.assertEqual(num_loops, 3)
+        self.assertEqual(mosaic_cols, 2)
+
+    def test_mosaic_export(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        with patch('sys.stderr', io.StringIO()):
+            with self.assertRaises(SystemExit):
+                execute({}, ['a', '--mosaic', 'b', '--export', 'foo.gif'], io.StringIO())
+
+    @patch('gif_for_cli.execute.slice_window')
+    def test_window(self, mock_slice_window, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.side_effect = lambda *args: io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.is_complete') as mock_is_complete:
+                # only the whole clip is cached.
+                mock_is_complete.side_effect = lambda dirname: '-from' not in dirname
+
+                execute({}, ['a', '--start', '2', '--duration', '1.5'], io.StringIO())
+
+        self.assertEqual(mock_generate.call_count, 0)
+        self.assertEqual(mock_slice_window.call_count, 1)
+        source_output_dirnames = mock_slice_window.call_args[0][0]
+        self.assertTrue(source_output_dirnames['.'].endswith('-cw3px-ch6px'))
+        options = mock_slice_window.call_args[1]
+        self.assertEqual(options['start'], 2)
+        self.assertEqual(options['duration'], 1.5)
+        self.assertTrue(options['output_dirnames']['.'].endswith('-cw3px-ch6px-from2s-for1.5s'))
+        self.assertTrue(mock_display.call_args[1]['display_dirname'].startswith(
+            options['output_dirnames']['.']))
+
+    def test_empty_window(self, mock_export, mock_display, mock_generate, mock_makedirs,
+            mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+        mock_generate.side_effect = EmptyWindowError(5)
+        stderr = io.StringIO()
+
+        with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+            mock_exists.return_value = False
+            with patch('sys.stderr', stderr):
+                with self.assertRaises(SystemExit):
+                    execute({}, ['a', '--start', '5'], io.StringIO())
+
+        self.assertIn('No frames are shown from 5s', stderr.getvalue())
+        self.assertEqual(mock_display.call_count, 0)
+
+    @patch('gif_for_cli.execute.threading.Thread', lambda target: FakeThread(target))
+    @patch('gif_for_cli.execute.generate_preview')
+    @patch('gif_for_cli.execute.extract')
+    def test_preview(self, mock_extract, mock_generate_preview, mock_export, mock_display,
+            mock_generate, mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+        switch = Mock()
+
+        def display(**kwargs):
+            kwargs['on_play'](switch)
+            return True
+        mock_display.side_effect = display
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.side_effect = lambda *args: io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+                'frames': [['0001', 1.1]],
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute({}, ['a', '--preview'], io.StringIO())
+
+        self.assertEqual(mock_extract.call_count, 1)
+        self.assertEqual(mock_extract.call_args[1]['cols'], 160)
+
+        # a small preview, from the frames extracted for the full size.
+        source_output_dirnames, max_frames = mock_generate_preview.call_args[0]
+        self.assertEqual(source_output_dirnames, mock_extract.call_args[1]['output_dirnames'])
+        self.assertEqual(mock_generate_preview.call_args[1]['cols'], 40)
+        self.assertEqual(mock_generate_preview.call_args[1]['rows'], 10)
+        self.assertEqual(mock_generate_preview.call_args[1]['modes'], ['nocolor'])
+
+        display_kwargs = mock_display.call_args[1]
+        self.assertTrue(
+            display_kwargs['display_dirname'].endswith('-40cols-10rows-cw3px-ch6px/nocolor'))
+        self.assertEqual(display_kwargs['frames'], [['0001', 1.1]])
+
+        # playback switches over once the rest is generated.
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual(mock_generate.call_args[1]['cols'], 160)
+        self.assertEqual(switch.call_count, 1)
+        self.assertEqual(switch.call_args[0][0],
+            '{}/nocolor'.format(source_output_dirnames['.']))
+
+    @patch('gif_for_cli.execute.threading.Thread')
+    @patch('gif_for_cli.execute.generate_preview')
+    @patch('gif_for_cli.execute.extract')
+    def test_preview_interrupted(self, mock_extract, mock_generate_preview, mock_Thread,
+            mock_export, mock_display, mock_generate, mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+        stdout = io.StringIO()
+
+        def display(**kwargs):
+            kwargs['on_play'](Mock())
+            # Ctrl+C while the rest is still generating.
+            return False
+        mock_display.side_effect = display
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.side_effect = lambda *args: io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+                'frames': [['0001', 1.1]],
+            }))
+
+            with patch('gif_for_cli.execute.os.path.exists') as mock_exists:
+                mock_exists.return_value = False
+
+                execute({}, ['a', '--preview'], stdout)
+
+        # exits right away, rather than waiting for the whole clip.
+        self.assertEqual(mock_Thread.return_value.start.call_count, 1)
+        self.assertEqual(mock_Thread.return_value.join.call_count, 0)
+        self.assertIn('Stopped before the whole clip was cached.', stdout.getvalue())
+
+    def test_preview_cached(self, mock_export, mock_display, mock_generate,
+            mock_makedirs, mock_process_input_source):
+        mock_process_input_source.side_effect = lambda input_source, api_key: input_source
+
+        with patch('gif_for_cli.execute.open') as mocked_open:
+            mocked_open.side_effect = lambda *args: io.StringIO(json.dumps({
+                'num_frames': 11,
+                'seconds': 1.1,
+            }))
+
+            with patch('gif_for_cli.execute.is_complete') as mock_is_complete:
+                mock_is_complete.return_value = True
+
+                execute({}, ['a', '--preview'], io.StringIO())
+
+        self.assertEqual(mock_generate.call_count, 0)
+        self.assertNotIn('on_play', mock_display.call_args[1])
+
+
+class FakeThread(object):
+    def __init__(self, target):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+    def join(self):
+        pass
+
+
+@patch('gif_for_cli.execute.threading.Thread', FakeThread)
+@patch('gif_for_cli.execute.derive')
+class TestGetResizeHandler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_entry(self, cols, rows):
+        dirname = '{}/{}x{}'.format(self.tmp_dir.name, cols, rows)
+        return {
+            'cols': cols,
+            'rows': rows,
+            'cell_width': 3,
+            'cell_height': 6,
+            'output_dirnames': {
+                '.': dirname,
+                'jpg': dirname + '/jpg',
+                'nocolor': dirname + '/nocolor',
+            },
+        }
+
+    def make_entry(self, cols, rows, num_jpgs=0, complete=True):
+        entry = self.get_entry(cols, rows)
+        for dirname in entry['output_dirnames'].values():
+            os.makedirs(dirname, exist_ok=True)
+        manifest = load_manifest(entry['output_dirnames']['.'])
+        manifest['extracted'] = manifest['complete'] = complete
+        save_manifest(entry['output_dirnames']['.'], manifest)
+        self.write_config(entry)
+        for i in range(num_jpgs):
+            open('{}/{:04d}.jpg'.format(entry['output_dirnames']['jpg'], i + 1), 'w').close()
+        return entry
+
+    def write_config(self, entry):
+        with open('{}/config.json'.format(entry['output_dirnames']['.']), 'w') as f:
+            json.dump({'frames': [['0001', 0.1]]}, f)
+
+    def test_cached(self, mock_derive):
+        self.make_entry(160, 40, num_jpgs=2)
+        entry = self.make_entry(80, 20)
+        switch = Mock()
+
+        on_resize = _get_resize_handler(self.get_entry, 'nocolor', (160, 40,))
+        on_resize((100, 24,), switch)
+
+        self.assertEqual(mock_derive.call_count, 0)
+        self.assertEqual(switch.call_count, 1)
+        self.assertEqual(switch.call_args[0], (
+            entry['output_dirnames']['nocolor'],
+            [['0001', 0.1]],
+            'none',
+        ))
+
+        # nothing to do if the bucket hasn't changed.
+        on_resize((90, 22,), switch)
+
+        self.assertEqual(switch.call_count, 1)
+
+    def test_derived(self, mock_derive):
+        mock_derive.side_effect = lambda source_output_dirnames, **entry: self.write_config(entry)
+        source = self.make_entry(160, 40, num_jpgs=2)
+        entry = self.get_entry(80, 20)
+        switch = Mock()
+
+        on_resize = _get_resize_handler(self.get_entry, 'nocolor', (160, 40,))
+        on_resize((100, 24,), switch)
+
+        self.assertEqual(mock_derive.call_count, 1)
+        self.assertEqual(mock_derive.call_args[0][0], source['output_dirnames'])
+        self.assertEqual(mock_derive.call_args[1], entry)
+        self.assertTrue(os.path.exists(entry['output_dirnames']['nocolor']))
+        self.assertEqual(switch.call_count, 1)
+        self.assertEqual(switch.call_args[0][0], entry['output_dirnames']['nocolor'])
+
+    def test_incomplete(self, mock_derive):
+        mock_derive.side_effect = lambda source_output_dirnames, **entry: self.write_config(entry)
+        source = self.make_entry(160, 40, num_jpgs=2)
+        entry = self.make_entry(80, 20, complete=False)
+        switch = Mock()
+
+        on_resize = _get_resize_handler(self.get_entry, 'nocolor', (160, 40,))
+        on_resize((100, 24,), switch)
+
+        # an interrupted entry is finished off before switching to it.
+        self.assertEqual(mock_derive.call_count, 1)
+        self.assertEqual(mock_derive.call_args[0][0], source['output_dirnames'])
+        self.assertEqual(switch.call_count, 1)
+        self.assertEqual(switch.call_args[0][0], entry['output_dirnames']['nocolor'])
+
+    def test_no_upscaling(self, mock_derive):
+        self.make_entry(80, 20, num_jpgs=2)
+        switch = Mock()
+
+        on_resize = _get_resize_handler(self.get_entry, 'nocolor', (80, 20,))
+        on_resize((200, 60,), switch)
+
+        self.assertEqual(mock_derive.call_count, 0)
+        self.assertEqual(switch.call_count, 0)
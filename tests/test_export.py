@@ -14,17 +14,22 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import io
+import json
 import os
+import tempfile
 import unittest
 from unittest.mock import patch, Mock
 
 from gif_for_cli.constants import ANSI_RESET, STORED_CELL_CHAR
+from PIL import Image
+
 from gif_for_cli.export import _export_txt_frames, _get_txt_frames, _run_ffmpeg,\
-    export, export_txt_frame
+    export, export_txt_frame, get_palette_format, parse_txt_frame, render_markup,\
+    render_palette_frame
 
 
 @patch('gif_for_cli.export.Image')
-@patch('gif_for_cli.export.open')
+@patch('gif_for_cli.storage.open')
 class TestExportTxtFrame(unittest.TestCase):
     def setUp(self):
         super(TestExportTxtFrame, self).setUp()
@@ -231,6 +236,29 @@ video:258kB audio:0kB subtitle:0kB other streams:0kB global headers:0kB muxing o
             'Exported to:\n{export_filename}\n'.format(**self.options),
         )
 
+    def test_frames(self, mock_Popen):
+        mock_process = Mock()
+        mock_process.returncode = 0
+        mock_process.communicate.return_value = (self.out, self.err,)
+        mock_Popen.return_value = mock_process
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.options['display_dirname'] = tmp_dir
+            self.options['frames'] = [['0001', 0.2], ['0003', 0.1]]
+
+            _run_ffmpeg(**self.options)
+
+            cmd = mock_Popen.call_args[0][0]
+            self.assertEqual(cmd[2:5], ['-f', 'concat', '-i'])
+            with open(cmd[5]) as f:
+                self.assertEqual(f.read(), """ffconcat version 1.0
+file '0001.txt.png'
+duration 0.2
+file '0003.txt.png'
+duration 0.1
+file '0003.txt.png'
+""")
+
     def test_ffmpeg_failure(self, mock_Popen):
         mock_process = Mock()
         mock_process.returncode = 1
@@ -283,3 +311,230 @@ class TestExport(unittest.TestCase):
         self.assertEqual(mock_run_ffmpeg.call_args[0][1], display_dirname)
         self.assertEqual(mock_run_ffmpeg.call_args[0][2], stdout)
         self.assertEqual(mock_run_ffmpeg.call_args[0][3], seconds_per_frame)
+        self.assertEqual(mock_run_ffmpeg.call_args[0][4], None)
+
+    @patch('gif_for_cli.export._export_palette')
+    def test_palette(self, mock_export_palette, mock_run_ffmpeg, mock_export_txt_frames,
+            mock_get_txt_frames):
+        for display_mode, export_filename, uses_pil in [
+            ('256', 'foo.gif', True),
+            ('256fgbg', 'foo.png', True),
+            ('nocolor', 'foo.webp', get_palette_format('foo.webp') is not None),
+            ('256', 'foo.mp4', False),
+            ('truecolor', 'foo.gif', False),
+        ]:
+            mock_export_palette.reset_mock()
+            mock_run_ffmpeg.reset_mock()
+
+            export(export_filename, 'some-dir', io.StringIO(), 0.1, 2, {},
+                display_mode=display_mode)
+
+            self.assertEqual(mock_export_palette.call_count, int(uses_pil))
+            self.assertEqual(mock_run_ffmpeg.call_count, int(not uses_pil))
+
+
+class TestParseTxtFrame(unittest.TestCase):
+    def test(self):
+        txt = u'a\u001b[48;5;21m\u001b[38;5;9mb\n\u001b[0mc\u001b[38;2;1;2;3md'
+
+        self.assertEqual(list(parse_txt_frame(txt)), [
+            (0, 0, 'a', 15, 0,),
+            (0, 1, 'b', 9, 21,),
+            (1, 0, 'c', 15, 0,),
+            (1, 1, 'd', (1, 2, 3,), 0,),
+        ])
+
+    def test_truecolor_bg(self):
+        txt = u'\u001b[48;2;4;5;6m\u001b[38;2;1;2;3m\u2580'
+
+        self.assertEqual(list(parse_txt_frame(txt)), [
+            (0, 0, u'\u2580', (1, 2, 3,), (4, 5, 6,),),
+        ])
+
+
+class TestExportPalette(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.display_dirname = self.tmp_dir.name
+        for frame_name, color in [('0001', 196), ('0002', 21)]:
+            with open('{}/{}.txt'.format(self.display_dirname, frame_name), 'w') as f:
+                f.write('\n'.join(
+                    [u'\u001b[48;5;{}m\u001b[38;5;{}m# '.format(color, color)] * 2))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_render_palette_frame(self):
+        txt_filename, size, data = render_palette_frame(
+            '{}/0001.txt'.format(self.display_dirname), '#', 40, 160)
+
+        # only palette indexes used in the frame, no blended ones.
+        self.assertEqual(set(data), {196})
+        self.assertEqual(len(data), size[0] * size[1])
+
+    def test_render_braille(self):
+        txt_filename = '{}/0003.txt'.format(self.display_dirname)
+        with open(txt_filename, 'w') as f:
+            # just the top left dot.
+            f.write(u'\u001b[38;5;196m\u2801')
+
+        txt_filename, size, data = render_palette_frame(txt_filename, '#', 40, 160)
+
+        img = Image.frombytes('P', size, data)
+        width, height = size
+        self.assertEqual(img.getpixel((width // 4, height // 8,)), 196)
+        self.assertEqual(img.getpixel((width * 3 // 4, height // 8,)), 0)
+        self.assertEqual(img.getpixel((width // 4, height * 3 // 8,)), 0)
+
+    def test_render_half_blocks(self):
+        txt_filename = '{}/0003.txt'.format(self.display_dirname)
+        with open(txt_filename, 'w') as f:
+            f.write(u'\u001b[38;5;196m\u001b[48;5;21m\u2580\u2584\u001b[0m')
+
+        txt_filename, size, data = render_palette_frame(txt_filename, '#', 40, 160)
+
+        # drawn as exact halves, not with the font.
+        img = Image.frombytes('P', size, data)
+        width, height = size
+        self.assertEqual(img.getpixel((0, 0,)), 196)
+        self.assertEqual(img.getpixel((width // 2 - 1, height // 2 - 1,)), 196)
+        self.assertEqual(img.getpixel((0, height // 2,)), 21)
+        self.assertEqual(img.getpixel((width - 1, 0,)), 21)
+        self.assertEqual(img.getpixel((width - 1, height - 1,)), 196)
+
+    def test(self):
+        export_filename = '{}/foo.gif'.format(self.tmp_dir.name)
+        stdout = io.StringIO()
+
+        export(export_filename, self.display_dirname, stdout, 0.1, 1, {}, cell_char='#',
+            rows=40, cols=160, frames=[['0001', 0.2], ['0002', 0.5], ['0001', 0.3]],
+            display_mode='256')
+
+        self.assertTrue(stdout.getvalue().endswith('Exported to:\n{}\n'.format(export_filename)))
+        with Image.open(export_filename) as img:
+            self.assertEqual(img.n_frames, 3)
+            durations = []
+            colors = []
+            for i in range(img.n_frames):
+                img.seek(i)
+                durations.append(img.info['duration'])
+                colors.append(img.convert('RGB').getpixel((0, 0,)))
+
+        self.assertEqual(durations, [200, 500, 300])
+        # exact x256 colors.
+        self.assertEqual(colors, [(255, 0, 0,), (0, 0, 255,), (255, 0, 0,)])
+
+
+class TestExportStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.display_dirname = self.tmp_dir.name
+        for frame_name, txt in [('0001', 'ab\ncd'), ('0002', 'ab\nce')]:
+            with open('{}/{}.txt'.format(self.display_dirname, frame_name), 'w') as f:
+                f.write(txt.replace('a', STORED_CELL_CHAR))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _export(self, export_filename, **options):
+        stdout = io.StringIO()
+        export(export_filename, self.display_dirname, stdout, 0.1, 1, {}, cell_char='#',
+            rows=2, cols=2, frames=[['0001', 0.2], ['0002', 0.5]], **options)
+        self.assertTrue(stdout.getvalue().endswith('Exported to:\n{}\n'.format(export_filename)))
+
+    def test_asciicast(self):
+        export_filename = '{}/foo.cast'.format(self.tmp_dir.name)
+        self._export(export_filename)
+
+        with open(export_filename) as f:
+            header, *events = [json.loads(line) for line in f]
+
+        self.assertEqual(header['version'], 2)
+        self.assertEqual((header['width'], header['height'],), (2, 3,))
+        # as a tty would pass them on, players don't add the carriage returns.
+        self.assertEqual(events, [
+            [0, 'o', '#b\r\ncd\r\n'],
+            [0.2, 'o', '\u001b[A\u001b[A#b\r\nce\r\n'],
+            [0.7, 'o', ANSI_RESET],
+        ])
+
+    def test_asciicast_delta(self):
+        export_filename = '{}/foo.cast'.format(self.tmp_dir.name)
+        self._export(export_filename, delta=True)
+
+        with open(export_filename) as f:
+            events = [json.loads(line) for line in f][1:]
+
+        # the unchanged first line is stepped over.
+        self.assertEqual(events[1], [0.2, 'o', '\u001b[A\u001b[A\r\nce\r\n'])
+
+    def test_typescript(self):
+        export_filename = '{}/foo.ans'.format(self.tmp_dir.name)
+        self._export(export_filename)
+
+        with open(export_filename, 'rb') as f:
+            header, data = f.read().split(b'\n', 1)
+        with open('{}/foo.timing'.format(self.tmp_dir.name)) as f:
+            timing = [line.split() for line in f]
+
+        self.assertTrue(header.startswith(b'Script started on '))
+        self.assertEqual(data, '#b\ncd\n\u001b[A\u001b[A#b\nce\n{}'.format(ANSI_RESET).encode())
+        self.assertEqual(timing, [
+            ['0.000000', '6'],
+            ['0.200000', '12'],
+            ['0.500000', '4'],
+        ])
+
+
+class TestRenderMarkup(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.display_dirname = self.tmp_dir.name
+        for frame_name, txt in [
+            ('0001', u'\u001b[38;5;196m<a\u001b[38;5;196mb\u001b[0m c'),
+            ('0002', u'\u001b[38;2;255;0;0mx\u001b[48;5;21m \ny'),
+        ]:
+            with open('{}/{}.txt'.format(self.display_dirname, frame_name), 'w') as f:
+                f.write(txt)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_html(self):
+        markup = render_markup(self.display_dirname, '#', 0.1, 'html',
+            frames=[['0001', 0.2], ['0002', 0.5], ['0001', 0.3]])
+
+        # runs are merged, and 196 and truecolor red share a class.
+        self.assertIn('<pre id="k0"><span class="f0">&lt;ab</span> c</pre>', markup)
+        self.assertIn('<pre id="k1"><span class="f0">x</span><span class="f0 b1"> </span>'
+            '\n<span class="f0 b1">y</span></pre>', markup)
+        # only rules for how each color is used.
+        self.assertIn('.f0{color:#ff0000}.b1{background:#0000ff}', markup)
+        self.assertNotIn('.b0', markup)
+        self.assertNotIn('.f1', markup)
+        self.assertEqual(markup.count('<pre'), 2)
+
+        self.assertIn('animation:1s step-end infinite', markup)
+        self.assertIn('@keyframes k0{0%{visibility:visible}20%{visibility:hidden}'
+            '70%{visibility:visible}100%{visibility:hidden}}', markup)
+        self.assertIn('@keyframes k1{20%{visibility:visible}70%{visibility:hidden}}', markup)
+
+    def test_svg(self):
+        markup = render_markup(self.display_dirname, '#', 0.1, 'svg')
+
+        self.assertIn('width="30" height="24"', markup)
+        self.assertIn('<g id="k0"><text class="c0" x="0" y="10" textLength="18">&lt;ab</text>'
+            '<text x="18" y="10" textLength="12"> c</text></g>', markup)
+        self.assertIn('<rect class="c1" x="6" y="0" width="6" height="12"/>', markup)
+        self.assertIn('.c0{fill:#ff0000}', markup)
+        self.assertIn('animation:0.2s step-end infinite', markup)
+
+    def test_export(self):
+        export_filename = '{}/foo.html'.format(self.tmp_dir.name)
+        stdout = io.StringIO()
+
+        export(export_filename, self.display_dirname, stdout, 0.1, 1, {}, cell_char='#')
+
+        self.assertTrue(stdout.getvalue().endswith('Exported to:\n{}\n'.format(export_filename)))
+        with open(export_filename) as f:
+            self.assertTrue(f.read().startswith('<!DOCTYPE html>'))
@@ -0,0 +1,154 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import io
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+from gif_for_cli import instrument
+from gif_for_cli.utils import memoize
+
+
+class InstrumentTestCase(unittest.TestCase):
+    def setUp(self):
+        instrument.reset()
+        instrument.enable()
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.reset()
+
+
+class TestTimers(InstrumentTestCase):
+    def test_timer(self):
+        with instrument.timer('foo'):
+            pass
+        with instrument.timer('foo'):
+            pass
+
+        stats = instrument.get_stats()
+        self.assertEqual(stats['timers']['foo']['calls'], 2)
+        self.assertGreaterEqual(stats['timers']['foo']['seconds'], 0)
+
+    def test_timed(self):
+        @instrument.timed('bar')
+        def bar(n):
+            return n * 2
+
+        self.assertEqual(bar(2), 4)
+        self.assertEqual(bar.__name__, 'bar')
+        self.assertEqual(instrument.get_stats()['timers']['bar']['calls'], 1)
+
+    def test_disabled(self):
+        instrument.disable()
+
+        @instrument.timed('bar')
+        def bar():
+            pass
+
+        bar()
+        with instrument.timer('foo'):
+            pass
+        instrument.count('baz')
+
+        self.assertEqual(instrument.get_stats(), {'timers': {}, 'counters': {}})
+
+
+class TestMemoizeCounters(InstrumentTestCase):
+    def test(self):
+        @memoize
+        def double(n):
+            return n * 2
+
+        double(1)
+        double(1)
+        double(1)
+        double(2)
+
+        report = instrument.get_report()
+        self.assertEqual(report['counters']['memoize:double:hits'], 2)
+        self.assertEqual(report['counters']['memoize:double:misses'], 2)
+        self.assertEqual(report['memo_hit_rates']['double'], 0.5)
+
+
+class TestCallWithStats(InstrumentTestCase):
+    def test(self):
+        def work(item, multiplier):
+            instrument.count('items')
+            with instrument.timer('work'):
+                return item * multiplier
+
+        # stats from before the call aren't sent back.
+        instrument.count('items', 10)
+        result, stats = instrument.call_with_stats(work, 2, multiplier=3)
+
+        self.assertEqual(result, 6)
+        self.assertEqual(stats['counters'], {'items': 1})
+        self.assertEqual(stats['timers']['work']['calls'], 1)
+
+        instrument.reset()
+        instrument.count('items', 10)
+        self.assertEqual(instrument.merge_result((result, stats,)), 6)
+        self.assertEqual(instrument.merge_result((result, stats,)), 6)
+        self.assertEqual(instrument.get_stats()['counters'], {'items': 12})
+        self.assertEqual(instrument.get_stats()['timers']['work']['calls'], 2)
+
+
+class TestProfile(unittest.TestCase):
+    def work(self):
+        with instrument.timer('work'):
+            instrument.count('things', 3)
+
+    def test_stdout(self):
+        stdout = io.StringIO()
+
+        with instrument.profile('-', stdout):
+            self.work()
+
+        self.assertFalse(instrument.enabled)
+        output = stdout.getvalue()
+        self.assertTrue(output.startswith('Profile:\n'))
+        self.assertIn('work', output)
+        self.assertIn('things: 3\n', output)
+
+    def test_json(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'profile.json')
+
+            with instrument.profile(filename, io.StringIO()):
+                self.work()
+
+            with open(filename) as f:
+                report = json.load(f)
+
+        self.assertEqual(report['timers']['work']['calls'], 1)
+        self.assertEqual(report['counters'], {'things': 3})
+
+    def test_cprofile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'profile.prof')
+
+            with instrument.profile(filename, io.StringIO()):
+                self.work()
+
+            stats = pstats.Stats(filename)
+
+        self.assertTrue(any(
+            func[2] == 'work'
+            for func in stats.stats
+        ))
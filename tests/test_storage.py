@@ -0,0 +1,81 @@
+"""
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import tempfile
+import unittest
+
+from gif_for_cli.constants import CODECS
+from gif_for_cli.display import get_txt_frames
+from gif_for_cli.storage import (
+    get_frame_basename,
+    get_frame_filename,
+    read_frame,
+    write_frame,
+)
+
+
+TXT = u'\u001b[38;2;255;0;0m##\u001b[0m\n' * 20
+
+
+class TestFrames(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for codec in CODECS:
+                filename = get_frame_filename(tmp_dir, '0001', codec)
+                write_frame(filename, TXT, codec)
+
+                self.assertEqual(read_frame(filename, codec), TXT)
+                self.assertEqual(get_frame_basename(filename, codec), tmp_dir + '/0001')
+
+    def test_utf8(self):
+        # half blocks and braille, whatever the locale's encoding is.
+        txt = u'\u2580\u28ff\n'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = get_frame_filename(tmp_dir, '0001', 'none')
+            write_frame(filename, txt, 'none')
+
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), txt.encode('utf-8'))
+            self.assertEqual(read_frame(filename, 'none'), txt)
+
+    def test_compressed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sizes = {}
+            for codec in CODECS:
+                filename = get_frame_filename(tmp_dir, '0001', codec)
+                write_frame(filename, TXT, codec)
+                sizes[codec] = os.path.getsize(filename)
+
+        self.assertLess(sizes['zlib'], sizes['none'] / 4)
+        self.assertLess(sizes['lzma'], sizes['none'] / 4)
+
+    def test_filenames(self):
+        self.assertEqual(get_frame_filename('foo', '0001'), 'foo/0001.txt')
+        self.assertEqual(get_frame_filename('foo', '0001', 'zlib'), 'foo/0001.txt.zz')
+        self.assertEqual(get_frame_filename('foo', '0001', 'lzma'), 'foo/0001.txt.xz')
+
+    def test_get_txt_frames(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for frame_name in ['0001', '0002']:
+                write_frame(get_frame_filename(tmp_dir, frame_name, 'zlib'), frame_name, 'zlib')
+            # a plain frame from another codec isn't picked up.
+            write_frame(get_frame_filename(tmp_dir, '0003'), '0003')
+
+            self.assertEqual(list(get_txt_frames(tmp_dir, '#', codec='zlib')), ['0001', '0002'])
+            self.assertEqual(
+                list(get_txt_frames(tmp_dir, '#', [['0002', 0.1]], codec='zlib')),
+                ['0002'],
+            )
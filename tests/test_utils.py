@@ -15,16 +15,22 @@ limitations under the License.
 """
 import argparse
 import io
+import threading
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, MagicMock, Mock
 
+from gif_for_cli import instrument
 from gif_for_cli.utils import (
     _get_default_display_mode,
     _log_frame_progress,
     _pool_type,
+    _sizes_type,
     get_parser,
     get_output_dirnames,
+    get_size_bucket,
     get_sorted_filenames,
+    get_terminal_size,
+    pool_abstraction,
 )
 
 
@@ -68,6 +74,100 @@ class TestLogFrameProgress(unittest.TestCase):
         ])
 
 
+def _work(item, multiplier):
+    instrument.count('items')
+    return item * multiplier
+
+
+@patch('gif_for_cli.utils.Pool')
+class TestPoolAbstraction(unittest.TestCase):
+    def setUp(self):
+        self.mock_pool = MagicMock()
+        self.mock_pool.__enter__.return_value = self.mock_pool
+
+        def mock_result(f, args, kwargs):
+            # the parent's stats aren't visible from a worker process.
+            parent_stats = instrument.get_stats()
+            m = Mock()
+            m.get.return_value = f(*args, **kwargs)
+            instrument.reset()
+            instrument.merge_stats(parent_stats)
+            return m
+        self.mock_pool.apply_async = mock_result
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.reset()
+
+    def test_stats_are_aggregated(self, mock_Pool):
+        mock_Pool.return_value = self.mock_pool
+        instrument.reset()
+        instrument.enable()
+
+        results = []
+        with patch('gif_for_cli.utils._log_frame_progress') as mock_log_frame_progress:
+            mock_log_frame_progress.side_effect = lambda total, r, stdout: results.extend(r)
+            pool_abstraction(_work, [1, 2, 3], 2, io.StringIO(), multiplier=2)
+
+        self.assertEqual(results, [2, 4, 6])
+        self.assertEqual(instrument.get_stats()['counters'], {'items': 3})
+
+    def test_on_result(self, mock_Pool):
+        mock_Pool.return_value = self.mock_pool
+
+        for pool_size in [1, 2]:
+            on_result = Mock()
+            pool_abstraction(_work, [1, 2, 3], pool_size, io.StringIO(), on_result=on_result,
+                multiplier=2)
+
+            self.assertEqual([call[0][0] for call in on_result.call_args_list], [2, 4, 6])
+
+    @patch('gif_for_cli.utils.get_context')
+    def test_spawned_off_main_thread(self, mock_get_context, mock_Pool):
+        mock_get_context.return_value.Pool.return_value = self.mock_pool
+
+        thread = threading.Thread(target=pool_abstraction,
+            args=(_work, [1, 2, 3], 2, io.StringIO()), kwargs={'multiplier': 2})
+        thread.start()
+        thread.join()
+
+        # other threads may hold locks a fork would copy.
+        self.assertEqual(mock_get_context.call_args[0], ('spawn',))
+        self.assertEqual(mock_Pool.call_count, 0)
+
+    def test_max_pending(self, mock_Pool):
+        mock_Pool.return_value = self.mock_pool
+        events = []
+
+        def apply_async(f, args, kwargs):
+            m = Mock()
+
+            def get():
+                events.append('done {}'.format(args[0]))
+                return f(*args, **kwargs)
+            m.get.side_effect = get
+            return m
+        self.mock_pool.apply_async = apply_async
+
+        def items():
+            for item in [1, 2, 3, 4]:
+                events.append('take {}'.format(item))
+                yield item
+
+        on_result = Mock()
+        pool_abstraction(_work, items(), 2, io.StringIO(), on_result=on_result, max_pending=2,
+            total=4, multiplier=2)
+
+        self.assertEqual([call[0][0] for call in on_result.call_args_list], [2, 4, 6, 8])
+        # an item is only taken once there's room for it.
+        self.assertEqual(events, [
+            'take 1', 'take 2', 'done 1',
+            'take 3', 'done 2',
+            'take 4', 'done 3',
+            'done 4',
+        ])
+
+
 class TestPoolType(unittest.TestCase):
     def test_none(self):
         self.assertIsNone(_pool_type(None))
@@ -80,6 +180,19 @@ class TestPoolType(unittest.TestCase):
             _pool_type('0')
 
 
+class TestSizesType(unittest.TestCase):
+    def test(self):
+        self.assertEqual(_sizes_type('80x20,240X60'), [(80, 20,), (240, 60,)])
+
+    def test_bad_format(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            _sizes_type('80')
+
+    def test_0(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            _sizes_type('0x20')
+
+
 class TestGetParser(unittest.TestCase):
     def test(self):
         parser = get_parser({})
@@ -87,6 +200,45 @@ class TestGetParser(unittest.TestCase):
         self.assertIsNotNone(parser)
 
 
+class TestGetTerminalSize(unittest.TestCase):
+    def test_not_a_terminal(self):
+        self.assertIsNone(get_terminal_size(io.StringIO(), {}))
+
+    def test_environ(self):
+        self.assertEqual(
+            get_terminal_size(io.StringIO(), {'COLUMNS': '100', 'LINES': '30'}),
+            (100, 30,),
+        )
+
+    @patch('os.get_terminal_size')
+    def test_terminal(self, mock_get_terminal_size):
+        mock_get_terminal_size.return_value = Mock(columns=200, lines=60)
+        stdout = Mock()
+
+        self.assertEqual(get_terminal_size(stdout, {}), (200, 60,))
+        self.assertEqual(mock_get_terminal_size.call_args[0][0], stdout.fileno.return_value)
+
+    @patch('os.get_terminal_size')
+    def test_environ_overrides_terminal(self, mock_get_terminal_size):
+        mock_get_terminal_size.return_value = Mock(columns=200, lines=60)
+
+        self.assertEqual(get_terminal_size(Mock(), {'COLUMNS': '100', 'LINES': '30'}),
+            (100, 30,))
+        # each is overridden on its own.
+        self.assertEqual(get_terminal_size(Mock(), {'LINES': '30'}), (200, 30,))
+
+
+class TestGetSizeBucket(unittest.TestCase):
+    def test(self):
+        self.assertEqual(get_size_bucket((80, 24,)), (80, 20,))
+        self.assertEqual(get_size_bucket((100, 60,)), (80, 20,))
+        self.assertEqual(get_size_bucket((250, 61,)), (240, 60,))
+        self.assertEqual(get_size_bucket((1000, 1000,)), (320, 80,))
+
+    def test_smaller_than_smallest_bucket(self):
+        self.assertEqual(get_size_bucket((20, 5,)), (40, 10,))
+
+
 class TestGetOutputDirnames(unittest.TestCase):
     def test(self):
         output_dirnames = get_output_dirnames(
@@ -107,6 +259,66 @@ class TestGetOutputDirnames(unittest.TestCase):
         self.assertEqual(output_dirnames['256'], dirname + '/256')
         self.assertEqual(output_dirnames['truecolor'], dirname + '/truecolor')
 
+    def test_color_space(self):
+        output_dirnames = get_output_dirnames(
+            '/home/foo',
+            '0.0.0',
+            '2094cb18c10ddb47dbe239ddbd702cc0',
+            160,
+            140,
+            3,
+            6,
+            'oklab',
+        )
+
+        self.assertTrue(output_dirnames['.'].endswith('-160cols-140rows-cw3px-ch6px-oklab'))
+        self.assertTrue(output_dirnames['256'].endswith('-oklab/256'))
+
+    def test_area_scale(self):
+        output_dirnames = get_output_dirnames(
+            '/home/foo',
+            '0.0.0',
+            '2094cb18c10ddb47dbe239ddbd702cc0',
+            160,
+            140,
+            3,
+            6,
+            'oklab',
+            area_scale=True,
+        )
+
+        self.assertTrue(output_dirnames['.'].endswith('-cw3px-ch6px-oklab-area'))
+
+    def test_equalize(self):
+        output_dirnames = get_output_dirnames(
+            '/home/foo',
+            '0.0.0',
+            '2094cb18c10ddb47dbe239ddbd702cc0',
+            160,
+            140,
+            3,
+            6,
+            equalize='clip',
+        )
+
+        self.assertTrue(output_dirnames['.'].endswith('-cw3px-ch6px-equalize-clip'))
+
+    def test_dither(self):
+        output_dirnames = get_output_dirnames('/home/foo', '0.0.0', 'abcdef', 160, 40, 3, 6,
+            equalize='clip', dither='bayer')
+
+        self.assertTrue(output_dirnames['.'].endswith('-cw3px-ch6px-equalize-clip-dither-bayer'))
+
+    def test_window(self):
+        def get_suffix(**options):
+            output_dirnames = get_output_dirnames('/home/foo', '0.0.0', 'abcdef', 160, 40, 3, 6,
+                **options)
+            return output_dirnames['.'].split('-ch6px')[1]
+
+        self.assertEqual(get_suffix(start=0), '')
+        self.assertEqual(get_suffix(start=1.5, duration=3), '-from1.5s-for3s')
+        self.assertEqual(get_suffix(duration=0.25), '-for0.25s')
+
 
 @patch('os.scandir')
 class TestGetSortedFilenames(unittest.TestCase):